@@ -4,19 +4,43 @@
 This file defines a minimal, professional inference skeleton with:
 - config loading
 - explicit output directory
+- in-process 2.5D inference: each stack is z-resampled plane by plane into a
+  ring buffer of 2k+1 planes and clamped channel windows are fed in batches to
+  a pluggable predictor, whose outputs are written straight into the
+  prediction stack (no per-slice input or output TIFFs)
+- optional XY tiling (`inference.tiling`): planes larger than the model patch
+  are cut into overlapping tiles, batched across planes and blended with
+  Gaussian/cosine weights (tools/common/tiling.py)
 - placeholder for post-processing and metrics export
+
+Predictor: `inference.predictor` is "module:factory" (factory(config) returns a
+callable mapping (batch, 2k+1, y, x) windows to (batch, y, x) predictions), or
+one of the CPU dry-run predictors in DUMMY_PREDICTORS.
 """
 
 from __future__ import annotations
 
 import argparse
+import glob
+import importlib
 import json
+import os
+import sys
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List
 
+import numpy as np
 import yaml
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "tools" / "common"))
+from catalog import unique_case_id  # noqa: E402
+from ome_meta import SpacingService  # noqa: E402
+from plane_stream import Predictor, stream_predict  # noqa: E402
+from tiling import TiledPredictor  # noqa: E402
+from volume_io import STACK_FORMATS, VolumeReader, volume_suffix, write_volume  # noqa: E402
+from zresample import iter_resampled_planes, resampled_depth  # noqa: E402
+
 
 def load_config(path: str) -> Dict[str, Any]:
     with open(path, "r", encoding="utf-8") as f:
@@ -37,10 +61,165 @@ class Context:
     root_dir: Path
 
 
+def _identity_predictor(config: Dict[str, Any]) -> Predictor:
+    """Centre channel unchanged; output == resampled stack (pipeline check)."""
+
+    def predict(batch: np.ndarray) -> np.ndarray:
+        return batch[:, batch.shape[1] // 2]
+
+    return predict
+
+
+def _threshold_predictor(config: Dict[str, Any]) -> Predictor:
+    """Channel-mean above a fraction of the dtype range -> {0, 1} mask."""
+    frac = float(config.get("inference", {}).get("dummy_threshold", 0.5))
+
+    def predict(batch: np.ndarray) -> np.ndarray:
+        top = np.iinfo(batch.dtype).max if np.issubdtype(batch.dtype, np.integer) else 1.0
+        return (batch.mean(axis=1) > frac * top).astype(np.uint8)
+
+    return predict
+
+
+DUMMY_PREDICTORS: Dict[str, Callable[[Dict[str, Any]], Predictor]] = {
+    "identity": _identity_predictor,
+    "threshold": _threshold_predictor,
+}
+
+
+def load_predictor(config: Dict[str, Any]) -> Predictor:
+    cfg = config.get("inference", {})
+    spec = str(cfg.get("predictor", "identity"))
+    if spec in DUMMY_PREDICTORS:
+        predictor = DUMMY_PREDICTORS[spec](config)
+    else:
+        module, _, attr = spec.partition(":")
+        if not attr:
+            raise ValueError(
+                f"inference.predictor must be 'module:factory' or one of {sorted(DUMMY_PREDICTORS)}: {spec!r}"
+            )
+        predictor = getattr(importlib.import_module(module), attr)(config)
+    tiling = cfg.get("tiling") or {}
+    if tiling.get("enabled", False):
+        # the predictor now sees (n, 2k+1, tile_y, tile_x) patches
+        predictor = TiledPredictor(
+            predictor,
+            tile=tiling.get("tile") or config.get("model", {}).get("input_size", (512, 512)),
+            overlap=tiling.get("overlap", 0.25),
+            tile_batch=int(tiling.get("tile_batch", 8)),
+            blend=str(tiling.get("blend", "gaussian")),
+        )
+    return predictor
+
+
+def _resolve(path: str, base: Path) -> Path:
+    p = Path(path)
+    return p if p.is_absolute() else (base / p).resolve()
+
+
+def predict_stack(
+    path: Path,
+    case_id: str,
+    out_dir: Path,
+    predictor: Predictor,
+    spacing: SpacingService,
+    cfg: Dict[str, Any],
+) -> dict:
+    """Stream one stack through resampler -> window ring -> predictor -> prediction stack.
+
+    The source dz comes from the OME metadata (or a sibling stack), else from
+    ``inference.source_dz``; without either the stack is skipped as
+    ``missing_dz``, like the prep scripts do, instead of running on its native
+    z grid.
+    """
+    target_dz = float(cfg.get("target_dz", 0.396))
+    k = int(cfg.get("k", 3))
+    fmt = str(cfg.get("stack_format", "tiff"))
+    out_dtype = np.dtype(cfg.get("output_dtype", "uint8"))
+    if fmt not in STACK_FORMATS:
+        raise ValueError(f"inference.stack_format must be one of {STACK_FORMATS}")
+    dz = spacing.dz_with_sibling_fallback(path) if path.is_file() else None
+    if dz is None and cfg.get("source_dz") is not None:
+        dz = float(cfg["source_dz"])
+    if dz is None:
+        return {"id": case_id, "source_path": str(path), "status": "skipped", "reason": "missing_dz"}
+    sp = spacing.spacing(path) if path.is_file() else None
+    with VolumeReader(path) as reader:
+        z, y, x = reader.shape
+        new_z = resampled_depth(z, dz, target_dz)
+        planes = iter_resampled_planes(reader, new_z)
+        preds = stream_predict(
+            planes,
+            new_z,
+            k,
+            predictor,
+            batch_size=int(cfg.get("batch_size", 2)),
+            out_dtype=out_dtype,
+        )
+        out_path = out_dir / f"{case_id}_pred{volume_suffix(fmt)}"
+        write_volume(
+            out_path,
+            preds,
+            (new_z, y, x),
+            out_dtype,
+            fmt=fmt,
+            spacing=(target_dz, sp.dy if sp else None, sp.dx if sp else None),
+        )
+    # same record as the prep scripts' meta JSON
+    meta = {
+        "id": case_id,
+        "source_path": str(path),
+        "dz_original": dz,
+        "dz_target": target_dz,
+        "z_original": int(z),
+        "z_resampled": int(new_z),
+        "resample_ratio": float(dz / target_dz),
+        "dx": sp.dx if sp else None,
+        "dy": sp.dy if sp else None,
+        "prediction_stack": str(out_path),
+        "stack_format": fmt,
+        "k": k,
+    }
+    (out_dir / "meta").mkdir(parents=True, exist_ok=True)
+    with open(out_dir / "meta" / f"{case_id}.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
 def infer(ctx: Context) -> None:
-    # TODO: implement model loading, inference loop, output writing.
     # Write predictions to data/06_inference/<method_name>/
-    raise NotImplementedError("Inference logic not implemented yet.")
+    cfg = ctx.config.get("inference", {})
+    paths = ctx.config.get("paths", {})
+    out_dir = _resolve(paths.get("inference_dir", f"../../data/06_inference/{ctx.method_dir.name}"), ctx.method_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    inputs: List[Path] = []
+    for pattern in cfg.get("inputs", []):
+        matches = sorted(glob.glob(str(_resolve(pattern, ctx.method_dir))))
+        if not matches:
+            raise FileNotFoundError(f"inference.inputs matched nothing: {pattern}")
+        inputs.extend(Path(m) for m in matches)
+    if not inputs:
+        raise ValueError("inference.inputs lists no stacks to predict")
+
+    predictor = load_predictor(ctx.config)
+    spacing = SpacingService(out_dir / "ome_spacing_cache.json")
+    # case ids as in the bulk prep / catalog: file stem, directory prefix on collisions
+    base = Path(os.path.commonpath([str(p.parent) for p in inputs]))
+    seen: Dict[str, int] = {}
+    ids = [unique_case_id(p.stem, p.relative_to(base), seen) for p in inputs]
+    results = [predict_stack(p, cid, out_dir, predictor, spacing, cfg) for p, cid in zip(inputs, ids)]
+    spacing.save()
+    manifest = [r for r in results if r.get("status") != "skipped"]
+    skipped = [r for r in results if r.get("status") == "skipped"]
+    for r in skipped:
+        print(f"[WARN] skipped {r['source_path']}: {r['reason']} (set inference.source_dz to force a dz)")
+    # TODO: method-specific post-processing and metrics export.
+    with open(out_dir / "manifest_inference.json", "w", encoding="utf-8") as f:
+        json.dump(
+            {"predictor": cfg.get("predictor", "identity"), "stacks": manifest, "skipped": skipped}, f, indent=2
+        )
+    print(f"predicted {len(manifest)} stacks (skipped {len(skipped)}) -> {out_dir}")
 
 
 def main() -> None:
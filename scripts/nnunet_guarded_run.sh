@@ -9,6 +9,7 @@ LOG_FILE=""
 STATUS_TSV=""
 REPORT_JSON=""
 HEARTBEAT_SEC=30
+SAMPLE_SEC="${SAMPLE_SEC:-0.5}"
 MODE="hybrid"
 ADAPTER=""
 PRECHECK_PY=""
@@ -16,7 +17,7 @@ PRECHECK_PY=""
 usage() {
   cat <<EOF
 Usage:
-  $(basename "$0") --contract <json> --log <log_file> --status-tsv <tsv_file> [--adapter nnunet|dbt] [--report <json>] [--mode hybrid|strict|warn] [--heartbeat-sec 30] -- <command...>
+  $(basename "$0") --contract <json> --log <log_file> --status-tsv <tsv_file> [--adapter nnunet|dbt] [--report <json>] [--mode hybrid|strict|warn] [--heartbeat-sec 30] [--sample-sec 0.5] -- <command...>
 EOF
 }
 
@@ -28,6 +29,7 @@ while [[ $# -gt 0 ]]; do
     --adapter) ADAPTER="$2"; shift 2 ;;
     --report) REPORT_JSON="$2"; shift 2 ;;
     --heartbeat-sec) HEARTBEAT_SEC="$2"; shift 2 ;;
+    --sample-sec) SAMPLE_SEC="$2"; shift 2 ;;
     --mode) MODE="$2"; shift 2 ;;
     --) shift; break ;;
     -h|--help) usage; exit 0 ;;
@@ -87,6 +89,7 @@ status_log() {
 echo -e "timestamp\tevent\tphase\tpid\texit_code\tmessage" > "${STATUS_TSV}"
 
 CHILD_PID=""
+MONITOR_PID=""
 CURRENT_PHASE="bootstrap"
 IN_EXIT_HANDLER=0
 
@@ -109,6 +112,10 @@ on_exit() {
     status_log "child_cleanup" "${CURRENT_PHASE}" "${CHILD_PID}" "" "kill_on_exit"
     kill -TERM "${CHILD_PID}" 2>/dev/null || true
   fi
+  if [[ -n "${MONITOR_PID}" ]] && kill -0 "${MONITOR_PID}" 2>/dev/null; then
+    kill -TERM "${MONITOR_PID}" 2>/dev/null || true
+    wait "${MONITOR_PID}" 2>/dev/null || true
+  fi
   status_log "script_exit" "${CURRENT_PHASE}" "${CHILD_PID:-}" "${rc}" "guarded_run_finished"
   exit "${rc}"
 }
@@ -134,21 +141,30 @@ CURRENT_PHASE="run"
 CHILD_PID=$!
 status_log "child_start" "${CURRENT_PHASE}" "${CHILD_PID}" "" "started"
 
+# process-tree sampler: heartbeat rows in status.tsv, <status>_resources.tsv time series,
+# <status>_resources.json peak/percentile summary at exit
+python3 "${GUARDRAILS_DIR}/resource_monitor.py" \
+  --pid "${CHILD_PID}" \
+  --status-tsv "${STATUS_TSV}" \
+  --phase "${CURRENT_PHASE}" \
+  --interval "${SAMPLE_SEC}" \
+  --heartbeat-sec "${HEARTBEAT_SEC}" \
+  --gpu >> "${LOG_FILE}" 2>&1 &
+MONITOR_PID=$!
+
 while kill -0 "${CHILD_PID}" 2>/dev/null; do
-  rss_kb="$(awk '/VmRSS:/ {print $2}' "/proc/${CHILD_PID}/status" 2>/dev/null || true)"
-  gpu_mib=""
-  if command -v nvidia-smi >/dev/null 2>&1; then
-    gpu_mib="$(nvidia-smi --query-compute-apps=pid,used_gpu_memory --format=csv,noheader,nounits 2>/dev/null \
-      | awk -F',' -v p="${CHILD_PID}" '{gsub(/ /,"",$1); gsub(/ /,"",$2); if($1==p){print $2; exit}}' || true)"
+  # wait returns early when a trapped signal arrives, so TERM/INT are handled promptly
+  if kill -0 "${MONITOR_PID}" 2>/dev/null; then
+    wait "${MONITOR_PID}" 2>/dev/null || true
+  else
+    sleep 1
   fi
-  status_log "heartbeat" "${CURRENT_PHASE}" "${CHILD_PID}" "" "rss_kb=${rss_kb:-na};gpu_mib=${gpu_mib:-na}"
-  sleep "${HEARTBEAT_SEC}"
 done
 
 rc=0
-if ! wait "${CHILD_PID}"; then
-  rc=$?
-fi
+wait "${CHILD_PID}" || rc=$?
 status_log "child_exit" "${CURRENT_PHASE}" "${CHILD_PID}" "${rc}" "finished"
 CHILD_PID=""
+wait "${MONITOR_PID}" 2>/dev/null || true
+MONITOR_PID=""
 exit "${rc}"
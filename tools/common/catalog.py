@@ -0,0 +1,378 @@
+"""
+SQLite catalog of raw stacks, their geometry and derived artifacts.
+
+Tables:
+- stacks:    one row per source stack (path, root, rel_path, size, mtime_ns,
+             z/y/x, dtype, dx/dy/dz, sibling dz fallback, case id)
+- dirs:      scanned directories with mtime_ns and their listing, so a refresh
+             only re-lists directories whose mtime changed
+- artifacts: derived files per case id (resampled stack, meta JSON, inputs,
+             predictions, ...) as (case_id, kind, path, params JSON)
+
+Refreshing a root stats every known stack and opens headers only for new or
+changed files; case ids are assigned exactly like the bulk inference prep
+(sorted paths, stem, directory prefix on collisions, stacks without any dz
+get none). Tools query the catalog instead of rglob-ing and opening headers:
+
+  python tools/common/catalog.py refresh --root /dfs/snout/Histology/RND2412
+  python tools/common/catalog.py list --root /dfs/snout/Histology/RND2412 --format tsv
+
+Scripts import it with
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+"""
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import tifffile as tiff
+
+from ome_meta import parse_ome_spacing
+
+SCHEMA_VERSION = 1
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_DB = Path(os.environ.get("MYELIN_CATALOG") or PROJECT_ROOT / "data" / "catalog.sqlite")
+DEFAULT_PATTERN = "*.ome.tif"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT NOT NULL, pattern TEXT NOT NULL, root TEXT NOT NULL, mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL, files TEXT NOT NULL, PRIMARY KEY (path, pattern)
+);
+CREATE TABLE IF NOT EXISTS stacks (
+    path TEXT PRIMARY KEY, root TEXT NOT NULL, rel_path TEXT NOT NULL, name TEXT NOT NULL,
+    size INTEGER, mtime_ns INTEGER, z INTEGER, y INTEGER, x INTEGER, dtype TEXT,
+    dx REAL, dy REAL, dz REAL, dz_fallback REAL, case_id TEXT, error TEXT
+);
+CREATE INDEX IF NOT EXISTS stacks_root ON stacks(root);
+CREATE INDEX IF NOT EXISTS stacks_case ON stacks(case_id);
+CREATE INDEX IF NOT EXISTS stacks_name ON stacks(name);
+CREATE TABLE IF NOT EXISTS artifacts (
+    case_id TEXT NOT NULL, kind TEXT NOT NULL, path TEXT NOT NULL, params TEXT, created REAL,
+    PRIMARY KEY (case_id, kind, path)
+);
+CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts(kind);
+"""
+
+
+def unique_case_id(stem: str, rel_path: Path, seen: Dict[str, int]) -> str:
+    if stem not in seen:
+        seen[stem] = 1
+        return stem
+    # collision: include directory path
+    safe = re.sub(r"[^A-Za-z0-9_\\-]", "_", str(rel_path.parent))
+    cid = f"{safe}__{stem}"
+    seen[cid] = 1
+    return cid
+
+
+@dataclass
+class StackRecord:
+    path: str
+    root: str
+    rel_path: str
+    name: str
+    size: Optional[int] = None
+    mtime_ns: Optional[int] = None
+    z: Optional[int] = None
+    y: Optional[int] = None
+    x: Optional[int] = None
+    dtype: Optional[str] = None
+    dx: Optional[float] = None
+    dy: Optional[float] = None
+    dz: Optional[float] = None
+    dz_fallback: Optional[float] = None
+    case_id: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def dz_effective(self) -> Optional[float]:
+        """dz of the stack, else of the first sibling in its directory that has one."""
+        return self.dz if self.dz is not None else self.dz_fallback
+
+
+_COLUMNS = [f.name for f in fields(StackRecord)]
+
+
+@dataclass
+class RefreshStats:
+    dirs_listed: int = 0
+    dirs_reused: int = 0
+    headers_read: int = 0
+    stacks_reused: int = 0
+    removed: int = 0
+    seconds: float = 0.0
+
+
+def read_header(path: str) -> dict:
+    """Geometry and spacing of one stack from its TIFF header and OME-XML (no pixel data)."""
+    try:
+        with tiff.TiffFile(path) as tf:
+            series = tf.series[0]
+            shape = tuple(series.shape)
+            dtype = str(series.dtype)
+            spacing = parse_ome_spacing(tf.ome_metadata)
+    except Exception as exc:
+        return {"error": f"read_error: {type(exc).__name__}"}
+    if len(shape) == 2:
+        shape = (1, *shape)
+    z = 1
+    for n in shape[:-2]:
+        z *= int(n)
+    return {
+        "z": z,
+        "y": int(shape[-2]),
+        "x": int(shape[-1]),
+        "dtype": dtype,
+        "dx": spacing.dx if spacing else None,
+        "dy": spacing.dy if spacing else None,
+        "dz": spacing.dz if spacing else None,
+        "error": None,
+    }
+
+
+class Catalog:
+    """Indexed catalog backed by one SQLite file; safe to share between tools (WAL mode)."""
+
+    def __init__(self, db_path: Path = DEFAULT_DB) -> None:
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # -- scanning -----------------------------------------------------------
+
+    def _walk(self, root: str, pattern: str, stats: RefreshStats) -> List[str]:
+        """Matching files under root; directories with an unchanged mtime reuse their stored listing."""
+        known = {
+            row[0]: (row[1], json.loads(row[2]), json.loads(row[3]))
+            for row in self.conn.execute(
+                "SELECT path, mtime_ns, subdirs, files FROM dirs WHERE root = ? AND pattern = ?", (root, pattern)
+            )
+        }
+        found: List[str] = []
+        visited: List[str] = []
+        updates: List[tuple] = []
+        pending = [root]
+        while pending:
+            d = pending.pop()
+            try:
+                mtime = os.stat(d).st_mtime_ns
+            except OSError:
+                continue
+            visited.append(d)
+            prev = known.get(d)
+            if prev is not None and prev[0] == mtime:
+                subdirs, names = prev[1], prev[2]
+                stats.dirs_reused += 1
+            else:
+                subdirs, names = [], []
+                try:
+                    with os.scandir(d) as it:
+                        for e in it:
+                            try:
+                                if e.is_dir(follow_symlinks=False):
+                                    subdirs.append(e.name)
+                                elif fnmatch.fnmatch(e.name, pattern):
+                                    names.append(e.name)
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+                subdirs.sort()
+                names.sort()
+                updates.append((d, pattern, root, mtime, json.dumps(subdirs), json.dumps(names)))
+                stats.dirs_listed += 1
+            pending.extend(os.path.join(d, s) for s in subdirs)
+            found.extend(os.path.join(d, n) for n in names)
+        self.conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?)", updates)
+        gone = set(known) - set(visited)
+        self.conn.executemany("DELETE FROM dirs WHERE path = ? AND pattern = ?", [(d, pattern) for d in gone])
+        return found
+
+    def refresh(
+        self, root: Path, pattern: str = DEFAULT_PATTERN, workers: int = 8, stat_files: bool = True
+    ) -> RefreshStats:
+        """Bring the rows under ``root`` up to date; ``stat_files=False`` trusts existing rows (new files only)."""
+        t0 = time.time()
+        stats = RefreshStats()
+        root_s = str(Path(root).resolve())
+        paths = self._walk(root_s, pattern, stats)
+        rows = {r.path: r for r in self.stacks(root=root_s)}
+
+        def _stat(p: str) -> Tuple[str, Optional[os.stat_result]]:
+            try:
+                return p, os.stat(p)
+            except OSError:
+                return p, None
+
+        todo: List[StackRecord] = []
+        keep: List[StackRecord] = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            if stat_files:
+                stat_results = list(ex.map(_stat, paths))
+            else:
+                stat_results = [(p, None) if p in rows else _stat(p) for p in paths]
+            for p, st in stat_results:
+                prev = rows.get(p)
+                if st is None:
+                    if prev is not None and not stat_files:
+                        keep.append(prev)
+                    continue
+                if prev is not None and (prev.size, prev.mtime_ns) == (st.st_size, st.st_mtime_ns):
+                    keep.append(prev)
+                    continue
+                rel = os.path.relpath(p, root_s)
+                todo.append(StackRecord(p, root_s, rel, os.path.basename(p), st.st_size, st.st_mtime_ns))
+            headers = list(ex.map(read_header, [r.path for r in todo]))
+        for rec, hdr in zip(todo, headers):
+            for k, v in hdr.items():
+                setattr(rec, k, v)
+        stats.headers_read = len(todo)
+        stats.stacks_reused = len(keep)
+
+        records = keep + todo
+        current = {r.path for r in records}
+        stale = [p for p in rows if p not in current]
+        stats.removed = len(stale)
+        self.conn.executemany("DELETE FROM stacks WHERE path = ?", [(p,) for p in stale])
+
+        # sibling dz fallback, then case ids in the bulk prep's order (sorted paths, stacks with a dz only)
+        records.sort(key=lambda r: Path(r.path))
+        by_dir: Dict[str, float] = {}
+        for r in records:
+            if r.dz is not None:
+                by_dir.setdefault(os.path.dirname(r.path), r.dz)
+        seen: Dict[str, int] = {}
+        for r in records:
+            r.dz_fallback = by_dir.get(os.path.dirname(r.path)) if r.dz is None else None
+            rel = Path(r.rel_path)
+            r.case_id = unique_case_id(Path(r.path).stem, rel, seen) if r.dz_effective is not None else None
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO stacks ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            [tuple(getattr(r, c) for c in _COLUMNS) for r in records],
+        )
+        self.conn.commit()
+        stats.seconds = round(time.time() - t0, 3)
+        return stats
+
+    # -- queries ------------------------------------------------------------
+
+    def stacks(self, root: Optional[Path] = None) -> List[StackRecord]:
+        """Stacks (under ``root`` if given) sorted by path, as the bulk prep's rglob + sort."""
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM stacks"
+        args: tuple = ()
+        if root is not None:
+            sql += " WHERE root = ?"
+            args = (str(Path(root).resolve()),)
+        recs = [StackRecord(*row) for row in self.conn.execute(sql, args)]
+        return sorted(recs, key=lambda r: Path(r.path))
+
+    def find(self, case_id: Optional[str] = None, name: Optional[str] = None) -> List[StackRecord]:
+        """Stacks by case id or by file name (e.g. ``<id>.ome.tif``)."""
+        if case_id is not None:
+            where, arg = "case_id = ?", case_id
+        elif name is not None:
+            where, arg = "name = ?", name
+        else:
+            raise ValueError("find() needs case_id or name")
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM stacks WHERE {where} ORDER BY path"
+        return [StackRecord(*row) for row in self.conn.execute(sql, (arg,))]
+
+    def add_artifacts(self, items: Iterable[Tuple[str, str, Path, Optional[dict]]]) -> None:
+        """Record (case_id, kind, path, params) derived artifacts; re-recording a path updates it."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+            [
+                (cid, kind, str(Path(path).resolve()), json.dumps(params) if params else None, now)
+                for cid, kind, path, params in items
+            ],
+        )
+        self.conn.commit()
+
+    def artifacts(
+        self, case_id: Optional[str] = None, kind: Optional[str] = None, under: Optional[Path] = None
+    ) -> List[dict]:
+        sql = "SELECT case_id, kind, path, params, created FROM artifacts WHERE 1 = 1"
+        args: list = []
+        if case_id is not None:
+            sql += " AND case_id = ?"
+            args.append(case_id)
+        if kind is not None:
+            sql += " AND kind = ?"
+            args.append(kind)
+        if under is not None:
+            sql += " AND path LIKE ? ESCAPE '\\'"
+            prefix = str(Path(under).resolve()).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            args.append(prefix + os.sep + "%")
+        sql += " ORDER BY case_id, kind, path"
+        return [
+            {"case_id": c, "kind": k, "path": p, "params": json.loads(pr) if pr else None, "created": t}
+            for c, k, p, pr, t in self.conn.execute(sql, args)
+        ]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Dataset catalog of raw stacks and derived artifacts")
+    ap.add_argument("--db", default=str(DEFAULT_DB), help="Catalog SQLite (default: $MYELIN_CATALOG or data/catalog.sqlite)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_ref = sub.add_parser("refresh", help="Incrementally (re)index the stacks under a root")
+    p_ref.add_argument("--root", required=True, nargs="+")
+    p_ref.add_argument("--pattern", default=DEFAULT_PATTERN)
+    p_ref.add_argument("--workers", type=int, default=8, help="Threads for stat and header reads")
+    p_ref.add_argument("--quick", action="store_true", help="Only stat new files; trust the stored size/mtime of known stacks")
+    p_list = sub.add_parser("list", help="Print catalogued stacks")
+    p_list.add_argument("--root", default=None)
+    p_list.add_argument("--case-id", default=None)
+    p_list.add_argument("--format", choices=["tsv", "json"], default="tsv")
+    p_art = sub.add_parser("artifacts", help="Print derived artifacts")
+    p_art.add_argument("--case-id", default=None)
+    p_art.add_argument("--kind", default=None)
+    args = ap.parse_args()
+
+    with Catalog(Path(args.db)) as cat:
+        if args.cmd == "refresh":
+            for root in args.root:
+                st = cat.refresh(Path(root), args.pattern, args.workers, stat_files=not args.quick)
+                print(f"{root}: " + " ".join(f"{k}={v}" for k, v in asdict(st).items()))
+        elif args.cmd == "list":
+            recs = cat.find(case_id=args.case_id) if args.case_id else cat.stacks(root=args.root)
+            if args.format == "json":
+                print(json.dumps([asdict(r) for r in recs], indent=2))
+            else:
+                cols = ["case_id", "z", "y", "x", "dtype", "dx", "dy", "dz", "dz_fallback", "path"]
+                print("\t".join(cols))
+                for r in recs:
+                    print("\t".join("" if getattr(r, c) is None else str(getattr(r, c)) for c in cols))
+        else:
+            for a in cat.artifacts(case_id=args.case_id, kind=args.kind):
+                print(f"{a['case_id']}\t{a['kind']}\t{a['path']}\t{json.dumps(a['params']) if a['params'] else ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+Connected components of a volume processed in z-slabs.
+
+Each slab is labelled on its own (scipy.ndimage.label); labels are made
+globally unique by offsetting, and components that continue across a slab
+boundary are merged with a union-find table built from the two boundary
+planes. Memory is bounded by the slab size.
+
+label_components / iter_filtered_planes do the same for a volume file on a
+process pool: slabs are labelled in parallel (a window of in-flight slabs
+keeps memory at about workers x slab), per-component voxel counts, bounding
+boxes and centroids are merged through the union-find roots, and a second
+pass re-labels each slab (ndimage.label is deterministic) to drop or number
+components plane by plane, so no label volume is ever stored.
+
+Scripts import it with
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+"""
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import product
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+from volume_io import VolumeReader
+
+ReadBlock = Callable[[int, int], np.ndarray]
+
+
+class UnionFind:
+    """Union-find over integer ids 0..n-1 (grows on demand), with path halving."""
+
+    def __init__(self, n: int = 0) -> None:
+        self.parent = np.arange(n, dtype=np.int64)
+
+    def grow(self, n: int) -> None:
+        if n > len(self.parent):
+            self.parent = np.concatenate([self.parent, np.arange(len(self.parent), n, dtype=np.int64)])
+
+    def find(self, a: int) -> int:
+        parent = self.parent
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return int(a)
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # smaller id wins so roots are stable (first occurrence in z order)
+            if rb < ra:
+                ra, rb = rb, ra
+            self.parent[rb] = ra
+
+    def union_pairs(self, pairs: np.ndarray) -> None:
+        for a, b in np.unique(pairs, axis=0) if len(pairs) else ():
+            self.union(int(a), int(b))
+
+    def roots(self) -> np.ndarray:
+        """Root of every id, by vectorized pointer jumping."""
+        p = self.parent
+        while True:
+            pp = p[p]
+            if np.array_equal(pp, p):
+                return p.copy()
+            p = pp
+
+
+def structure(connectivity: int) -> np.ndarray:
+    if connectivity == 26:
+        return np.ones((3, 3, 3), dtype=bool)
+    if connectivity == 6:
+        return ndimage.generate_binary_structure(3, 1)
+    raise ValueError("connectivity must be 6 or 26")
+
+
+def _plane_offsets(connectivity: int) -> List[Tuple[int, int]]:
+    return list(product((-1, 0, 1), repeat=2)) if connectivity == 26 else [(0, 0)]
+
+
+def boundary_pairs(prev_plane: np.ndarray, next_plane: np.ndarray, connectivity: int) -> np.ndarray:
+    """(label in prev_plane, label in next_plane) pairs of voxels connected across the boundary."""
+    out = []
+    h, w = prev_plane.shape
+    for dy, dx in _plane_offsets(connectivity):
+        a = prev_plane[max(0, -dy) : h - max(0, dy), max(0, -dx) : w - max(0, dx)]
+        b = next_plane[max(0, dy) : h - max(0, -dy), max(0, dx) : w - max(0, -dx)]
+        both = (a > 0) & (b > 0)
+        if both.any():
+            out.append(np.stack([a[both], b[both]], axis=1))
+    if not out:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(out).astype(np.int64), axis=0)
+
+
+def count_components(
+    read_block: ReadBlock,
+    depth: int,
+    slab: int = 64,
+    connectivity: int = 26,
+) -> Tuple[int, int]:
+    """Count components of a boolean volume read slab by slab.
+
+    ``read_block(z0, z1)`` returns the boolean (z1 - z0, y, x) block. Returns
+    (number of components, number not touching the volume border); the second
+    value is the cavity count when applied to the background.
+    """
+    struct = structure(connectivity)
+    uf = UnionFind(1)  # id 0 = background
+    border: List[np.ndarray] = []
+    offset = 0
+    prev_last = None
+    for z0 in range(0, depth, slab):
+        z1 = min(z0 + slab, depth)
+        labels, n = ndimage.label(read_block(z0, z1), structure=struct)
+        labels = labels.astype(np.int64)
+        labels[labels > 0] += offset
+        uf.grow(offset + n + 1)
+        faces = [labels[:, 0, :], labels[:, -1, :], labels[:, :, 0], labels[:, :, -1]]
+        if z0 == 0:
+            faces.append(labels[0])
+        if z1 == depth:
+            faces.append(labels[-1])
+        touched = np.unique(np.concatenate([f.ravel() for f in faces]))
+        border.append(touched[touched > 0])
+        if prev_last is not None:
+            uf.union_pairs(boundary_pairs(prev_last, labels[0], connectivity))
+        prev_last = labels[-1]
+        offset += n
+
+    if offset == 0:
+        return 0, 0
+    roots = uf.roots()
+    unique_roots = np.unique(roots[1:])
+    border_roots = np.unique(roots[np.concatenate(border)])
+    return int(len(unique_roots)), int(len(np.setdiff1d(unique_roots, border_roots)))
+
+
+@dataclass
+class Components:
+    """Components of a volume labelled slab by slab; arrays are indexed by component id - 1."""
+
+    shape: Tuple[int, int, int]
+    slabs: List[Tuple[int, int, int]]  # (z0, z1, label offset) per slab
+    compact: np.ndarray  # global slab label -> component id (1..n, in z order), 0 = background
+    voxels: np.ndarray  # (n,) int64
+    bbox_min: np.ndarray  # (n, 3) z, y, x
+    bbox_max: np.ndarray  # (n, 3) z, y, x, inclusive
+    centroid: np.ndarray  # (n, 3) z, y, x in voxels
+
+    @property
+    def n(self) -> int:
+        return len(self.voxels)
+
+
+def _ordered_map(ex: Optional[Executor], fn: Callable, tasks: Iterable[tuple], window: int) -> Iterator:
+    """fn(*task) in task order with at most ``window`` tasks in flight (inline without an executor)."""
+    if ex is None:
+        for task in tasks:
+            yield fn(*task)
+        return
+    pending: deque = deque()
+    for task in tasks:
+        pending.append(ex.submit(fn, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _label_slab(path: Path, z0: int, z1: int, threshold: float, connectivity: int) -> tuple:
+    """Label one slab; returns its count, boundary planes and per-label stats (global z)."""
+    with VolumeReader(path) as reader:
+        labels, n = ndimage.label(reader.read_block(z0, z1) > threshold, structure=structure(connectivity))
+    voxels = np.bincount(labels.ravel(), minlength=n + 1)[1:].astype(np.int64)
+    lo = np.zeros((n, 3), dtype=np.int64)
+    hi = np.zeros((n, 3), dtype=np.int64)
+    for i, sl in enumerate(ndimage.find_objects(labels)):
+        lo[i] = [s.start for s in sl]
+        hi[i] = [s.stop - 1 for s in sl]
+    lo[:, 0] += z0
+    hi[:, 0] += z0
+    # coordinate sums, so centroids of merged components are exact
+    sums = np.asarray(ndimage.center_of_mass(labels > 0, labels, np.arange(1, n + 1))).reshape(n, 3)
+    sums = (sums + [z0, 0, 0]) * voxels[:, None]
+    return n, labels[0].copy(), labels[-1].copy(), voxels, lo, hi, sums
+
+
+def label_components(
+    path: Path,
+    threshold: float = 0.0,
+    slab: int = 64,
+    connectivity: int = 26,
+    workers: int = 1,
+) -> Components:
+    """Label the foreground (value > threshold) of a volume file in z-slabs on ``workers`` processes."""
+    with VolumeReader(path) as reader:
+        shape = reader.shape
+    depth = shape[0]
+    bounds = [(z0, min(z0 + slab, depth)) for z0 in range(0, depth, slab)]
+    tasks = [(path, z0, z1, threshold, connectivity) for z0, z1 in bounds]
+
+    uf = UnionFind(1)  # id 0 = background
+    slabs: List[Tuple[int, int, int]] = []
+    stats: List[tuple] = []
+    offset = 0
+    prev_last = None
+    ex = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for (z0, z1), (n, first, last, voxels, lo, hi, sums) in zip(
+            bounds, _ordered_map(ex, _label_slab, tasks, 2 * max(1, workers))
+        ):
+            first = first.astype(np.int64)
+            first[first > 0] += offset
+            uf.grow(offset + n + 1)
+            if prev_last is not None:
+                uf.union_pairs(boundary_pairs(prev_last, first, connectivity))
+            prev_last = last.astype(np.int64)
+            prev_last[prev_last > 0] += offset
+            slabs.append((z0, z1, offset))
+            stats.append((voxels, lo, hi, sums))
+            offset += n
+    finally:
+        if ex is not None:
+            ex.shutdown()
+
+    roots = uf.roots()
+    unique_roots = np.unique(roots[1:])
+    compact = np.zeros(offset + 1, dtype=np.int64)
+    compact[1:] = np.searchsorted(unique_roots, roots[1:]) + 1
+    n_comp = len(unique_roots)
+    voxels = np.zeros(n_comp, dtype=np.int64)
+    bbox_min = np.full((n_comp, 3), np.iinfo(np.int64).max, dtype=np.int64)
+    bbox_max = np.full((n_comp, 3), -1, dtype=np.int64)
+    sums = np.zeros((n_comp, 3), dtype=np.float64)
+    for (_, _, off), (v, lo, hi, s) in zip(slabs, stats):
+        ids = compact[off + 1 : off + 1 + len(v)] - 1
+        np.add.at(voxels, ids, v)
+        np.minimum.at(bbox_min, ids, lo)
+        np.maximum.at(bbox_max, ids, hi)
+        np.add.at(sums, ids, s)
+    centroid = sums / np.maximum(voxels, 1)[:, None]
+    return Components(shape, slabs, compact, voxels, bbox_min, bbox_max, centroid)
+
+
+def label_dtype(n: int) -> np.dtype:
+    """Smallest unsigned dtype holding component ids 0..n."""
+    return np.dtype(np.uint16 if n <= np.iinfo(np.uint16).max else np.uint32)
+
+
+def _filter_slab(
+    path: Path, z0: int, z1: int, threshold: float, connectivity: int, lut: np.ndarray, as_labels: bool
+) -> np.ndarray:
+    with VolumeReader(path) as reader:
+        block = reader.read_block(z0, z1)
+    labels, _ = ndimage.label(block > threshold, structure=structure(connectivity))
+    ids = lut[labels]
+    if as_labels:
+        return ids
+    return np.where(ids > 0, block, np.zeros((), dtype=block.dtype))
+
+
+def iter_filtered_planes(
+    path: Path,
+    comps: Components,
+    keep: np.ndarray,
+    threshold: float = 0.0,
+    connectivity: int = 26,
+    workers: int = 1,
+    as_labels: bool = False,
+) -> Iterator[np.ndarray]:
+    """Planes of ``path`` with components where ``keep`` is False zeroed.
+
+    With ``as_labels`` the planes hold component ids instead (0 for removed
+    components and background) in ``label_dtype(comps.n)``.
+    """
+    keep_ids = np.concatenate([[False], np.asarray(keep, dtype=bool)])
+    lut = np.where(keep_ids[comps.compact], comps.compact, 0).astype(label_dtype(comps.n))
+    ends = [off for _, _, off in comps.slabs[1:]] + [len(lut) - 1]
+    # slab-local label i is global label off + i; local 0 stays background
+    tasks = (
+        (path, z0, z1, threshold, connectivity, np.concatenate([lut[:1], lut[off + 1 : end + 1]]), as_labels)
+        for (z0, z1, off), end in zip(comps.slabs, ends)
+    )
+    ex = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for block in _ordered_map(ex, _filter_slab, tasks, 2 * max(1, workers)):
+            yield from block
+    finally:
+        if ex is not None:
+            ex.shutdown(cancel_futures=True)
@@ -0,0 +1,165 @@
+"""
+Physical spacing lookup for OME-TIFF (and CZI) metadata, shared by the
+inference prep scripts and czi_tools.
+
+- Pull-parses the XML and stops at the first <Pixels> (OME) or after <Scaling>
+  (CZI), instead of building the whole tree.
+- SpacingService memoizes per file and per directory (sibling dz fallback), and
+  can persist results to a small JSON cache keyed on (path, size, mtime), so
+  unchanged files are not reopened on the next run.
+
+Scripts import it with
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+"""
+from __future__ import annotations
+
+import json
+import os
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import tifffile as tiff
+
+_CHUNK = 1 << 16
+
+
+@dataclass
+class Spacing:
+    dx: Optional[float] = None
+    dy: Optional[float] = None
+    dz: Optional[float] = None
+    unit_x: Optional[str] = None
+    unit_y: Optional[str] = None
+    unit_z: Optional[str] = None
+
+
+def strip_ns(tag: str) -> str:
+    return tag.split("}", 1)[-1] if "}" in tag else tag
+
+
+def _to_float(val: Optional[str]) -> Optional[float]:
+    if val is None or val == "":
+        return None
+    try:
+        return float(val)
+    except ValueError:
+        return None
+
+
+def _iter_events(xml: Union[str, bytes], events: Tuple[str, ...]) -> Iterator[Tuple[str, ET.Element]]:
+    """Feed the document in chunks so callers can stop as soon as they have what they need."""
+    parser = ET.XMLPullParser(events=events)
+    for start in range(0, len(xml), _CHUNK):
+        parser.feed(xml[start : start + _CHUNK])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def parse_ome_spacing(ome_xml: Optional[Union[str, bytes]]) -> Optional[Spacing]:
+    """PhysicalSize{X,Y,Z} and units of the first Image/Pixels element."""
+    if not ome_xml:
+        return None
+    try:
+        for _, elem in _iter_events(ome_xml, ("start",)):
+            if strip_ns(elem.tag) != "Pixels":
+                continue
+            a = elem.attrib
+            return Spacing(
+                dx=_to_float(a.get("PhysicalSizeX")),
+                dy=_to_float(a.get("PhysicalSizeY")),
+                dz=_to_float(a.get("PhysicalSizeZ")),
+                unit_x=a.get("PhysicalSizeXUnit"),
+                unit_y=a.get("PhysicalSizeYUnit"),
+                unit_z=a.get("PhysicalSizeZUnit"),
+            )
+    except ET.ParseError:
+        return None
+    return None
+
+
+def parse_dz_from_ome(ome_xml: Optional[Union[str, bytes]]) -> Optional[float]:
+    spacing = parse_ome_spacing(ome_xml)
+    return spacing.dz if spacing else None
+
+
+def parse_czi_scaling(meta_xml: Union[str, bytes]) -> Dict[str, Tuple[Optional[float], Optional[str]]]:
+    """CZI Scaling/Items/Distance entries as {Id: (value, unit)}; stops after </Scaling>."""
+    scaling: Dict[str, Tuple[Optional[float], Optional[str]]] = {}
+    depth = 0
+    for event, elem in _iter_events(meta_xml, ("start", "end")):
+        tag = strip_ns(elem.tag)
+        if tag == "Scaling":
+            depth += 1 if event == "start" else -1
+            if depth == 0:
+                break
+            continue
+        if depth == 0 or event != "end" or tag != "Distance":
+            continue
+        dist_id = elem.get("Id") or elem.get("id") or tag
+        val_text = elem.findtext("Value")
+        unit_text = elem.findtext("DefaultUnit") or elem.findtext("Unit")
+        scaling[dist_id] = (_to_float(val_text), unit_text)
+    return scaling
+
+
+class SpacingService:
+    """Memoized OME spacing lookup with optional on-disk persistence."""
+
+    def __init__(self, cache_path: Optional[Path] = None) -> None:
+        self.cache_path = cache_path
+        self._files: Dict[str, dict] = {}
+        self._dir_fallback: Dict[str, Optional[float]] = {}
+        self._dirty = False
+        if cache_path is not None and cache_path.exists():
+            try:
+                self._files = json.loads(cache_path.read_text()).get("files", {})
+            except (OSError, ValueError):
+                self._files = {}
+
+    def spacing(self, path: Path) -> Optional[Spacing]:
+        key = str(path)
+        st = path.stat()
+        entry = self._files.get(key)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            sp = entry.get("spacing")
+            return Spacing(**sp) if sp is not None else None
+        with tiff.TiffFile(path) as tf:
+            spacing = parse_ome_spacing(tf.ome_metadata)
+        self._files[key] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "spacing": asdict(spacing) if spacing else None,
+        }
+        self._dirty = True
+        return spacing
+
+    def dz(self, path: Path) -> Optional[float]:
+        spacing = self.spacing(path)
+        return spacing.dz if spacing else None
+
+    def dz_with_sibling_fallback(self, path: Path, pattern: str = "*.ome.tif") -> Optional[float]:
+        """dz of ``path``, else of the first sibling that has one (searched once per directory)."""
+        dz = self.dz(path)
+        if dz is not None:
+            return dz
+        parent = str(path.parent)
+        if parent not in self._dir_fallback:
+            found = None
+            for sib in path.parent.glob(pattern):
+                found = self.dz(sib)
+                if found is not None:
+                    break
+            self._dir_fallback[parent] = found
+        return self._dir_fallback[parent]
+
+    def save(self) -> None:
+        if self.cache_path is None or not self._dirty:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_path.with_name(f".{self.cache_path.name}.tmp")
+        tmp.write_text(json.dumps({"files": self._files}, indent=2))
+        os.replace(tmp, self.cache_path)
+        self._dirty = False
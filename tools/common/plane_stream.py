@@ -0,0 +1,90 @@
+"""
+File-free 2.5D inference feeder: planes in, predicted planes out.
+
+A stack is streamed plane by plane (e.g. straight out of the z-resampler)
+into a ring buffer of 2k+1 planes. Every centre c gets the clamped channel
+window planes[clamp(c-k .. c+k)], the same channels the prep scripts write
+as `<case>_zNNN_000C.tif` files (slice_layout.channel_window_targets with
+pad="clamp"). Windows are gathered into a preallocated (batch, 2k+1, y, x)
+buffer and handed to a predictor callable; its per-plane outputs are yielded
+in z order, so they can go straight into write_volume or an array.
+
+Memory: the ring (2k+1 planes) plus one batch of windows and outputs.
+
+Scripts import it with
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+"""
+from __future__ import annotations
+
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+# (batch, 2k+1, y, x) windows -> (batch, y, x) per-centre predictions
+Predictor = Callable[[np.ndarray], np.ndarray]
+
+
+def window_planes(c: int, z: int, k: int) -> List[int]:
+    """Plane indices of the clamped 2k+1 channel window of centre ``c``."""
+    return [min(max(c + off, 0), z - 1) for off in range(-k, k + 1)]
+
+
+def iter_windows(planes: Iterable[np.ndarray], z: int, k: int) -> Iterator[Tuple[int, np.ndarray, List[int]]]:
+    """Yield ``(centre, ring, slots)`` for c = 0..z-1 in order.
+
+    ``ring[slots]`` is the window of centre c. The ring is reused, so callers
+    must copy what they keep before advancing the iterator.
+    """
+    n = 2 * k + 1
+    ring = None
+    j = -1
+    for j, plane in enumerate(planes):
+        if j >= z:
+            raise ValueError(f"more than the announced {z} planes")
+        if ring is None:
+            ring = np.empty((n, *plane.shape), dtype=plane.dtype)
+        ring[j % n] = plane
+        c = j - k
+        if c >= 0:
+            yield c, ring, [p % n for p in window_planes(c, z, k)]
+    if j != z - 1:
+        raise ValueError(f"expected {z} planes, got {j + 1}")
+    # the last k centres only need planes already in the ring
+    for c in range(max(0, z - k), z):
+        yield c, ring, [p % n for p in window_planes(c, z, k)]
+
+
+def stream_predict(
+    planes: Iterable[np.ndarray],
+    z: int,
+    k: int,
+    predictor: Predictor,
+    batch_size: int = 8,
+    out_dtype: np.dtype = np.uint8,
+) -> Iterator[np.ndarray]:
+    """Predicted planes of a z-plane stream, in z order, batching windows for ``predictor``."""
+    batch = None
+    filled = 0
+    out_dtype = np.dtype(out_dtype)
+    for _, ring, slots in iter_windows(planes, z, k):
+        if batch is None:
+            batch = np.empty((batch_size, 2 * k + 1, *ring.shape[1:]), dtype=ring.dtype)
+        np.take(ring, slots, axis=0, out=batch[filled])
+        filled += 1
+        if filled == batch_size:
+            yield from _run(predictor, batch, filled, out_dtype)
+            filled = 0
+    if filled:
+        yield from _run(predictor, batch, filled, out_dtype)
+
+
+def _run(predictor: Predictor, batch: np.ndarray, n: int, out_dtype: np.dtype) -> Iterator[np.ndarray]:
+    pred = np.asarray(predictor(batch[:n]))
+    if pred.shape[0] != n or pred.shape[-2:] != batch.shape[-2:]:
+        raise ValueError(f"predictor returned {pred.shape} for a batch of {batch[:n].shape}")
+    if np.issubdtype(out_dtype, np.integer) and np.issubdtype(pred.dtype, np.floating):
+        # blended/averaged outputs: round instead of truncating 0.9999 to 0
+        info = np.iinfo(out_dtype)
+        pred = np.clip(np.rint(pred), info.min, info.max)
+    for i in range(n):
+        yield pred[i].astype(out_dtype, copy=False)
@@ -0,0 +1,145 @@
+"""
+Channel-window slice layout shared by the inference prep scripts and the
+nnUNet dataset builder.
+
+nnUNet 2D pseudo-3D inputs need one file per (case, channel), i.e. plane j of a
+stack appears up to 2k+1 times in imagesTs/imagesTr. Layouts:
+
+- copy:     every case channel is an independent TIFF (original behaviour)
+- hardlink: each plane is written once to a plane store, case channels are hardlinks
+- symlink:  same, with relative symlinks into the plane store
+
+imagesTs keeps the `<case>_zNNN_000C.tif` names nnUNet expects in every layout.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import tifffile as tiff
+
+LAYOUTS = ("copy", "hardlink", "symlink")
+# clamp: every plane is a case centre, edge windows repeat the first/last plane
+# drop:  only centres with a full window (k..z-k-1)
+PAD_POLICIES = ("clamp", "drop")
+
+
+def window_centers(z: int, k: int, pad: str = "clamp") -> range:
+    if pad not in PAD_POLICIES:
+        raise ValueError(f"unknown pad policy {pad!r}, expected one of {PAD_POLICIES}")
+    return range(z) if pad == "clamp" else range(k, max(k, z - k))
+
+
+def channel_window_targets(z: int, k: int, pad: str = "clamp") -> List[List[Tuple[int, int]]]:
+    """For each plane j, the (case centre index, channel index) pairs that read it."""
+    targets: List[List[Tuple[int, int]]] = [[] for _ in range(z)]
+    for idx in window_centers(z, k, pad):
+        for ch_idx, off in enumerate(range(-k, k + 1)):
+            j = min(max(idx + off, 0), z - 1)
+            targets[j].append((idx, ch_idx))
+    return targets
+
+
+def case_channel_path(out_dir: Path, case_prefix: str, idx: int, ch_idx: int) -> Path:
+    return out_dir / f"{case_prefix}_z{idx + 1:03d}_{ch_idx:04d}.tif"
+
+
+def plane_store_path(store_dir: Path, case_prefix: str, j: int) -> Path:
+    return store_dir / f"{case_prefix}_p{j + 1:03d}.tif"
+
+
+def _unlink(path: Path) -> None:
+    if path.is_symlink() or path.exists():
+        path.unlink()
+
+
+@contextmanager
+def atomic_target(path: Path) -> Iterator[Path]:
+    """Yield a hidden temp path next to ``path`` and rename it into place on success.
+
+    A crash leaves either the previous file or no file, never a truncated one.
+    Replacing the directory entry also means an existing hardlink/symlink is
+    never written through into the shared plane store.
+    """
+    tmp = path.with_name(f".{path.name}.tmp")
+    _unlink(tmp)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        _unlink(tmp)
+
+
+def write_plane(path: Path, plane: np.ndarray) -> None:
+    with atomic_target(path) as tmp:
+        tiff.imwrite(tmp, plane, photometric="minisblack")
+
+
+def link_plane(src: Path, dst: Path, layout: str) -> None:
+    with atomic_target(dst) as tmp:
+        if layout == "symlink":
+            os.symlink(os.path.relpath(src, dst.parent), tmp)
+            return
+        try:
+            os.link(src, tmp)
+        except OSError:
+            # e.g. plane store on another filesystem
+            shutil.copy2(src, tmp)
+
+
+def check_layout(layout: str, store_dir: Optional[Path]) -> None:
+    if layout not in LAYOUTS:
+        raise ValueError(f"unknown layout {layout!r}, expected one of {LAYOUTS}")
+    if layout != "copy" and store_dir is None:
+        raise ValueError(f"layout={layout} requires a plane store directory")
+
+
+def save_slice_images(
+    planes: Iterable[np.ndarray],
+    z: int,
+    out_dir: Path,
+    case_prefix: str,
+    k: int = 3,
+    layout: str = "copy",
+    store_dir: Optional[Path] = None,
+) -> Iterator[np.ndarray]:
+    """Write each incoming plane to every case channel that references it.
+
+    Planes are passed through unchanged so this can sit between a plane
+    producer and a stack writer; all ``z`` cases are complete once the input is
+    drained.
+    """
+    check_layout(layout, store_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if store_dir is not None and layout != "copy":
+        store_dir.mkdir(parents=True, exist_ok=True)
+    targets = channel_window_targets(z, k)
+    for j, plane in enumerate(planes):
+        if layout == "copy":
+            for idx, ch_idx in targets[j]:
+                write_plane(case_channel_path(out_dir, case_prefix, idx, ch_idx), plane)
+        else:
+            src = plane_store_path(store_dir, case_prefix, j)
+            write_plane(src, plane)
+            for idx, ch_idx in targets[j]:
+                link_plane(src, case_channel_path(out_dir, case_prefix, idx, ch_idx), layout)
+        yield plane
+
+
+def link_slice_images(
+    z: int, out_dir: Path, case_prefix: str, k: int, layout: str, store_dir: Path
+) -> int:
+    """Populate imagesTs from planes already in the plane store; returns case count."""
+    check_layout(layout, store_dir)
+    if layout == "copy":
+        raise ValueError("link_slice_images needs layout=hardlink or symlink")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for j, cases in enumerate(channel_window_targets(z, k)):
+        src = plane_store_path(store_dir, case_prefix, j)
+        for idx, ch_idx in cases:
+            link_plane(src, case_channel_path(out_dir, case_prefix, idx, ch_idx), layout)
+    return z
@@ -0,0 +1,128 @@
+"""
+Tiled XY sliding-window prediction with overlap blending.
+
+TiledPredictor wraps a patch predictor ((n, C, th, tw) -> (n, th, tw)) into a
+plane predictor ((b, C, Y, X) -> (b, Y, X) float32) for plane_stream: every
+plane (or 2k+1-channel window) is cut into overlapping tiles, tiles of all
+planes in the batch are sent to the patch predictor `tile_batch` at a time,
+and outputs are accumulated with a Gaussian / cosine / constant weight map
+into a preallocated accumulator, then normalised by the summed weights.
+
+Tile starts step by tile - overlap and the last tile is aligned to the plane
+edge, so every pixel is covered and tiles never run past the plane; planes
+smaller than a tile are zero-padded. Memory: accumulator and weight sum
+(b, Y, X) plus one tile batch.
+
+Scripts import it with
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+"""
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+BLEND_MODES = ("gaussian", "cosine", "constant")
+
+# (n, C, th, tw) tiles -> (n, th, tw) outputs
+PatchPredictor = Callable[[np.ndarray], np.ndarray]
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """Tile origins along one axis: step tile - overlap, last tile flush with the end."""
+    if length <= tile:
+        return [0]
+    step = max(1, tile - overlap)
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def blend_weights(tile: Tuple[int, int], mode: str = "gaussian", sigma_scale: float = 0.125) -> np.ndarray:
+    """Separable (th, tw) float32 weight map, 1 at the centre and > 0 everywhere."""
+    if mode not in BLEND_MODES:
+        raise ValueError(f"unknown blend mode {mode!r}, expected one of {BLEND_MODES}")
+    axes = []
+    for n in tile:
+        pos = np.arange(n, dtype=np.float64) + 0.5
+        if mode == "gaussian":
+            sigma = max(n * sigma_scale, 1e-6)
+            w = np.exp(-0.5 * ((pos - n / 2) / sigma) ** 2)
+        elif mode == "cosine":
+            w = 0.5 - 0.5 * np.cos(2 * np.pi * pos / n)
+        else:
+            w = np.ones(n)
+        axes.append(w / w.max())
+    weights = np.outer(axes[0], axes[1])
+    # edge pixels keep a small weight so a pixel covered by one tile only is still defined
+    floor = weights[weights > 0].min() if (weights > 0).any() else 1.0
+    return np.maximum(weights, min(floor, 1e-3)).astype(np.float32)
+
+
+def _overlap_px(overlap: Union[int, float], tile: int) -> int:
+    return int(round(overlap * tile)) if isinstance(overlap, float) and overlap < 1 else int(overlap)
+
+
+class TiledPredictor:
+    """Plane predictor built from a patch predictor by overlapping tiles and weighted blending."""
+
+    def __init__(
+        self,
+        predictor: PatchPredictor,
+        tile: Sequence[int] = (512, 512),
+        overlap: Union[int, float] = 0.25,
+        tile_batch: int = 8,
+        blend: str = "gaussian",
+    ) -> None:
+        self.predictor = predictor
+        self.tile = (int(tile[0]), int(tile[1]))
+        self.overlap = (_overlap_px(overlap, self.tile[0]), _overlap_px(overlap, self.tile[1]))
+        if min(self.tile) < 1 or any(o >= t for o, t in zip(self.overlap, self.tile)):
+            raise ValueError(f"overlap {self.overlap} must be smaller than tile {self.tile}")
+        self.tile_batch = max(1, int(tile_batch))
+        self.weights = blend_weights(self.tile, blend)
+        self._grids: Dict[Tuple[int, int], Tuple[List[Tuple[int, int]], np.ndarray]] = {}
+        self._acc = np.empty(0, dtype=np.float32)
+
+    def grid(self, shape: Tuple[int, int]) -> Tuple[List[Tuple[int, int]], np.ndarray]:
+        """Tile origins and summed weight map of one plane shape (cached)."""
+        if shape not in self._grids:
+            th, tw = self.tile
+            origins = [
+                (y0, x0)
+                for y0 in tile_starts(shape[0], th, self.overlap[0])
+                for x0 in tile_starts(shape[1], tw, self.overlap[1])
+            ]
+            wsum = np.zeros(shape, dtype=np.float32)
+            for y0, x0 in origins:
+                region = wsum[y0 : y0 + th, x0 : x0 + tw]
+                region += self.weights[: region.shape[0], : region.shape[1]]
+            self._grids[shape] = (origins, wsum)
+        return self._grids[shape]
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        b, c, ny, nx = batch.shape
+        th, tw = self.tile
+        origins, wsum = self.grid((ny, nx))
+        if self._acc.size < b * ny * nx:
+            self._acc = np.empty(b * ny * nx, dtype=np.float32)
+        acc = self._acc[: b * ny * nx].reshape(b, ny, nx)
+        acc.fill(0)
+
+        jobs = [(i, y0, x0) for i in range(b) for y0, x0 in origins]
+        tiles = np.zeros((min(self.tile_batch, len(jobs)), c, th, tw), dtype=batch.dtype)
+        for s in range(0, len(jobs), self.tile_batch):
+            chunk = jobs[s : s + self.tile_batch]
+            for n, (i, y0, x0) in enumerate(chunk):
+                src = batch[i, :, y0 : y0 + th, x0 : x0 + tw]
+                if src.shape[-2:] != (th, tw):
+                    tiles[n] = 0
+                tiles[n, :, : src.shape[1], : src.shape[2]] = src
+            out = np.asarray(self.predictor(tiles[: len(chunk)]))
+            if out.shape != (len(chunk), th, tw):
+                raise ValueError(f"patch predictor returned {out.shape} for tiles {tiles[: len(chunk)].shape}")
+            for n, (i, y0, x0) in enumerate(chunk):
+                region = acc[i, y0 : y0 + th, x0 : x0 + tw]
+                h, w = region.shape
+                region += out[n, :h, :w] * self.weights[:h, :w]
+        return acc / wsum
@@ -0,0 +1,131 @@
+"""
+Streaming z-resampling of (z, y, x) stacks to a target dz, shared by the
+inference prep scripts and the in-process inference pipeline.
+
+Output planes are produced one at a time from the two bracketing source
+planes, so a stack is never loaded whole. iter_inverse_planes maps a stack on
+the resampled grid (e.g. a prediction) back to the native z grid the same way:
+native plane j sits at resampled position j * (z_resampled - 1) / (z_original - 1),
+the exact inverse of the forward linspace mapping.
+
+Scripts import it with
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from volume_io import VolumeReader
+
+# nearest / linear for probabilities, nearest / majority for label masks
+INVERSE_MODES = ("nearest", "linear", "majority")
+
+
+def resampled_depth(z: int, dz: float, target_dz: float) -> int:
+    """Number of planes after resampling ``z`` planes of spacing ``dz`` to ``target_dz``."""
+    return max(1, int(round(z * dz / target_dz)))
+
+
+def resample_z_positions(z: int, new_z: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Source plane indices (z0, z1) and float32 weights for each output plane."""
+    if new_z < 1:
+        new_z = 1
+    pos = np.linspace(0, z - 1, new_z)
+    z0 = np.floor(pos).astype(int)
+    z1 = np.clip(z0 + 1, 0, z - 1)
+    w = (pos - z0).astype(np.float32)
+    return z0, z1, w
+
+
+def iter_resampled_planes(reader: VolumeReader, new_z: int) -> Iterator[np.ndarray]:
+    """Yield linearly z-resampled planes one at a time.
+
+    Matches the former whole-volume ``resample_z_linear`` bit for bit, but keeps
+    at most the two source planes bracketing the current output plane in memory.
+    """
+    z = reader.shape[0]
+    if new_z == z:
+        for i in range(z):
+            yield reader.read(i)
+        return
+    z0, z1, w = resample_z_positions(z, new_z)
+    is_int = np.issubdtype(reader.dtype, np.integer)
+    # same promotion as float32 weights times a full-volume array
+    work = np.result_type(np.float32, reader.dtype)
+    cache: Dict[int, np.ndarray] = {}
+    for i in range(len(w)):
+        need = (int(z0[i]), int(z1[i]))
+        cache = {j: cache[j] if j in cache else reader.read(j).astype(work) for j in need}
+        w0 = work.type(np.float32(1.0) - w[i])
+        out = w0 * cache[need[0]] + work.type(w[i]) * cache[need[1]]
+        if is_int:
+            out = np.clip(np.rint(out), 0, np.iinfo(reader.dtype).max).astype(reader.dtype)
+        else:
+            out = out.astype(reader.dtype)
+        yield out
+
+
+def majority_vote(planes: np.ndarray, nearest: int) -> np.ndarray:
+    """Per-pixel most frequent label of (n, y, x) ``planes``; ties go to ``planes[nearest]``."""
+    if len(planes) == 1:
+        return planes[0].copy()
+    labels = np.unique(planes)
+    if len(labels) == 1:
+        return planes[0].copy()
+    counts = np.stack([(planes == lab).sum(axis=0, dtype=np.int32) for lab in labels])
+    best = labels[np.argmax(counts, axis=0)]
+    near = planes[nearest]
+    near_count = (planes == near).sum(axis=0, dtype=np.int32)
+    return np.where(near_count == counts.max(axis=0), near, best).astype(planes.dtype)
+
+
+def _majority_windows(z_resampled: int, z_original: int) -> List[Tuple[int, int, int]]:
+    """Per native plane: resampled planes [lo, hi) inside its z extent and the nearest one."""
+    if z_original == 1:
+        return [(0, z_resampled, (z_resampled - 1) // 2)]
+    scale = (z_resampled - 1) / (z_original - 1)
+    windows = []
+    for j in range(z_original):
+        nearest = min(max(int(np.floor(j * scale + 0.5)), 0), z_resampled - 1)
+        lo = max(int(np.ceil((j - 0.5) * scale)), 0)
+        hi = min(int(np.floor((j + 0.5) * scale)), z_resampled - 1) + 1
+        if hi <= lo:
+            # native planes finer than the resampled grid: nothing inside, use the nearest
+            lo, hi = nearest, nearest + 1
+        windows.append((lo, hi, nearest - lo))
+    return windows
+
+
+def iter_inverse_planes(reader: VolumeReader, z_original: int, mode: str = "linear") -> Iterator[np.ndarray]:
+    """Yield the planes of a resampled-grid stack mapped back to ``z_original`` planes.
+
+    ``linear`` interpolates the two bracketing planes (rounded for integer
+    dtypes), ``nearest`` copies the closest plane, ``majority`` takes the
+    per-pixel majority label of the resampled planes within each native
+    plane's z extent. Source planes are read once, in order, and only the
+    ones the current output plane needs are kept.
+    """
+    if mode not in INVERSE_MODES:
+        raise ValueError(f"unknown inverse mode {mode!r}, expected one of {INVERSE_MODES}")
+    z_resampled = reader.shape[0]
+    if z_original == z_resampled:
+        yield from reader.iter_planes()
+        return
+    if mode == "linear":
+        yield from iter_resampled_planes(reader, z_original)
+        return
+    if mode == "nearest":
+        z0, z1, w = resample_z_positions(z_resampled, z_original)
+        src = np.where(w >= 0.5, z1, z0)
+        windows = [(int(i), int(i) + 1, 0) for i in src]
+    else:
+        windows = _majority_windows(z_resampled, z_original)
+    cache: Dict[int, np.ndarray] = {}
+    for lo, hi, nearest in windows:
+        cache = {i: cache[i] if i in cache else reader.read(i) for i in range(lo, hi)}
+        if hi - lo == 1:
+            yield cache[lo]
+        else:
+            yield majority_vote(np.stack([cache[i] for i in range(lo, hi)]), nearest)
@@ -15,9 +15,8 @@ from typing import Dict, List, Optional, Tuple
 
 from czifile import CziFile
 
-
-def strip_ns(tag: str) -> str:
-    return tag.split("}", 1)[-1] if "}" in tag else tag
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from ome_meta import parse_czi_scaling, strip_ns  # noqa: E402
 
 
 def read_xyz(node: ET.Element) -> Tuple[Optional[float], Optional[float], Optional[float]]:
@@ -39,23 +38,6 @@ def read_xyz(node: ET.Element) -> Tuple[Optional[float], Optional[float], Option
     return get_val("X"), get_val("Y"), get_val("Z")
 
 
-def parse_scaling(root: ET.Element) -> Dict[str, Tuple[Optional[float], Optional[str]]]:
-    scaling: Dict[str, Tuple[Optional[float], Optional[str]]] = {}
-    for dist in root.findall(".//Scaling//Distance"):
-        dist_id = dist.get("Id") or dist.get("id") or strip_ns(dist.tag)
-        val_text = dist.findtext("Value")
-        unit_text = dist.findtext("DefaultUnit") or dist.findtext("Unit")
-        val = None
-        if val_text is not None:
-            try:
-                val = float(val_text)
-            except Exception:
-                val = None
-        if dist_id:
-            scaling[dist_id] = (val, unit_text)
-    return scaling
-
-
 def parse_scene_positions(root: ET.Element) -> List[Dict[str, Optional[float]]]:
     scenes = root.findall(".//Scenes//Scene")
     if not scenes:
@@ -103,9 +85,8 @@ def main() -> int:
     if isinstance(meta_xml, bytes):
         meta_xml = meta_xml.decode("utf-8", errors="ignore")
 
+    scaling = parse_czi_scaling(meta_xml)
     root = ET.fromstring(meta_xml)
-
-    scaling = parse_scaling(root)
     scene_positions = parse_scene_positions(root)
 
     print(f"File: {czi_path}")
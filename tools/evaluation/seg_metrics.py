@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Segmentation metrics (Dice, IoU, Precision/Recall, Boundary F1) for one
+method x fold, appended to results/compare_runs.csv.
+
+- Cases come from a split file: data/05_splits/*.json ({"train", "val"} or the
+  stack-level {"folds": [{"train_stacks", "val_stacks"}]}, which matches
+  reassembled <sid>_pred z-stacks) or nnUNet splits_final.json (list of
+  folds); pick the fold with --fold
+- Split cases without a prediction/label (or failing to score) make the run
+  refuse to append to compare_runs.csv; with --allow-missing they count as
+  Dice 0, so a fold with missing outputs never scores higher
+- Predictions and labels are matched by case id and may be per-slice nnUNet
+  outputs or reassembled z-stacks (TIFF / OME-TIFF / OME-Zarr)
+- Each case is streamed in z-chunks; confusion counts and per-plane boundary
+  matches are accumulated per chunk, so no volume is loaded whole
+- Cases are scored on a process pool (--workers)
+
+compare_runs.csv keeps its header (method,config,fold,best_dice,val_loss,epoch,notes):
+best_dice is the mean per-case Dice, the remaining metrics go to notes.
+Per-case metrics can be written with --case-csv.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from volume_io import VolumeReader, list_volumes, volume_name  # noqa: E402
+
+COMPARE_HEADER = ["method", "config", "fold", "best_dice", "val_loss", "epoch", "notes"]
+
+
+@dataclass
+class Counts:
+    tp: int = 0
+    fp: int = 0
+    fn: int = 0
+    tn: int = 0
+    # boundary pixels (per plane) and those within tolerance of the other boundary
+    bp: int = 0
+    bp_hit: int = 0
+    bl: int = 0
+    bl_hit: int = 0
+
+    def __iadd__(self, other: "Counts") -> "Counts":
+        for k, v in asdict(other).items():
+            setattr(self, k, getattr(self, k) + v)
+        return self
+
+
+def _ratio(num: float, den: float) -> float:
+    return float(num) / float(den) if den else float("nan")
+
+
+def metrics(c: Counts) -> Dict[str, float]:
+    dice = _ratio(2 * c.tp, 2 * c.tp + c.fp + c.fn)
+    if c.tp + c.fp + c.fn == 0:
+        # empty prediction and empty label is a perfect match
+        dice = 1.0
+    bp = _ratio(c.bp_hit, c.bp)
+    br = _ratio(c.bl_hit, c.bl)
+    bf1 = _ratio(2 * bp * br, bp + br) if not (np.isnan(bp) or np.isnan(br)) else float("nan")
+    return {
+        "dice": dice,
+        "iou": 1.0 if c.tp + c.fp + c.fn == 0 else _ratio(c.tp, c.tp + c.fp + c.fn),
+        "precision": _ratio(c.tp, c.tp + c.fp),
+        "recall": _ratio(c.tp, c.tp + c.fn),
+        "bf1": bf1,
+    }
+
+
+def _boundary(mask: np.ndarray) -> np.ndarray:
+    return mask & ~ndimage.binary_erosion(mask, border_value=0)
+
+
+def boundary_counts(pred: np.ndarray, label: np.ndarray, tol_px: float) -> Tuple[int, int, int, int]:
+    """(pred boundary, matched pred boundary, label boundary, matched label boundary) for one plane."""
+    pb = _boundary(pred)
+    lb = _boundary(label)
+    n_pb = int(np.count_nonzero(pb))
+    n_lb = int(np.count_nonzero(lb))
+    if n_pb == 0 or n_lb == 0:
+        return n_pb, 0, n_lb, 0
+    # distance to the nearest boundary pixel of the other mask
+    d_to_l = ndimage.distance_transform_edt(~lb)
+    d_to_p = ndimage.distance_transform_edt(~pb)
+    hit_p = int(np.count_nonzero(d_to_l[pb] <= tol_px))
+    hit_l = int(np.count_nonzero(d_to_p[lb] <= tol_px))
+    return n_pb, hit_p, n_lb, hit_l
+
+
+def block_counts(pred: np.ndarray, label: np.ndarray, tol_px: float) -> Counts:
+    """Confusion + boundary counts of a (z, y, x) boolean block."""
+    tp = int(np.count_nonzero(pred & label))
+    n_pred = int(np.count_nonzero(pred))
+    n_label = int(np.count_nonzero(label))
+    c = Counts(tp=tp, fp=n_pred - tp, fn=n_label - tp, tn=int(pred.size) - n_pred - n_label + tp)
+    for p2, l2 in zip(pred, label):
+        bp, bp_hit, bl, bl_hit = boundary_counts(p2, l2, tol_px)
+        c.bp += bp
+        c.bp_hit += bp_hit
+        c.bl += bl
+        c.bl_hit += bl_hit
+    return c
+
+
+def score_case(
+    pred_path: Path, label_path: Path, threshold: float = 0.0, tol_px: float = 2.0, chunk_z: int = 16
+) -> Counts:
+    total = Counts()
+    with VolumeReader(pred_path) as pr, VolumeReader(label_path) as lr:
+        if pr.shape != lr.shape:
+            raise ValueError(f"shape mismatch {pr.shape} vs {lr.shape}: {pred_path} / {label_path}")
+        for z0 in range(0, pr.shape[0], chunk_z):
+            z1 = min(z0 + chunk_z, pr.shape[0])
+            total += block_counts(pr.read_block(z0, z1) > threshold, lr.read_block(z0, z1) > 0, tol_px)
+    return total
+
+
+def _score_task(task: tuple) -> Tuple[str, Optional[Counts], str]:
+    case, pred_path, label_path, threshold, tol_px, chunk_z = task
+    try:
+        return case, score_case(pred_path, label_path, threshold, tol_px, chunk_z), ""
+    except Exception as exc:
+        return case, None, f"{type(exc).__name__}: {exc}"
+
+
+def load_split_cases(path: Path, fold: int, subset: str = "val") -> List[str]:
+    """Case ids of ``subset`` in one fold of a split file.
+
+    Accepts {"train", "val"}, nnUNet splits_final.json (list of folds) and the
+    stack-level data/05_splits/*_splits_stacks.json ({"folds": [{"train_stacks",
+    "val_stacks"}]}), where "val" / "train" map to "val_stacks" / "train_stacks".
+    """
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, dict) and "folds" in data:
+        data = data["folds"]
+    if isinstance(data, list):
+        data = data[fold]
+    key = subset if subset in data else f"{subset}_stacks"
+    if key not in data:
+        raise KeyError(f"{path}: no {subset!r} cases (keys: {sorted(data)})")
+    return sorted(data[key])
+
+
+def index_volumes(root: Path, suffix: str = "") -> Dict[str, Path]:
+    """{case id: path} for volumes in ``root``; ``suffix`` (e.g. "_pred") is stripped from names."""
+    out: Dict[str, Path] = {}
+    for p in list_volumes(root):
+        name = volume_name(p)
+        if suffix and name.endswith(suffix):
+            name = name[: -len(suffix)]
+        out[name] = p
+    return out
+
+
+def append_compare_row(csv_path: Path, row: List[str]) -> None:
+    new = not csv_path.exists() or csv_path.stat().st_size == 0
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(csv_path, "a", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        if new:
+            w.writerow(COMPARE_HEADER)
+        w.writerow(row)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Score predictions against labels and append to compare_runs.csv")
+    ap.add_argument("--pred-dir", required=True, help="Predictions (per-slice or z-stack volumes)")
+    ap.add_argument("--label-dir", required=True, help="Labels, e.g. nnUNet labelsTr")
+    ap.add_argument("--splits", default=None, help="Split JSON; without it every prediction with a label is scored")
+    ap.add_argument("--fold", type=int, default=0)
+    ap.add_argument("--subset", default="val")
+    ap.add_argument("--pred-suffix", default="", help="Suffix to strip from prediction names, e.g. _pred")
+    ap.add_argument("--threshold", type=float, default=0.0, help="Prediction foreground is value > threshold")
+    ap.add_argument("--boundary-tol", type=float, default=2.0, help="Boundary F1 tolerance in pixels")
+    ap.add_argument("--chunk-z", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--method", required=True)
+    ap.add_argument("--config", default="2d")
+    ap.add_argument("--compare-csv", default="results/compare_runs.csv")
+    ap.add_argument("--case-csv", default=None, help="Optional per-case metrics CSV")
+    ap.add_argument(
+        "--allow-missing",
+        action="store_true",
+        help="Append even if split cases are unscored; they count as Dice 0 in best_dice",
+    )
+    args = ap.parse_args()
+
+    preds = index_volumes(Path(args.pred_dir), args.pred_suffix)
+    labels = index_volumes(Path(args.label_dir))
+    if args.splits:
+        cases = load_split_cases(Path(args.splits), args.fold, args.subset)
+    else:
+        cases = sorted(set(preds) & set(labels))
+    missing = [c for c in cases if c not in preds or c not in labels]
+    tasks = [
+        (c, preds[c], labels[c], args.threshold, args.boundary_tol, args.chunk_z)
+        for c in cases
+        if c in preds and c in labels
+    ]
+    if not tasks:
+        print("No prediction/label pairs to score", file=sys.stderr)
+        return 1
+
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            results = list(ex.map(_score_task, tasks, chunksize=max(1, len(tasks) // (4 * args.workers))))
+    else:
+        results = [_score_task(t) for t in tasks]
+
+    total = Counts()
+    per_case: List[Tuple[str, Dict[str, float]]] = []
+    errors = []
+    for case, counts, err in results:
+        if counts is None:
+            errors.append(case)
+            print(f"[WARN] {case}: {err}", file=sys.stderr)
+            continue
+        total += counts
+        per_case.append((case, metrics(counts)))
+
+    if args.case_csv:
+        with open(args.case_csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["case", "dice", "iou", "precision", "recall", "bf1"])
+            for case, m in per_case:
+                w.writerow([case] + [f"{m[k]:.6f}" for k in ("dice", "iou", "precision", "recall", "bf1")])
+
+    unscored = missing + errors
+    if unscored and not args.allow_missing:
+        print(
+            f"[ERROR] {len(unscored)} of {len(cases)} cases unscored (e.g. {unscored[:3]}); "
+            "not appending to compare_runs.csv (use --allow-missing to count them as Dice 0)",
+            file=sys.stderr,
+        )
+        return 2
+    dices = [m["dice"] for _, m in per_case] + [0.0] * len(unscored)
+    mean_dice = float(np.nanmean(dices)) if dices else float("nan")
+    global_m = metrics(total)
+    notes = ";".join(
+        [f"global_{k}={v:.4f}" for k, v in global_m.items()]
+        + [
+            f"n_cases={len(per_case)}",
+            f"missing={len(missing)}",
+            f"errors={len(errors)}",
+            f"threshold={args.threshold:g}",
+            f"boundary_tol_px={args.boundary_tol:g}",
+            f"split={Path(args.splits).name if args.splits else 'all'}:{args.subset}",
+            f"pred_dir={args.pred_dir}",
+        ]
+    )
+    append_compare_row(
+        Path(args.compare_csv),
+        [args.method, args.config, str(args.fold), f"{mean_dice:.4f}", "", "", notes],
+    )
+    print(
+        f"method={args.method} fold={args.fold} mean_dice={mean_dice:.4f} "
+        f"cases={len(per_case)} missing={len(missing)}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
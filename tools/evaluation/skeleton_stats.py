@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Skeleton length statistics for prediction or label volumes.
+
+- Binarize (> threshold) and skeletonize each volume (skimage, Lee 3D thinning)
+- Label 26-connected skeleton components
+- Per-component length = sum of physical edge lengths between 26-neighbour
+  skeleton voxels (dx/dy/dz scaled), counted with one vectorized pass per
+  neighbour offset instead of walking voxels
+- Emit pooled stats JSON (results/skeleton_length_stats.json) plus per-case
+  component tables and a per-case summary CSV
+- Per-volume component lengths are cached by content hash + parameters, so
+  re-scoring unchanged volumes skips skeletonization
+
+Usage:
+  python tools/evaluation/skeleton_stats.py --inputs REVIEW/predictions/<model> \
+      --dx 0.439294 --dy 0.439294 --dz 0.396 \
+      --out results/skeleton_length_stats.json --table-dir results/skeleton_lengths
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from itertools import product
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import ndimage
+from skimage.morphology import skeletonize
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from volume_io import VolumeReader, list_volumes, volume_name, volume_sha1  # noqa: E402
+
+# 13 of the 26 neighbour offsets (one per undirected edge)
+HALF_OFFSETS = [off for off in product((-1, 0, 1), repeat=3) if off > (0, 0, 0)]
+CACHE_VERSION = 1
+
+
+def load_binary(path: Path, threshold: float) -> np.ndarray:
+    with VolumeReader(path) as reader:
+        return reader.read_block(0, reader.shape[0]) > threshold
+
+
+def skeletonize_volume(mask: np.ndarray) -> np.ndarray:
+    if mask.shape[0] == 1:
+        return skeletonize(mask[0]).astype(bool)[None]
+    return skeletonize(mask).astype(bool)
+
+
+def _shifted(off: Sequence[int]) -> Tuple[Tuple[slice, ...], Tuple[slice, ...]]:
+    """Slices (a, b) such that arr[b] is arr[a] moved by ``off``."""
+    a, b = [], []
+    for d in off:
+        if d > 0:
+            a.append(slice(0, -d))
+            b.append(slice(d, None))
+        elif d < 0:
+            a.append(slice(-d, None))
+            b.append(slice(0, d))
+        else:
+            a.append(slice(None))
+            b.append(slice(None))
+    return tuple(a), tuple(b)
+
+
+def component_lengths(
+    skel: np.ndarray, spacing: Tuple[float, float, float]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-component skeleton length (physical units) and voxel count.
+
+    ``spacing`` is (dz, dy, dx).
+    """
+    labels, n = ndimage.label(skel, structure=np.ones((3, 3, 3), dtype=bool))
+    lengths = np.zeros(n + 1, dtype=np.float64)
+    step = np.asarray(spacing, dtype=np.float64)
+    for off in HALF_OFFSETS:
+        a, b = _shifted(off)
+        edge = skel[a] & skel[b]
+        if not edge.any():
+            continue
+        dist = float(np.sqrt(np.sum((np.asarray(off) * step) ** 2)))
+        lengths += np.bincount(labels[a][edge], minlength=n + 1) * dist
+    voxels = np.bincount(labels.ravel(), minlength=n + 1)
+    return lengths[1:], voxels[1:]
+
+
+def summarize(values: np.ndarray, percentiles: Sequence[float]) -> Dict[str, Optional[float]]:
+    stats: Dict[str, Optional[float]] = {"count": int(values.size)}
+    keys = ["min", "max", "mean", "median"] + [f"p{p:g}" for p in percentiles]
+    if values.size == 0:
+        stats.update({k: None for k in keys})
+        return stats
+    stats.update(
+        {
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "mean": float(values.mean()),
+            "median": float(np.median(values)),
+        }
+    )
+    for p in percentiles:
+        stats[f"p{p:g}"] = float(np.percentile(values, p))
+    return stats
+
+
+def case_lengths(
+    path: Path,
+    spacing: Tuple[float, float, float],
+    threshold: float,
+    cache_dir: Optional[Path],
+) -> Tuple[np.ndarray, np.ndarray, bool]:
+    """Component lengths/voxel counts for one volume; third value is True on a cache hit."""
+    cache_path = None
+    if cache_dir is not None:
+        params = {"v": CACHE_VERSION, "spacing": list(spacing), "threshold": threshold}
+        param_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+        key = f"{volume_sha1(path)}_{param_key}"
+        cache_path = cache_dir / f"{key}.npz"
+        if cache_path.exists():
+            with np.load(cache_path) as z:
+                return z["lengths"], z["voxels"], True
+    skel = skeletonize_volume(load_binary(path, threshold))
+    lengths, voxels = component_lengths(skel, spacing)
+    if cache_path is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_name(f".{cache_path.stem}.tmp.npz")
+        np.savez(tmp, lengths=lengths, voxels=voxels)
+        os.replace(tmp, cache_path)
+    return lengths, voxels, False
+
+
+def write_case_table(path: Path, lengths: np.ndarray, voxels: np.ndarray) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["component", "length", "n_voxels"])
+        for i, (length, nv) in enumerate(zip(lengths, voxels), start=1):
+            w.writerow([i, f"{length:.6g}", int(nv)])
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Skeleton length statistics for binary/probability volumes")
+    ap.add_argument("--inputs", nargs="+", required=True, help="Volume files or directories of volumes")
+    ap.add_argument("--out", default="results/skeleton_length_stats.json", help="Pooled stats JSON")
+    ap.add_argument("--table-dir", default=None, help="Per-case component CSVs + summary.csv")
+    ap.add_argument("--dx", type=float, default=1.0)
+    ap.add_argument("--dy", type=float, default=1.0)
+    ap.add_argument("--dz", type=float, default=1.0)
+    ap.add_argument("--threshold", type=float, default=0.0, help="Foreground is value > threshold")
+    ap.add_argument("--percentiles", type=float, nargs="*", default=[10, 20, 30])
+    ap.add_argument("--cache-dir", default="results/.cache/skeleton_stats", help="'' disables the cache")
+    args = ap.parse_args()
+
+    spacing = (args.dz, args.dy, args.dx)
+    cache_dir = Path(args.cache_dir) if args.cache_dir else None
+    table_dir = Path(args.table_dir) if args.table_dir else None
+    if table_dir is not None:
+        table_dir.mkdir(parents=True, exist_ok=True)
+
+    volumes: List[Path] = []
+    for item in args.inputs:
+        volumes.extend(list_volumes(Path(item)))
+    if not volumes:
+        print("No input volumes found", file=sys.stderr)
+        return 1
+
+    all_lengths: List[np.ndarray] = []
+    summary_rows = []
+    n_cached = 0
+    for path in volumes:
+        lengths, voxels, cached = case_lengths(path, spacing, args.threshold, cache_dir)
+        n_cached += int(cached)
+        all_lengths.append(lengths)
+        case = volume_name(path)
+        summary_rows.append(
+            [case, str(path), int(lengths.size), f"{float(lengths.sum()):.6g}", int(voxels.sum())]
+        )
+        if table_dir is not None:
+            write_case_table(table_dir / f"{case}_components.csv", lengths, voxels)
+
+    stats = summarize(np.concatenate(all_lengths), args.percentiles)
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(stats, indent=2), encoding="utf-8")
+
+    if table_dir is not None:
+        with open(table_dir / "summary.csv", "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["case", "path", "n_components", "total_length", "skeleton_voxels"])
+            w.writerows(summary_rows)
+
+    print(f"cases={len(volumes)} (cached={n_cached}) components={stats['count']} out={out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Topology-aware metrics for reassembled z-stacks.
+
+Per case (prediction vs label):
+- clDice, skeleton precision (Tprec) and skeleton recall (Tsens)
+- 3D Boundary F1 with a physical distance tolerance (um, dx/dy/dz aware)
+- Betti numbers b0 (26-connected components), b2 (cavities) and b1 (tunnels,
+  from the Euler characteristic: b1 = b0 + b2 - chi) and their absolute errors
+
+Volumes are processed in z-slabs with an overlapping halo, so only
+slab + 2*halo planes are in memory. Skeletons and boundaries are computed on
+the haloed slab and counted on the core only; Euler characteristic is
+additive over slabs; components are merged across slabs with union-find
+(tools/common/chunked_components.py). Skeletonization is local to the haloed
+slab, so clDice with --slab smaller than the stack is a close approximation
+of the whole-volume value. Cases run on a process pool (--workers).
+
+Usage:
+  python tools/evaluation/topo_metrics.py --pred-dir REVIEW/predictions/<model> \
+      --label-dir <label_zstacks> --pred-suffix _pred --threshold 0 \
+      --dx 0.439294 --dy 0.439294 --dz 0.396 --out-csv results/topo_<model>.csv
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from chunked_components import count_components  # noqa: E402
+from seg_metrics import index_volumes, load_split_cases  # noqa: E402
+from skeleton_stats import skeletonize_volume  # noqa: E402
+from volume_io import VolumeReader  # noqa: E402
+
+BETTI_KEYS = ("betti0", "betti1", "betti2")
+
+
+def _ypair(a: np.ndarray) -> np.ndarray:
+    return a[:, :-1, :] | a[:, 1:, :]
+
+
+def _xpair(a: np.ndarray) -> np.ndarray:
+    return a[:, :, :-1] | a[:, :, 1:]
+
+
+def euler_slab(planes: np.ndarray, last: bool) -> int:
+    """Euler characteristic contribution of one slab (26-connected foreground).
+
+    ``planes`` holds voxel planes z0-1 .. z1 (out-of-volume planes as zeros).
+    The slab owns lattice rows z0..z1-1 (plus z1 when ``last``) and voxel planes
+    z0..z1-1, so contributions of consecutive slabs sum to chi of the volume.
+    """
+    p = np.pad(planes, ((0, 0), (1, 1), (1, 1)))
+    n = p.shape[0] - 2
+    rows = n + 1 if last else n
+    zpair = p[:rows] | p[1 : rows + 1]
+    vox = p[1 : n + 1]
+    v = np.count_nonzero(_xpair(_ypair(zpair)))
+    e = (
+        np.count_nonzero(_ypair(zpair)[:, :, 1:-1])
+        + np.count_nonzero(_xpair(zpair)[:, 1:-1, :])
+        + np.count_nonzero(_xpair(_ypair(vox)))
+    )
+    f = (
+        np.count_nonzero(zpair[:, 1:-1, 1:-1])
+        + np.count_nonzero(_xpair(vox)[:, 1:-1, :])
+        + np.count_nonzero(_ypair(vox)[:, :, 1:-1])
+    )
+    c = np.count_nonzero(vox[:, 1:-1, 1:-1])
+    return int(v - e + f - c)
+
+
+def _boundary(mask: np.ndarray) -> np.ndarray:
+    return mask & ~ndimage.binary_erosion(mask, structure=ndimage.generate_binary_structure(3, 1), border_value=0)
+
+
+def _slab_planes(block: np.ndarray, e0: int, z0: int, z1: int, depth: int) -> np.ndarray:
+    """Voxel planes z0-1 .. z1 from a haloed block starting at e0, zero outside the volume."""
+    out = np.zeros((z1 - z0 + 2, *block.shape[1:]), dtype=bool)
+    lo, hi = max(z0 - 1, 0), min(z1 + 1, depth)
+    out[lo - (z0 - 1) : hi - (z0 - 1)] = block[lo - e0 : hi - e0]
+    return out
+
+
+def case_topology(
+    pred_path: Path,
+    label_path: Path,
+    threshold: float,
+    spacing: Tuple[float, float, float],
+    tol_um: float,
+    slab: int,
+    halo: int,
+) -> Dict[str, float]:
+    halo = max(halo, int(math.ceil(tol_um / spacing[0])) + 1, 1)
+    counts = dict.fromkeys(
+        ["sp", "sp_in_l", "sl", "sl_in_p", "bp", "bp_hit", "bl", "bl_hit", "chi_p", "chi_l"], 0
+    )
+    with VolumeReader(pred_path) as pr, VolumeReader(label_path) as lr:
+        if pr.shape != lr.shape:
+            raise ValueError(f"shape mismatch {pr.shape} vs {lr.shape}: {pred_path} / {label_path}")
+        depth = pr.shape[0]
+        for z0 in range(0, depth, slab):
+            z1 = min(z0 + slab, depth)
+            e0, e1 = max(0, z0 - halo), min(depth, z1 + halo)
+            p = pr.read_block(e0, e1) > threshold
+            lab = lr.read_block(e0, e1) > 0
+            core = slice(z0 - e0, z1 - e0)
+
+            sp, sl = skeletonize_volume(p)[core], skeletonize_volume(lab)[core]
+            counts["sp"] += np.count_nonzero(sp)
+            counts["sp_in_l"] += np.count_nonzero(sp & lab[core])
+            counts["sl"] += np.count_nonzero(sl)
+            counts["sl_in_p"] += np.count_nonzero(sl & p[core])
+
+            bp, bl = _boundary(p), _boundary(lab)
+            if bp.any() and bl.any():
+                d_to_l = ndimage.distance_transform_edt(~bl, sampling=spacing)[core]
+                d_to_p = ndimage.distance_transform_edt(~bp, sampling=spacing)[core]
+                counts["bp_hit"] += np.count_nonzero(d_to_l[bp[core]] <= tol_um)
+                counts["bl_hit"] += np.count_nonzero(d_to_p[bl[core]] <= tol_um)
+            counts["bp"] += np.count_nonzero(bp[core])
+            counts["bl"] += np.count_nonzero(bl[core])
+
+            last = z1 == depth
+            counts["chi_p"] += euler_slab(_slab_planes(p, e0, z0, z1, depth), last)
+            counts["chi_l"] += euler_slab(_slab_planes(lab, e0, z0, z1, depth), last)
+
+        betti = {}
+        for key, reader, thr in (("pred", pr, threshold), ("label", lr, 0)):
+            b0, _ = count_components(lambda a, b: reader.read_block(a, b) > thr, depth, slab, 26)
+            _, b2 = count_components(lambda a, b: ~(reader.read_block(a, b) > thr), depth, slab, 6)
+            chi = counts["chi_p" if key == "pred" else "chi_l"]
+            betti[key] = (b0, b0 + b2 - chi, b2)
+
+    def ratio(a: float, b: float) -> float:
+        return a / b if b else float("nan")
+
+    tprec = ratio(counts["sp_in_l"], counts["sp"])
+    tsens = ratio(counts["sl_in_p"], counts["sl"])
+    bprec = ratio(counts["bp_hit"], counts["bp"])
+    brec = ratio(counts["bl_hit"], counts["bl"])
+    out = {
+        "cldice": ratio(2 * tprec * tsens, tprec + tsens),
+        "skel_precision": tprec,
+        "skel_recall": tsens,
+        "bf1": ratio(2 * bprec * brec, bprec + brec),
+    }
+    for i, key in enumerate(BETTI_KEYS):
+        out[f"{key}_pred"] = betti["pred"][i]
+        out[f"{key}_label"] = betti["label"][i]
+        out[f"{key}_error"] = abs(betti["pred"][i] - betti["label"][i])
+    return out
+
+
+def _task(task: tuple) -> Tuple[str, Optional[Dict[str, float]], str]:
+    case = task[0]
+    try:
+        return case, case_topology(*task[1:]), ""
+    except Exception as exc:
+        return case, None, f"{type(exc).__name__}: {exc}"
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="clDice, skeleton P/R, Boundary F1 and Betti errors per case")
+    ap.add_argument("--pred-dir", required=True)
+    ap.add_argument("--label-dir", required=True)
+    ap.add_argument("--splits", default=None, help="Split JSON; without it every prediction with a label is scored")
+    ap.add_argument("--fold", type=int, default=0)
+    ap.add_argument("--subset", default="val")
+    ap.add_argument("--pred-suffix", default="", help="Suffix to strip from prediction names, e.g. _pred")
+    ap.add_argument("--threshold", type=float, default=0.0, help="Prediction foreground is value > threshold")
+    ap.add_argument("--dx", type=float, default=1.0)
+    ap.add_argument("--dy", type=float, default=1.0)
+    ap.add_argument("--dz", type=float, default=1.0)
+    ap.add_argument("--boundary-tol-um", type=float, default=1.0)
+    ap.add_argument("--slab", type=int, default=32, help="Core planes per slab")
+    ap.add_argument("--halo", type=int, default=8, help="Overlap planes on each side of a slab")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--out-csv", required=True, help="Per-case metrics CSV")
+    ap.add_argument("--summary-json", default=None, help="Mean metrics over cases (default: <out-csv>.json)")
+    args = ap.parse_args()
+
+    preds = index_volumes(Path(args.pred_dir), args.pred_suffix)
+    labels = index_volumes(Path(args.label_dir))
+    if args.splits:
+        cases = load_split_cases(Path(args.splits), args.fold, args.subset)
+    else:
+        cases = sorted(set(preds) & set(labels))
+    spacing = (args.dz, args.dy, args.dx)
+    tasks = [
+        (c, preds[c], labels[c], args.threshold, spacing, args.boundary_tol_um, args.slab, args.halo)
+        for c in cases
+        if c in preds and c in labels
+    ]
+    if not tasks:
+        print("No prediction/label pairs to score", file=sys.stderr)
+        return 1
+
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            results = list(ex.map(_task, tasks))
+    else:
+        results = [_task(t) for t in tasks]
+
+    rows: List[Tuple[str, Dict[str, float]]] = []
+    for case, res, err in results:
+        if res is None:
+            print(f"[WARN] {case}: {err}", file=sys.stderr)
+            continue
+        rows.append((case, res))
+    if not rows:
+        return 2
+
+    keys = list(rows[0][1].keys())
+    out_csv = Path(args.out_csv)
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_csv, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["case"] + keys)
+        for case, res in rows:
+            w.writerow([case] + [f"{res[k]:.6g}" for k in keys])
+
+    summary = {
+        "n_cases": len(rows),
+        "n_missing": len(cases) - len(tasks),
+        "n_errors": len(results) - len(rows),
+        "spacing_zyx": list(spacing),
+        "boundary_tol_um": args.boundary_tol_um,
+        "mean": {k: float(np.nanmean([res[k] for _, res in rows])) for k in keys},
+    }
+    summary_path = Path(args.summary_json) if args.summary_json else out_csv.with_suffix(".json")
+    summary_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    m = summary["mean"]
+    print(
+        f"cases={len(rows)} cldice={m['cldice']:.4f} bf1={m['bf1']:.4f} "
+        f"betti0_err={m['betti0_error']:.2f} betti1_err={m['betti1_error']:.2f}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
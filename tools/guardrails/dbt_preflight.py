@@ -2,11 +2,21 @@
 from __future__ import annotations
 
 import argparse
+import fnmatch
+import hashlib
 import json
+import os
 import re
-from dataclasses import asdict, dataclass
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
+
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parents[2] / "logs" / "preflight_cache"
 
 
 @dataclass
@@ -29,12 +39,191 @@ def _add_issue(issues: List[Issue], check: str, msg: str, critical_checks: Set[s
     issues.append(Issue(_issue_level(check, critical_checks), check, msg, context))
 
 
-def _count_files(root: Path) -> int:
-    if not root.exists():
-        return 0
+def _scan_dir(path: Path) -> Tuple[List[str], List[str]]:
+    """(sorted subdirectory names, sorted file names) of one directory, from a single scandir."""
+    dirs: List[str] = []
+    files: List[str] = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                (dirs if entry.is_dir() else files).append(entry.name)
+            except OSError:
+                continue
+    return sorted(dirs), sorted(files)
+
+
+def _first_file(root: Path) -> Optional[Path]:
+    """First regular file under ``root`` (depth-first), stopping as soon as one is found."""
     if root.is_file():
-        return 1
-    return sum(1 for p in root.rglob("*") if p.is_file())
+        return root
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        return Path(entry.path)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                except OSError:
+                    continue
+    return None
+
+
+@dataclass
+class SplitSnapshot:
+    """Case dirs of one train/test split plus the listing of the sampled cases."""
+
+    path: Path
+    exists: bool = False
+    mtime_ns: int = 0
+    cases: List[str] = field(default_factory=list)
+    # mtimes of the sampled cases, or of every case when snapshotted with stat_cases (--full)
+    case_mtimes: Dict[str, int] = field(default_factory=dict)
+    # sampled case -> (first patch dir name or None, file names in that patch dir)
+    samples: Dict[str, Tuple[Optional[str], Set[str]]] = field(default_factory=dict)
+
+
+@dataclass
+class FoldSnapshot:
+    """Everything the dataset checks need from one fold dir, gathered in one walk."""
+
+    path: Path
+    exists: bool = False
+    mtime_ns: int = 0
+    top_level: List[str] = field(default_factory=list)
+    suspicious: List[str] = field(default_factory=list)
+    train: Optional[SplitSnapshot] = None
+    test: Optional[SplitSnapshot] = None
+
+
+def _snapshot_split(split_dir: Path, n_samples: int, stat_cases: bool = False) -> SplitSnapshot:
+    """Case names from one scandir; only sampled cases are stat'ed unless ``stat_cases``.
+
+    On network filesystems a stat per case dir dominates the scan, so the
+    sampled mode relies on the split dir mtime (changes when cases are added,
+    removed or renamed) and stats every case only for --full.
+    """
+    snap = SplitSnapshot(split_dir)
+    try:
+        snap.mtime_ns = split_dir.stat().st_mtime_ns
+        snap.cases, _ = _scan_dir(split_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return snap
+    snap.exists = True
+    sampled = snap.cases[: max(0, n_samples)]
+    for case in snap.cases if stat_cases else sampled:
+        try:
+            snap.case_mtimes[case] = (split_dir / case).stat().st_mtime_ns
+        except OSError:
+            continue
+    for case in sampled:
+        patches, _ = _scan_dir(split_dir / case)
+        if not patches:
+            snap.samples[case] = (None, set())
+            continue
+        _, files = _scan_dir(split_dir / case / patches[0])
+        snap.samples[case] = (patches[0], set(files))
+    return snap
+
+
+def _snapshot_fold(
+    fold_dir: Path,
+    prepared_relpath: str,
+    train_subdir: str,
+    test_subdir: str,
+    suspicious_globs: List[str],
+    n_samples: int,
+    stat_cases: bool = False,
+) -> FoldSnapshot:
+    snap = FoldSnapshot(fold_dir)
+    try:
+        snap.mtime_ns = fold_dir.stat().st_mtime_ns
+        dirs, files = _scan_dir(fold_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return snap
+    snap.exists = True
+    snap.top_level = sorted(dirs + files)
+    for pat in suspicious_globs:
+        if "/" in pat or "**" in pat:
+            # multi-level patterns still need a real glob
+            snap.suspicious.extend(str(p) for p in fold_dir.glob(pat))
+        else:
+            snap.suspicious.extend(str(fold_dir / n) for n in fnmatch.filter(snap.top_level, pat))
+    prepared_dir = fold_dir / prepared_relpath
+    snap.train = _snapshot_split(prepared_dir / train_subdir, n_samples, stat_cases)
+    snap.test = _snapshot_split(prepared_dir / test_subdir, n_samples, stat_cases)
+    return snap
+
+
+def _scan_dataset(
+    dataset_cfg: dict, scan_workers: int = 0, stat_cases: bool = False
+) -> Optional[List[Tuple[str, FoldSnapshot]]]:
+    """(fold name, snapshot) for every configured fold, or None if fold_root is missing.
+
+    ``stat_cases`` stats every case dir (only worth it for --full, where a
+    cache hit skips validating every patch dir).
+    """
+    fold_root = _as_path(dataset_cfg.get("fold_root"))
+    if fold_root is None or not fold_root.is_dir():
+        return None
+    fold_indices = dataset_cfg.get("fold_indices", [0, 1, 2, 3])
+    prepared_relpath = dataset_cfg.get("prepared_relpath", "training_data_seed42_ok")
+    train_subdir = dataset_cfg.get("train_subdir", "training_datasets")
+    test_subdir = dataset_cfg.get("test_subdir", "test_datasets")
+    suspicious_globs = dataset_cfg.get("suspicious_globs", ["training_data_seed42training_datasets*"])
+    sample_cases_per_split = int(dataset_cfg.get("sample_cases_per_split", 3))
+
+    # one snapshot per fold, folds scanned concurrently (I/O bound on network filesystems)
+    fold_dirs = [fold_root / f"fold{fold}" for fold in fold_indices]
+    with ThreadPoolExecutor(max_workers=max(1, scan_workers or len(fold_dirs))) as ex:
+        snapshots = list(
+            ex.map(
+                lambda d: _snapshot_fold(
+                    d,
+                    prepared_relpath,
+                    train_subdir,
+                    test_subdir,
+                    suspicious_globs,
+                    sample_cases_per_split,
+                    stat_cases,
+                ),
+                fold_dirs,
+            )
+        )
+    return [(f"fold{fold}", snap) for fold, snap in zip(fold_indices, snapshots)]
+
+
+def dataset_fingerprint(scans: Optional[List[Tuple[str, FoldSnapshot]]]) -> str:
+    """Cheap dataset fingerprint from what the scan already read.
+
+    Fold/split dir mtimes, case dir names and count, mtimes and patch listings
+    of the sampled cases (every case's mtime with --full). Edits inside a case
+    that is not sampled, or inside a patch dir that leave its case dir
+    untouched, are not seen; use --no-cache after such changes.
+    """
+    h = hashlib.sha1()
+    for fold_name, snap in scans or []:
+        item: list = [fold_name, str(snap.path), snap.exists, snap.mtime_ns, snap.top_level]
+        for split in (snap.train, snap.test):
+            if split is not None:
+                item.append(
+                    [
+                        str(split.path),
+                        split.exists,
+                        split.mtime_ns,
+                        len(split.cases),
+                        split.cases,
+                        sorted(split.case_mtimes.items()),
+                        sorted((c, p, sorted(f)) for c, (p, f) in split.samples.items()),
+                    ]
+                )
+        h.update(json.dumps(item).encode())
+    return h.hexdigest()
 
 
 def _check_output(out_cfg: dict, critical_checks: Set[str], issues: List[Issue], stats: dict) -> None:
@@ -43,51 +232,49 @@ def _check_output(out_cfg: dict, critical_checks: Set[str], issues: List[Issue],
         return
     allow_nonempty = bool(out_cfg.get("allow_nonempty", False))
     exists = out_path.exists()
-    file_count = _count_files(out_path)
+    first_file = _first_file(out_path) if exists else None
     stats["output"] = {
         "path": str(out_path),
         "exists": exists,
-        "file_count": file_count,
+        "nonempty": first_file is not None,
         "allow_nonempty": allow_nonempty,
     }
-    if exists and file_count > 0 and not allow_nonempty:
+    if first_file is not None and not allow_nonempty:
         _add_issue(
             issues,
             "overwrite",
             f"output is non-empty and allow_nonempty=false: {out_path}",
             critical_checks,
-            context=f"file_count={file_count}",
+            context=f"first_file={first_file}",
         )
 
 
 def _check_case_dirs(
     split_name: str,
-    split_dir: Path,
+    snap: SplitSnapshot,
     min_cases: int,
     case_dir_pattern: Optional[str],
     required_patch_files: List[str],
-    sample_cases_per_split: int,
     critical_checks: Set[str],
     issues: List[Issue],
 ) -> dict:
-    if not split_dir.is_dir():
-        _add_issue(issues, "nonempty", f"[{split_name}] missing dir: {split_dir}", critical_checks)
+    if not snap.exists:
+        _add_issue(issues, "nonempty", f"[{split_name}] missing dir: {snap.path}", critical_checks)
         return {"n_cases": 0, "sample_checked": 0}
 
-    case_dirs = sorted([p for p in split_dir.iterdir() if p.is_dir()])
-    n_cases = len(case_dirs)
+    n_cases = len(snap.cases)
     if n_cases < min_cases:
         _add_issue(
             issues,
             "nonempty",
             f"[{split_name}] too few cases: {n_cases} < {min_cases}",
             critical_checks,
-            context=str(split_dir),
+            context=str(snap.path),
         )
 
     if case_dir_pattern:
         rx = re.compile(case_dir_pattern)
-        bad = [p.name for p in case_dirs if not rx.match(p.name)]
+        bad = [name for name in snap.cases if not rx.match(name)]
         if bad:
             _add_issue(
                 issues,
@@ -98,23 +285,25 @@ def _check_case_dirs(
             )
 
     sample_checked = 0
-    for case_dir in case_dirs[: max(0, sample_cases_per_split)]:
-        patch_dirs = sorted([p for p in case_dir.iterdir() if p.is_dir()])
-        if not patch_dirs:
+    for case, (patch, files) in snap.samples.items():
+        if patch is None:
             _add_issue(
                 issues,
                 "dbt_structure",
-                f"[{split_name}] case has no patch dirs: {case_dir.name}",
+                f"[{split_name}] case has no patch dirs: {case}",
                 critical_checks,
             )
             continue
-        patch = patch_dirs[0]
-        missing = [f for f in required_patch_files if not (patch / f).is_file()]
+        missing = [
+            f
+            for f in required_patch_files
+            if ("/" in f and not (snap.path / case / patch / f).is_file()) or ("/" not in f and f not in files)
+        ]
         if missing:
             _add_issue(
                 issues,
                 "dbt_structure",
-                f"[{split_name}] patch missing required files: {case_dir.name}/{patch.name}",
+                f"[{split_name}] patch missing required files: {case}/{patch}",
                 critical_checks,
                 context="missing=" + ",".join(missing),
             )
@@ -123,25 +312,28 @@ def _check_case_dirs(
     return {"n_cases": n_cases, "sample_checked": sample_checked}
 
 
-def _check_dataset(dataset_cfg: dict, critical_checks: Set[str], issues: List[Issue], stats: dict) -> None:
+def _check_dataset(
+    dataset_cfg: dict,
+    scans: Optional[List[Tuple[str, FoldSnapshot]]],
+    critical_checks: Set[str],
+    issues: List[Issue],
+    stats: dict,
+) -> Dict[str, FoldSnapshot]:
+    """Run the dataset checks on the fold snapshots; returns the existing folds by fold name."""
     fold_root = _as_path(dataset_cfg.get("fold_root"))
-    if fold_root is None or not fold_root.is_dir():
+    if scans is None:
         _add_issue(issues, "nonempty", f"dataset.fold_root missing: {fold_root}", critical_checks)
-        return
+        return {}
 
     fold_indices = dataset_cfg.get("fold_indices", [0, 1, 2, 3])
     prepared_relpath = dataset_cfg.get("prepared_relpath", "training_data_seed42_ok")
-    train_subdir = dataset_cfg.get("train_subdir", "training_datasets")
-    test_subdir = dataset_cfg.get("test_subdir", "test_datasets")
     min_train_cases = int(dataset_cfg.get("min_train_cases", 1))
     min_test_cases = int(dataset_cfg.get("min_test_cases", 1))
     case_dir_pattern = dataset_cfg.get("case_dir_pattern", r"^.+_z\d+$")
-    sample_cases_per_split = int(dataset_cfg.get("sample_cases_per_split", 3))
     required_patch_files = dataset_cfg.get(
         "required_patch_files",
         ["node_img.tif", "node_matrix_1.txt", "node_matrix_2.txt", "node_matrix_3.txt"],
     )
-    suspicious_globs = dataset_cfg.get("suspicious_globs", ["training_data_seed42training_datasets*"])
 
     dataset_stats = {
         "fold_root": str(fold_root),
@@ -149,42 +341,34 @@ def _check_dataset(dataset_cfg: dict, critical_checks: Set[str], issues: List[Is
         "folds": {},
     }
 
-    for fold in fold_indices:
-        fold_name = f"fold{fold}"
-        fold_dir = fold_root / fold_name
-        if not fold_dir.is_dir():
-            _add_issue(issues, "split", f"missing fold dir: {fold_dir}", critical_checks)
+    existing: Dict[str, FoldSnapshot] = {}
+    for fold_name, snap in scans:
+        if not snap.exists:
+            _add_issue(issues, "split", f"missing fold dir: {snap.path}", critical_checks)
             continue
-
-        prepared_dir = fold_dir / prepared_relpath
-        train_dir = prepared_dir / train_subdir
-        test_dir = prepared_dir / test_subdir
+        existing[fold_name] = snap
 
         train_stat = _check_case_dirs(
             f"{fold_name}:train",
-            train_dir,
+            snap.train,
             min_train_cases,
             case_dir_pattern,
             required_patch_files,
-            sample_cases_per_split,
             critical_checks,
             issues,
         )
         test_stat = _check_case_dirs(
             f"{fold_name}:test",
-            test_dir,
+            snap.test,
             min_test_cases,
             case_dir_pattern,
             required_patch_files,
-            sample_cases_per_split,
             critical_checks,
             issues,
         )
 
-        if train_dir.is_dir() and test_dir.is_dir():
-            train_cases = {p.name for p in train_dir.iterdir() if p.is_dir()}
-            test_cases = {p.name for p in test_dir.iterdir() if p.is_dir()}
-            overlap = train_cases & test_cases
+        if snap.train.exists and snap.test.exists:
+            overlap = set(snap.train.cases) & set(snap.test.cases)
             if overlap:
                 _add_issue(
                     issues,
@@ -194,25 +378,206 @@ def _check_dataset(dataset_cfg: dict, critical_checks: Set[str], issues: List[Is
                     context=", ".join(sorted(list(overlap))[:5]),
                 )
 
-        suspicious_hits = []
-        for pat in suspicious_globs:
-            suspicious_hits.extend([str(p) for p in fold_dir.glob(pat)])
-        if suspicious_hits:
+        if snap.suspicious:
             _add_issue(
                 issues,
                 "dbt_hygiene",
-                f"{fold_name} suspicious paths found: {len(suspicious_hits)}",
+                f"{fold_name} suspicious paths found: {len(snap.suspicious)}",
                 critical_checks,
-                context="; ".join(suspicious_hits[:5]),
+                context="; ".join(snap.suspicious[:5]),
             )
 
         dataset_stats["folds"][fold_name] = {
-            "prepared_dir": str(prepared_dir),
+            "prepared_dir": str(snap.path / prepared_relpath),
             "train": train_stat,
             "test": test_stat,
         }
 
     stats["dataset"] = dataset_stats
+    return existing
+
+
+def _image_header(path: Path) -> Tuple[Optional[str], str]:
+    """(error or None, "shape/dtype/pages") from the TIFF header and IFDs only; no pixel data is read."""
+    import tifffile
+
+    try:
+        with tifffile.TiffFile(path) as tf:
+            n_pages = len(tf.pages)
+            series = tf.series[0] if tf.series else None
+            if n_pages == 0 or series is None:
+                return "no image pages", ""
+            shape = tuple(series.shape)
+            if 0 in shape:
+                return f"empty shape {shape}", ""
+            return None, f"{'x'.join(map(str, shape))}/{series.dtype}/{n_pages}"
+    except Exception as exc:
+        return f"unreadable tiff ({type(exc).__name__}: {exc})", ""
+
+
+def _matrix_rows(path: Path) -> Tuple[Optional[str], int]:
+    """(error or None, number of non-empty rows) of a node_matrix text file."""
+    try:
+        with open(path, "rb") as f:
+            return None, sum(1 for line in f if line.strip())
+    except OSError as exc:
+        return f"unreadable ({exc.strerror})", 0
+
+
+def _validate_case(task: Tuple[str, str, List[str]]) -> dict:
+    """Validate every patch dir of one case (runs in a worker process)."""
+    split_name, case_dir, required_patch_files = task
+    case_path = Path(case_dir)
+    out = {
+        "split": split_name,
+        "case": case_path.name,
+        "patches": 0,
+        "files": 0,
+        "bad": [],
+        "image_kinds": Counter(),
+        "matrix_rows": 0,
+        "empty_matrices": 0,
+    }
+    try:
+        patches, _ = _scan_dir(case_path)
+    except OSError as exc:
+        out["bad"].append((case_path.name, f"unreadable case dir ({exc.strerror})"))
+        return out
+    if not patches:
+        out["bad"].append((case_path.name, "no patch dirs"))
+    for patch in patches:
+        patch_path = case_path / patch
+        rel = f"{case_path.name}/{patch}"
+        out["patches"] += 1
+        try:
+            _, files = _scan_dir(patch_path)
+        except OSError as exc:
+            out["bad"].append((rel, f"unreadable patch dir ({exc.strerror})"))
+            continue
+        present = set(files)
+        missing = [f for f in required_patch_files if f not in present and not (patch_path / f).is_file()]
+        if missing:
+            out["bad"].append((rel, "missing=" + ",".join(missing)))
+        for name in required_patch_files:
+            if name in missing:
+                continue
+            out["files"] += 1
+            if name.endswith((".tif", ".tiff")):
+                err, kind = _image_header(patch_path / name)
+                if err:
+                    out["bad"].append((f"{rel}/{name}", err))
+                else:
+                    out["image_kinds"][f"{name}:{kind}"] += 1
+            elif name.endswith(".txt"):
+                err, rows = _matrix_rows(patch_path / name)
+                if err:
+                    out["bad"].append((f"{rel}/{name}", err))
+                out["matrix_rows"] += rows
+                out["empty_matrices"] += int(err is None and rows == 0)
+    return out
+
+
+def _check_full(
+    snapshots: Dict[str, FoldSnapshot],
+    dataset_cfg: dict,
+    critical_checks: Set[str],
+    issues: List[Issue],
+    stats: dict,
+    workers: int,
+) -> None:
+    """Validate every patch dir of every case in the snapshots (``--full``) on a process pool."""
+    required_patch_files = dataset_cfg.get(
+        "required_patch_files",
+        ["node_img.tif", "node_matrix_1.txt", "node_matrix_2.txt", "node_matrix_3.txt"],
+    )
+    tasks = []
+    for fold_name, snap in snapshots.items():
+        for split, split_snap in (("train", snap.train), ("test", snap.test)):
+            for case in split_snap.cases:
+                tasks.append((f"{fold_name}:{split}", str(split_snap.path / case), required_patch_files))
+    if not tasks:
+        return
+
+    t0 = time.monotonic()
+    per_split: Dict[str, dict] = {}
+    with ProcessPoolExecutor(max_workers=workers or None) as ex:
+        chunksize = max(1, len(tasks) // (8 * (workers or os.cpu_count() or 1)))
+        for res in ex.map(_validate_case, tasks, chunksize=chunksize):
+            agg = per_split.setdefault(
+                res["split"],
+                {"cases": 0, "patches": 0, "files": 0, "bad": [], "n_bad": 0, "image_kinds": Counter(),
+                 "matrix_rows": 0, "empty_matrices": 0},
+            )
+            agg["cases"] += 1
+            for key in ("patches", "files", "matrix_rows", "empty_matrices"):
+                agg[key] += res[key]
+            agg["n_bad"] += len(res["bad"])
+            agg["bad"].extend(res["bad"][: max(0, 5 - len(agg["bad"]))])
+            agg["image_kinds"].update(res["image_kinds"])
+    elapsed = time.monotonic() - t0
+
+    full_stats: dict = {"folds": {}}
+    for split_name in sorted(per_split):
+        agg = per_split[split_name]
+        fold_name, split = split_name.split(":")
+        if agg["n_bad"]:
+            _add_issue(
+                issues,
+                "dbt_structure",
+                f"[{split_name}] invalid patches/files: {agg['n_bad']}",
+                critical_checks,
+                context="; ".join(f"{p}: {why}" for p, why in agg["bad"]),
+            )
+        if len(agg["image_kinds"]) > 1:
+            _add_issue(
+                issues,
+                "dbt_content",
+                f"[{split_name}] mixed image shapes/dtypes: {len(agg['image_kinds'])}",
+                critical_checks,
+                context=", ".join(f"{k}={n}" for k, n in agg["image_kinds"].most_common(5)),
+            )
+        full_stats["folds"].setdefault(fold_name, {})[split] = {
+            "cases": agg["cases"],
+            "patches": agg["patches"],
+            "files": agg["files"],
+            "invalid": agg["n_bad"],
+            "matrix_rows": agg["matrix_rows"],
+            "empty_matrices": agg["empty_matrices"],
+            "image_kinds": dict(agg["image_kinds"]),
+        }
+    n_patches = sum(a["patches"] for a in per_split.values())
+    n_files = sum(a["files"] for a in per_split.values())
+    full_stats.update(
+        {
+            "workers": workers or os.cpu_count(),
+            "elapsed_sec": round(elapsed, 3),
+            "patches": n_patches,
+            "files": n_files,
+            "patches_per_sec": round(n_patches / elapsed, 1) if elapsed > 0 else None,
+            "files_per_sec": round(n_files / elapsed, 1) if elapsed > 0 else None,
+        }
+    )
+    stats["full"] = full_stats
+
+
+def _cache_key(contract: dict, mode: str, full: bool) -> str:
+    payload = {"v": CACHE_VERSION, "contract": contract, "mode": mode, "full": full}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _load_cached(cache_path: Path, fingerprint: str) -> Optional[dict]:
+    try:
+        entry = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return entry if entry.get("fingerprint") == fingerprint else None
+
+
+def _save_cached(cache_path: Path, entry: dict) -> None:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_name(f".{cache_path.name}.tmp")
+    tmp.write_text(json.dumps(entry, indent=2), encoding="utf-8")
+    os.replace(tmp, cache_path)
 
 
 def main() -> int:
@@ -220,6 +585,19 @@ def main() -> int:
     ap.add_argument("--contract", required=True, help="Run contract JSON path")
     ap.add_argument("--report", required=True, help="Output report JSON path")
     ap.add_argument("--mode", choices=["strict", "hybrid", "warn"], default="hybrid")
+    ap.add_argument("--scan-workers", type=int, default=0, help="Threads for fold scanning (0 = one per fold)")
+    ap.add_argument(
+        "--full",
+        action="store_true",
+        help="Validate every patch dir (TIFF headers, node_matrix rows); also enabled by dataset.full_check",
+    )
+    ap.add_argument("--workers", type=int, default=0, help="Processes for --full validation (0 = all CPUs)")
+    ap.add_argument(
+        "--cache-dir",
+        default=str(DEFAULT_CACHE_DIR),
+        help="Dataset check results keyed on contract + dataset fingerprint",
+    )
+    ap.add_argument("--no-cache", action="store_true", help="Always re-run the dataset checks")
     args = ap.parse_args()
 
     contract_path = Path(args.contract).resolve()
@@ -238,7 +616,38 @@ def main() -> int:
     stats: dict = {"contract": str(contract_path)}
 
     dataset_cfg = contract.get("dataset", {})
-    _check_dataset(dataset_cfg, critical_checks_cfg, issues, stats)
+    full = args.full or bool(dataset_cfg.get("full_check", False))
+    if full:
+        # every patch is validated below, so skip the sampled patch check
+        dataset_cfg = {**dataset_cfg, "sample_cases_per_split": 0}
+    scans = _scan_dataset(dataset_cfg, args.scan_workers, stat_cases=full)
+
+    # dataset checks are reused while the contract and the dataset fingerprint are unchanged;
+    # the output check below is cheap and always runs live
+    cache_path = None
+    cached = None
+    fingerprint = dataset_fingerprint(scans)
+    if not args.no_cache:
+        cache_path = Path(args.cache_dir).expanduser() / f"dbt_{_cache_key(contract, args.mode, full)[:16]}.json"
+        cached = _load_cached(cache_path, fingerprint)
+    if cached is not None:
+        issues.extend(Issue(**i) for i in cached["issues"])
+        stats.update(cached["stats"])
+    else:
+        snapshots = _check_dataset(dataset_cfg, scans, critical_checks_cfg, issues, stats)
+        if full:
+            _check_full(snapshots, dataset_cfg, critical_checks_cfg, issues, stats, args.workers)
+        if cache_path is not None:
+            _save_cached(
+                cache_path,
+                {
+                    "fingerprint": fingerprint,
+                    "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "contract": str(contract_path),
+                    "issues": [asdict(i) for i in issues],
+                    "stats": {k: v for k, v in stats.items() if k in ("dataset", "full")},
+                },
+            )
 
     out_cfg = contract.get("output")
     if out_cfg:
@@ -252,13 +661,22 @@ def main() -> int:
         "mode": args.mode,
         "adapter": "dbt",
         "critical_checks": sorted(list(critical_checks_cfg)),
+        "cached": cached is not None,
+        "cache": {
+            "path": str(cache_path) if cache_path else None,
+            "fingerprint": fingerprint,
+            "created": cached["created"] if cached else None,
+        },
         "stats": stats,
         "errors": errors,
         "warnings": warns,
     }
     report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
 
-    print(f"preflight_ok={ok} errors={len(errors)} warnings={len(warns)} report={report_path}")
+    print(
+        f"preflight_ok={ok} errors={len(errors)} warnings={len(warns)} "
+        f"cached={cached is not None} report={report_path}"
+    )
     return 0 if ok else 2
 
 
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Resource-aware scheduler for method x fold training jobs.
+
+Reads a queue JSON, expands method entries into one job per fold and runs
+jobs concurrently while their declared budgets fit:
+- cpus:    CPU cores (also exported as OMP_NUM_THREADS / nnUNet_n_proc_DA, overriding
+           values inherited from the shell or nnunet_env.sh; only the job's own
+           "env" can set them differently)
+- mem_gb:  declared host memory
+- devices: device slots (GPU ids from --devices, exported as CUDA_VISIBLE_DEVICES);
+           0 for CPU-only jobs such as preprocessing
+
+Resume/skip follows run_fold in scripts/run_4models_4fold_seed42_resume.sh:
+checkpoint_latest.pth -> resume (--c), else checkpoint_final.pth -> skip,
+else start. Job states are persisted to logs/scheduler/<queue>.state.json after every
+change; a killed scheduler restarts interrupted jobs (which then resume from
+their checkpoints) and keeps finished ones. On SIGINT/SIGTERM running jobs get
+SIGTERM and, after --kill-grace-sec (or a second signal), SIGKILL, so a hung
+trainer cannot keep its devices after the scheduler exits.
+
+Queue format:
+{
+  "defaults": {"config": "2d", "cpus": 8, "mem_gb": 24, "devices": 1,
+               "env": {"PYTHONHASHSEED": "42"}},
+  "jobs": [
+    {"method_dir": "nnunet_dice_cldice", "dataset_id": 1,
+     "dataset": "Dataset001_20241206_MyelinConfData",
+     "trainer": "nnUNetTrainerCLDice", "plans": "nnUNetPlans", "folds": [0, 1, 2, 3]},
+    {"id": "prep_k3", "command": ["python", "tools/nnunet_prep/..."], "devices": 0, "cpus": 4}
+  ]
+}
+Entries with "command" run as-is (no checkpoint logic); "after": [job ids]
+delays a job until those jobs are done. Training entries may override
+"command" with a stand-in (format fields: dataset_id, config, fold, trainer,
+plans, method_dir, dataset) and "results_dir" to test without nnUNet.
+
+Usage:
+  python tools/guardrails/job_scheduler.py --queue scripts/queues/4models_4fold_seed42.json \
+      --cpus 32 --mem-gb 120 --devices 0
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+TRAIN_COMMAND = ["nnUNetv2_train", "{dataset_id}", "{config}", "{fold}", "-tr", "{trainer}", "-p", "{plans}"]
+RESUME_ARGS = ["--c"]
+STATES = ("pending", "running", "done", "skipped", "failed")
+
+
+@dataclass
+class Job:
+    id: str
+    command: List[str]
+    cpus: int = 1
+    mem_gb: float = 0.0
+    devices: int = 0
+    env: Dict[str, str] = field(default_factory=dict)
+    after: List[str] = field(default_factory=list)
+    # training jobs only
+    method_dir: Optional[str] = None
+    fold_dir: Optional[str] = None
+    resume_args: List[str] = field(default_factory=list)
+    # set when the job cannot run (e.g. method without nnunet_env.sh); it is marked failed
+    error: str = ""
+
+
+@dataclass
+class JobState:
+    status: str = "pending"
+    attempts: int = 0
+    rc: Optional[int] = None
+    action: str = ""
+    devices: List[str] = field(default_factory=list)
+    started: str = ""
+    finished: str = ""
+    log: str = ""
+
+
+_ENV_CACHE: Dict[str, Dict[str, str]] = {}
+
+
+def method_env(method_dir: str) -> Dict[str, str]:
+    """Environment after sourcing methods/<method_dir>/nnunet_env.sh (current env if it has none)."""
+    if method_dir not in _ENV_CACHE:
+        env_sh = ROOT_DIR / "methods" / method_dir / "nnunet_env.sh"
+        if not env_sh.is_file():
+            _ENV_CACHE[method_dir] = dict(os.environ)
+        else:
+            out = subprocess.run(
+                ["bash", "-c", 'source "$1" >/dev/null && env -0', "bash", str(env_sh)],
+                check=True,
+                capture_output=True,
+            ).stdout
+            _ENV_CACHE[method_dir] = dict(
+                item.split("=", 1) for item in out.decode().split("\0") if "=" in item
+            )
+    return _ENV_CACHE[method_dir]
+
+
+def expand_queue(queue: dict) -> List[Job]:
+    defaults = queue.get("defaults", {})
+    jobs: List[Job] = []
+    for entry in queue.get("jobs", []):
+        spec = {**defaults, **entry}
+        env = {**defaults.get("env", {}), **entry.get("env", {})}
+        common = {
+            "cpus": int(spec.get("cpus", 1)),
+            "mem_gb": float(spec.get("mem_gb", 0)),
+            "devices": int(spec.get("devices", 0)),
+            "env": {k: str(v) for k, v in env.items()},
+            "after": list(spec.get("after", [])),
+        }
+        if "method_dir" not in spec:
+            jobs.append(Job(id=spec["id"], command=[str(c) for c in spec["command"]], **common))
+            continue
+        config = spec.get("config", "2d")
+        for fold in spec.get("folds", [0, 1, 2, 3]):
+            fields = {
+                "dataset_id": spec["dataset_id"],
+                "dataset": spec["dataset"],
+                "trainer": spec["trainer"],
+                "plans": spec["plans"],
+                "config": config,
+                "fold": fold,
+                "method_dir": spec["method_dir"],
+            }
+            results = spec.get("results_dir") or method_env(spec["method_dir"]).get("nnUNet_results")
+            run_dir = f"{spec['trainer']}__{spec['plans']}__{config}"
+            fold_dir = Path(results) / spec["dataset"] / run_dir / f"fold_{fold}" if results else None
+            jobs.append(
+                Job(
+                    id=spec.get("id", f"{spec['method_dir']}/{spec['dataset']}/{run_dir}") + f"/fold_{fold}",
+                    command=[str(c).format(**fields) for c in spec.get("command", TRAIN_COMMAND)],
+                    method_dir=spec["method_dir"],
+                    fold_dir=str(fold_dir) if fold_dir else None,
+                    resume_args=[str(a) for a in spec.get("resume_args", RESUME_ARGS)],
+                    error="" if results else f"no nnUNet_results (methods/{spec['method_dir']}/nnunet_env.sh or results_dir)",
+                    **common,
+                )
+            )
+    ids = [j.id for j in jobs]
+    dup = {i for i in ids if ids.count(i) > 1}
+    if dup:
+        raise ValueError(f"duplicate job ids: {sorted(dup)}")
+    unknown = {a for j in jobs for a in j.after if a not in ids}
+    if unknown:
+        raise ValueError(f"unknown 'after' job ids: {sorted(unknown)}")
+    return jobs
+
+
+def resume_action(job: Job) -> str:
+    """'resume' | 'skip' | 'start', with the same precedence as run_fold."""
+    if job.fold_dir is None:
+        return "start"
+    fold_dir = Path(job.fold_dir)
+    if (fold_dir / "checkpoint_latest.pth").is_file():
+        return "resume"
+    if (fold_dir / "checkpoint_final.pth").is_file():
+        return "skip"
+    return "start"
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Scheduler:
+    def __init__(
+        self,
+        jobs: List[Job],
+        state_path: Path,
+        log_dir: Path,
+        cpus: int,
+        mem_gb: float,
+        devices: List[str],
+        max_attempts: int,
+        dry_run: bool = False,
+        kill_grace_sec: float = 30.0,
+    ) -> None:
+        self.jobs = {j.id: j for j in jobs}
+        self.order = [j.id for j in jobs]
+        self.state_path = state_path
+        self.log_dir = log_dir
+        self.cpus = cpus
+        self.mem_gb = mem_gb
+        self.free_devices = list(devices)
+        self.n_devices = len(devices)
+        self.max_attempts = max_attempts
+        self.dry_run = dry_run
+        self.procs: Dict[str, subprocess.Popen] = {}
+        self.stopping = False
+        self.kill_grace_sec = kill_grace_sec
+        self.kill_deadline: Optional[float] = None
+        self.state: Dict[str, JobState] = {i: JobState() for i in self.order}
+        self._load_state()
+
+    # -- persistence -------------------------------------------------
+    def _load_state(self) -> None:
+        if not self.state_path.is_file():
+            return
+        saved = json.loads(self.state_path.read_text(encoding="utf-8")).get("jobs", {})
+        for job_id, rec in saved.items():
+            if job_id not in self.state:
+                continue
+            st = JobState(**rec)
+            if st.status == "running":
+                # scheduler died while the job ran: run it again (it resumes from its checkpoint)
+                st.status, st.devices, st.attempts = "pending", [], max(0, st.attempts - 1)
+            self.state[job_id] = st
+
+    def save(self) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_name(f".{self.state_path.name}.tmp")
+        payload = {"updated": _now(), "jobs": {i: asdict(self.state[i]) for i in self.order}}
+        tmp.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    # -- scheduling --------------------------------------------------
+    def _used(self) -> tuple:
+        running = [self.jobs[i] for i in self.procs]
+        return sum(j.cpus for j in running), sum(j.mem_gb for j in running)
+
+    def _fits(self, job: Job) -> bool:
+        cpu_used, mem_used = self._used()
+        if not self.procs:
+            # an oversized job still runs alone rather than blocking the queue forever
+            return job.devices <= len(self.free_devices)
+        return (
+            cpu_used + job.cpus <= self.cpus
+            and mem_used + job.mem_gb <= self.mem_gb
+            and job.devices <= len(self.free_devices)
+        )
+
+    def _ready(self, job: Job) -> bool:
+        return all(self.state[a].status in ("done", "skipped") for a in job.after)
+
+    def _launch(self, job: Job) -> None:
+        st = self.state[job.id]
+        action = resume_action(job)
+        st.action = action
+        if action == "skip":
+            print(f"[skip] {job.id} (checkpoint_final exists)", flush=True)
+            st.status, st.finished = "skipped", _now()
+            return
+        cmd = job.command + (job.resume_args if action == "resume" else [])
+        devs = [self.free_devices.pop(0) for _ in range(job.devices)]
+        env = dict(method_env(job.method_dir)) if job.method_dir else dict(os.environ)
+        # the cpus budget wins over inherited values; an explicit job env entry wins over both
+        env["OMP_NUM_THREADS"] = str(job.cpus)
+        env["nnUNet_n_proc_DA"] = str(job.cpus)
+        env.update(job.env)
+        if job.devices:
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(devs)
+        log = self.log_dir / (job.id.replace("/", "__") + ".log")
+        log.parent.mkdir(parents=True, exist_ok=True)
+        st.status, st.attempts, st.devices = "running", st.attempts + 1, devs
+        st.started, st.finished, st.rc, st.log = _now(), "", None, str(log)
+        print(f"[{action}] {job.id} devices={','.join(devs) or '-'} log={log}", flush=True)
+        if self.dry_run:
+            print("  " + " ".join(cmd), flush=True)
+            st.status, st.rc, st.finished = "done", 0, _now()
+            self.free_devices.extend(devs)
+            return
+        with open(log, "ab") as fh:
+            fh.write(f"# {_now()} [{action}] {' '.join(cmd)}\n".encode())
+            fh.flush()
+            self.procs[job.id] = subprocess.Popen(
+                cmd, stdout=fh, stderr=subprocess.STDOUT, env=env, cwd=ROOT_DIR, start_new_session=True
+            )
+
+    def _reap(self) -> bool:
+        changed = False
+        for job_id, proc in list(self.procs.items()):
+            rc = proc.poll()
+            if rc is None:
+                continue
+            del self.procs[job_id]
+            st = self.state[job_id]
+            self.free_devices.extend(st.devices)
+            self.free_devices.sort(key=lambda d: (len(d), d))
+            st.rc, st.finished = rc, _now()
+            if self.stopping:
+                # interrupted by the scheduler, not a failed attempt
+                st.status, st.attempts = "pending", max(0, st.attempts - 1)
+            elif rc == 0:
+                st.status = "done"
+            else:
+                st.status = "pending" if st.attempts < self.max_attempts else "failed"
+            print(f"[exit] {job_id} rc={rc} -> {st.status}", flush=True)
+            changed = True
+        return changed
+
+    def _blocked(self, job: Job) -> bool:
+        return any(self.state[a].status == "failed" for a in job.after)
+
+    def step(self) -> bool:
+        """Reap finished jobs and launch every pending job that fits. Returns True if work remains."""
+        changed = self._reap()
+        if self.procs and self.kill_deadline is not None and time.monotonic() >= self.kill_deadline:
+            self._signal_jobs(signal.SIGKILL)
+            self.kill_deadline = None
+        if not self.stopping:
+            for job_id in self.order:
+                job, st = self.jobs[job_id], self.state[job_id]
+                if st.status != "pending" or not self._ready(job):
+                    if st.status == "pending" and self._blocked(job):
+                        st.status, st.finished = "failed", _now()
+                        print(f"[blocked] {job_id}: a dependency failed", flush=True)
+                        changed = True
+                    continue
+                if job.error:
+                    st.status, st.finished = "failed", _now()
+                    print(f"[error] {job_id}: {job.error}", flush=True)
+                    changed = True
+                    continue
+                if job.devices > self.n_devices:
+                    st.status = "failed"
+                    print(f"[error] {job_id} needs {job.devices} device slots, only {self.n_devices}", flush=True)
+                    changed = True
+                    continue
+                if self._fits(job):
+                    self._launch(job)
+                    changed = True
+        if changed:
+            self.save()
+        if self.procs:
+            return True
+        if self.stopping:
+            return False
+        return any(
+            self.state[i].status == "pending" and self._ready(self.jobs[i]) for i in self.order
+        )
+
+    def _signal_jobs(self, sig: signal.Signals) -> None:
+        for job_id, proc in self.procs.items():
+            if sig == signal.SIGKILL:
+                print(f"[kill] {job_id} did not exit after SIGTERM", file=sys.stderr, flush=True)
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def stop(self) -> None:
+        """Terminate running jobs (whole process groups); they stay pending for the next start.
+
+        Jobs still running ``kill_grace_sec`` later, or at a second stop(), get SIGKILL.
+        """
+        if self.stopping:
+            self._signal_jobs(signal.SIGKILL)
+            self.kill_deadline = None
+            return
+        self.stopping = True
+        self._signal_jobs(signal.SIGTERM)
+        self.kill_deadline = time.monotonic() + self.kill_grace_sec
+
+    def run(self, poll_sec: float) -> int:
+        while self.step():
+            time.sleep(poll_sec)
+        self.save()
+        counts = {s: sum(1 for st in self.state.values() if st.status == s) for s in STATES}
+        print("scheduler " + " ".join(f"{k}={v}" for k, v in counts.items()), flush=True)
+        if self.stopping:
+            return 130
+        return 0 if counts["failed"] == 0 and counts["pending"] == 0 else 1
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Run method x fold jobs concurrently under CPU/memory/device budgets")
+    ap.add_argument("--queue", required=True, help="Queue JSON")
+    ap.add_argument("--state", default=None, help="Persisted job states (default: <log-dir>/<queue>.state.json)")
+    ap.add_argument("--log-dir", default=str(ROOT_DIR / "logs" / "scheduler"))
+    ap.add_argument("--cpus", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--mem-gb", type=float, default=None, help="Memory budget (default: MemTotal)")
+    ap.add_argument("--devices", default="0", help="Comma-separated device slots, e.g. 0,1 ('' for none)")
+    ap.add_argument("--max-attempts", type=int, default=1, help="Runs per job before it is marked failed")
+    ap.add_argument("--poll-sec", type=float, default=2.0)
+    ap.add_argument("--retry-failed", action="store_true", help="Reset failed jobs to pending on start")
+    ap.add_argument("--dry-run", action="store_true", help="Print resume/skip/start decisions and commands only")
+    ap.add_argument(
+        "--kill-grace-sec",
+        type=float,
+        default=30.0,
+        help="Seconds between SIGTERM and SIGKILL for running jobs when stopping",
+    )
+    args = ap.parse_args()
+
+    queue_path = Path(args.queue).resolve()
+    jobs = expand_queue(json.loads(queue_path.read_text(encoding="utf-8")))
+    state_path = Path(args.state) if args.state else Path(args.log_dir) / f"{queue_path.stem}.state.json"
+    mem_gb = args.mem_gb
+    if mem_gb is None:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            mem_gb = int(f.readline().split()[1]) / (1024.0 * 1024.0)
+    devices = [d.strip() for d in args.devices.split(",") if d.strip()]
+
+    sched = Scheduler(
+        jobs,
+        state_path,
+        Path(args.log_dir),
+        args.cpus,
+        mem_gb,
+        devices,
+        args.max_attempts,
+        dry_run=args.dry_run,
+        kill_grace_sec=args.kill_grace_sec,
+    )
+    if args.retry_failed:
+        for st in sched.state.values():
+            if st.status == "failed":
+                st.status, st.attempts = "pending", 0
+    if args.dry_run:
+        # decisions only: never persist dry-run states
+        sched.save = lambda: None  # type: ignore[method-assign]
+
+    def _on_signal(signum, frame) -> None:
+        print(f"[signal] {signal.Signals(signum).name}: stopping running jobs", file=sys.stderr, flush=True)
+        sched.stop()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+    print(
+        f"scheduler jobs={len(jobs)} cpus={args.cpus} mem_gb={mem_gb:.1f} "
+        f"devices={','.join(devices) or '-'} state={state_path}",
+        flush=True,
+    )
+    return sched.run(args.poll_sec)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Process-tree resource sampler for guarded runs (Linux /proc).
+
+Samples the supervised process and all of its descendants (data-loader
+workers included) every --interval seconds:
+- RSS (and PSS from smaps_rollup every --pss-every samples, where available)
+- CPU% (utime + stime deltas, 100% = one core)
+- read/write bytes from /proc/<pid>/io (storage) and rchar/wchar (all I/O)
+- process and thread counts
+
+Writes a compact time-series TSV (default: <status>_resources.tsv next to
+status.tsv), keeps the status.tsv heartbeat rows every --heartbeat-sec, and
+at exit writes peak/percentile summaries (<status>_resources.json) plus a
+"resources" row in status.tsv. Exits when the supervised pid exits.
+
+Usage (from scripts/nnunet_guarded_run.sh):
+  python3 tools/guardrails/resource_monitor.py --pid <child_pid> --status-tsv <run.tsv> \
+      --interval 0.5 --heartbeat-sec 30
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MB = 1024.0 * 1024.0
+TSV_HEADER = [
+    "t_sec",
+    "n_procs",
+    "n_threads",
+    "rss_mb",
+    "pss_mb",
+    "cpu_pct",
+    "read_mb_s",
+    "write_mb_s",
+    "rchar_mb_s",
+    "wchar_mb_s",
+    "read_mb",
+    "write_mb",
+    "gpu_mib",
+]
+SUMMARY_KEYS = ["n_procs", "n_threads", "rss_mb", "pss_mb", "cpu_pct", "read_mb_s", "write_mb_s", "rchar_mb_s", "wchar_mb_s"]
+
+
+@dataclass
+class ProcSample:
+    ppid: int
+    state: str
+    ticks: int
+    threads: int
+    rss: int
+    io: Optional[Tuple[int, int, int, int]]  # read_bytes, write_bytes, rchar, wchar
+
+
+def _read_stat(pid: int) -> Optional[ProcSample]:
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            raw = f.read().decode(errors="replace")
+    except OSError:
+        return None
+    # comm may contain spaces/parentheses: split after the last ')'
+    fields = raw[raw.rfind(")") + 2 :].split()
+    return ProcSample(
+        ppid=int(fields[1]),
+        state=fields[0],
+        ticks=int(fields[11]) + int(fields[12]),
+        threads=int(fields[17]),
+        rss=int(fields[21]) * PAGE_SIZE,
+        io=None,
+    )
+
+
+def _read_io(pid: int) -> Optional[Tuple[int, int, int, int]]:
+    try:
+        with open(f"/proc/{pid}/io", "rb") as f:
+            vals = dict(line.split(b":", 1) for line in f.read().splitlines() if b":" in line)
+        return (
+            int(vals.get(b"read_bytes", 0)),
+            int(vals.get(b"write_bytes", 0)),
+            int(vals.get(b"rchar", 0)),
+            int(vals.get(b"wchar", 0)),
+        )
+    except (OSError, ValueError):
+        return None
+
+
+def _read_pss(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "rb") as f:
+            for line in f:
+                if line.startswith(b"Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def _children(pid: int) -> Optional[List[int]]:
+    """Direct children from /proc/<pid>/task/*/children, or None if the kernel lacks it."""
+    out: List[int] = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return []
+    for tid in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children", "rb") as f:
+                out.extend(int(c) for c in f.read().split())
+        except FileNotFoundError:
+            return None
+        except OSError:
+            continue
+    return out
+
+
+def process_tree(root: int) -> Dict[int, ProcSample]:
+    """Stat samples of ``root`` and all descendants (zombies excluded)."""
+    tree: Dict[int, ProcSample] = {}
+    root_stat = _read_stat(root)
+    if root_stat is None or root_stat.state == "Z":
+        return tree
+    tree[root] = root_stat
+    queue = [root]
+    use_children_files = True
+    while queue and use_children_files:
+        pid = queue.pop()
+        kids = _children(pid)
+        if kids is None:
+            use_children_files = False
+            break
+        for kid in kids:
+            st = _read_stat(kid)
+            if st is not None and st.state != "Z":
+                tree[kid] = st
+                queue.append(kid)
+    if not use_children_files:
+        # fallback: one pass over /proc building the ppid map
+        by_parent: Dict[int, List[Tuple[int, ProcSample]]] = {}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            st = _read_stat(int(name))
+            if st is not None and st.state != "Z":
+                by_parent.setdefault(st.ppid, []).append((int(name), st))
+        tree = {root: root_stat}
+        queue = [root]
+        while queue:
+            for kid, st in by_parent.get(queue.pop(), []):
+                if kid not in tree:
+                    tree[kid] = st
+                    queue.append(kid)
+    return tree
+
+
+def gpu_mib(pids: Set[int]) -> Optional[int]:
+    """GPU memory used by ``pids`` (nvidia-smi compute apps), None without nvidia-smi."""
+    if shutil.which("nvidia-smi") is None:
+        return None
+    try:
+        out = subprocess.run(
+            ["nvidia-smi", "--query-compute-apps=pid,used_gpu_memory", "--format=csv,noheader,nounits"],
+            capture_output=True,
+            text=True,
+            timeout=10,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    total = 0
+    for line in out.splitlines():
+        parts = [p.strip() for p in line.split(",")]
+        if len(parts) == 2 and parts[0].isdigit() and int(parts[0]) in pids and parts[1].isdigit():
+            total += int(parts[1])
+    return total
+
+
+def _percentile(values: List[float], q: float) -> float:
+    s = sorted(values)
+    if not s:
+        return float("nan")
+    k = (len(s) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def summarize(rows: List[Dict[str, Optional[float]]]) -> Dict[str, Dict[str, float]]:
+    out: Dict[str, Dict[str, float]] = {}
+    for key in SUMMARY_KEYS:
+        vals = [float(r[key]) for r in rows if r.get(key) is not None]
+        if not vals:
+            continue
+        out[key] = {
+            "peak": max(vals),
+            "mean": sum(vals) / len(vals),
+            "p50": _percentile(vals, 50),
+            "p90": _percentile(vals, 90),
+            "p99": _percentile(vals, 99),
+        }
+    return out
+
+
+class Sampler:
+    """Per-sample deltas over a process tree; I/O totals keep bytes of exited processes."""
+
+    def __init__(self, root: int, pss_every: int) -> None:
+        self.root = root
+        self.pss_every = max(1, pss_every)
+        self.n = 0
+        self.prev_ticks: Dict[int, int] = {}
+        self.prev_io: Dict[int, Tuple[int, int, int, int]] = {}
+        self.io_total = [0, 0, 0, 0]
+        self.last_pss: Optional[int] = None
+        self.t_prev: Optional[float] = None
+        self.pids: Set[int] = set()
+
+    def sample(self) -> Optional[Dict[str, Optional[float]]]:
+        tree = process_tree(self.root)
+        if not tree:
+            return None
+        now = time.monotonic()
+        dt = now - self.t_prev if self.t_prev is not None else None
+        first = self.t_prev is None
+        self.t_prev = now
+
+        ticks = 0
+        io_delta = [0, 0, 0, 0]
+        for pid, st in tree.items():
+            # new processes count from zero (they started within the interval), except on the first sample
+            prev = self.prev_ticks.get(pid, st.ticks if first else 0)
+            ticks += max(0, st.ticks - prev)
+            self.prev_ticks[pid] = st.ticks
+            io = _read_io(pid)
+            if io is not None:
+                prev_io = self.prev_io.get(pid, io if first else (0, 0, 0, 0))
+                for i in range(4):
+                    io_delta[i] += max(0, io[i] - prev_io[i])
+                self.prev_io[pid] = io
+        for pid in list(self.prev_ticks):
+            if pid not in tree:
+                self.prev_ticks.pop(pid, None)
+                self.prev_io.pop(pid, None)
+        for i in range(4):
+            self.io_total[i] += io_delta[i]
+
+        if self.n % self.pss_every == 0:
+            pss = [_read_pss(pid) for pid in tree]
+            self.last_pss = sum(p for p in pss if p is not None) if any(p is not None for p in pss) else None
+        self.n += 1
+        self.pids = set(tree)
+
+        def rate(v: int) -> Optional[float]:
+            return v / MB / dt if dt else None
+
+        return {
+            "n_procs": len(tree),
+            "n_threads": sum(st.threads for st in tree.values()),
+            "rss_mb": sum(st.rss for st in tree.values()) / MB,
+            "pss_mb": self.last_pss / MB if self.last_pss is not None else None,
+            "cpu_pct": 100.0 * ticks / CLK_TCK / dt if dt else None,
+            "read_mb_s": rate(io_delta[0]),
+            "write_mb_s": rate(io_delta[1]),
+            "rchar_mb_s": rate(io_delta[2]),
+            "wchar_mb_s": rate(io_delta[3]),
+            "read_mb": self.io_total[0] / MB,
+            "write_mb": self.io_total[1] / MB,
+        }
+
+
+def _fmt(v: Optional[float]) -> str:
+    if v is None:
+        return "na"
+    return str(v) if isinstance(v, int) else f"{v:.2f}"
+
+
+def status_row(status_tsv: Path, event: str, phase: str, pid: int, msg: str) -> None:
+    """Append a row in the nnunet_guarded_run.sh status.tsv format."""
+    with open(status_tsv, "a", encoding="utf-8") as f:
+        f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}\t{event}\t{phase}\t{pid}\t\t{msg}\n")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Sample a process tree's RSS/PSS, CPU, I/O and threads until it exits")
+    ap.add_argument("--pid", type=int, required=True, help="Root pid to supervise")
+    ap.add_argument("--interval", type=float, default=0.5, help="Sampling period in seconds")
+    ap.add_argument("--pss-every", type=int, default=4, help="Read PSS (smaps_rollup) every N samples")
+    ap.add_argument("--status-tsv", default=None, help="Guarded-run status.tsv for heartbeat/summary rows")
+    ap.add_argument("--phase", default="run")
+    ap.add_argument("--heartbeat-sec", type=float, default=30.0)
+    ap.add_argument("--gpu", action="store_true", help="Query nvidia-smi at each heartbeat")
+    ap.add_argument("--out", default=None, help="Time-series TSV (default: <status>_resources.tsv)")
+    ap.add_argument("--summary", default=None, help="Summary JSON (default: <out stem>.json)")
+    args = ap.parse_args()
+
+    status_tsv = Path(args.status_tsv) if args.status_tsv else None
+    if args.out:
+        out = Path(args.out)
+    elif status_tsv is not None:
+        out = status_tsv.with_name(f"{status_tsv.stem}_resources.tsv")
+    else:
+        out = Path(f"resources_{args.pid}.tsv")
+    summary_path = Path(args.summary) if args.summary else out.with_suffix(".json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    stop = False
+
+    def _on_signal(signum, frame) -> None:
+        nonlocal stop
+        stop = True
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+
+    sampler = Sampler(args.pid, args.pss_every)
+    rows: List[Dict[str, Optional[float]]] = []
+    t0 = time.monotonic()
+    next_beat = t0
+    gpu_last: Optional[int] = None
+    gpu_peak: Optional[int] = None
+    with open(out, "w", encoding="utf-8", buffering=1) as f:
+        f.write("\t".join(TSV_HEADER) + "\n")
+        while not stop:
+            tick = time.monotonic()
+            row = sampler.sample()
+            if row is None:
+                break
+            if tick >= next_beat:
+                if args.gpu:
+                    gpu_last = gpu_mib(sampler.pids)
+                    if gpu_last is not None:
+                        gpu_peak = max(gpu_peak or 0, gpu_last)
+                if status_tsv is not None:
+                    status_row(
+                        status_tsv,
+                        "heartbeat",
+                        args.phase,
+                        args.pid,
+                        f"rss_kb={int(row['rss_mb'] * 1024)};gpu_mib={_fmt(gpu_last)};"
+                        f"cpu_pct={_fmt(row['cpu_pct'])};procs={row['n_procs']};threads={row['n_threads']}",
+                    )
+                next_beat = tick + args.heartbeat_sec
+            row["gpu_mib"] = gpu_last
+            if row["cpu_pct"] is not None:  # first sample only primes the deltas
+                rows.append(row)
+                f.write("\t".join([f"{tick - t0:.2f}"] + [_fmt(row[k]) for k in TSV_HEADER[1:]]) + "\n")
+            time.sleep(max(0.0, args.interval - (time.monotonic() - tick)))
+
+    summary = {
+        "pid": args.pid,
+        "duration_sec": round(time.monotonic() - t0, 2),
+        "interval_sec": args.interval,
+        "samples": len(rows),
+        "read_mb_total": sampler.io_total[0] / MB,
+        "write_mb_total": sampler.io_total[1] / MB,
+        "rchar_mb_total": sampler.io_total[2] / MB,
+        "wchar_mb_total": sampler.io_total[3] / MB,
+        "gpu_mib_peak": gpu_peak,
+        "timeseries": str(out),
+        "stats": summarize(rows),
+    }
+    summary_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    stats = summary["stats"]
+
+    def peak(key: str) -> str:
+        return _fmt(stats[key]["peak"]) if key in stats else "na"
+
+    msg = (
+        f"rss_mb_peak={peak('rss_mb')};pss_mb_peak={peak('pss_mb')};cpu_pct_peak={peak('cpu_pct')};"
+        f"cpu_pct_p50={_fmt(stats['cpu_pct']['p50']) if 'cpu_pct' in stats else 'na'};"
+        f"procs_peak={peak('n_procs')};read_mb={summary['read_mb_total']:.1f};"
+        f"write_mb={summary['write_mb_total']:.1f};summary={summary_path}"
+    )
+    if status_tsv is not None:
+        status_row(status_tsv, "resources", args.phase, args.pid, msg)
+    print(f"resources {msg}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""Content-hash leakage check for train/val/test splits of an nnUNet dataset.
+
+Case directories or ids that differ by name can still carry the same or
+nearly the same slice (neighbouring planes of one stack, re-exported
+copies). For every case the centre channel in imagesTr is hashed twice:
+- exact:      blake2b of the pixel buffer (+ shape/dtype), metadata-agnostic
+- perceptual: 64-bit DCT hash of a 32x32 area-averaged thumbnail
+
+Hashes are kept in <dataset>/content_hash_index.npz stamped with file
+size/mtime_ns, so only new or changed images are read (batched, on a process
+pool). Near duplicates (Hamming distance <= --max-distance) are found by
+multi-index hashing: the 64 bits are cut into max_distance+1 bands and only
+codes sharing a band are compared, so there is no all-pairs comparison.
+Cross-split pairs are counted per group, not enumerated.
+
+Every split file is checked: nnUNet splits_final.json (list of folds) and
+dicts of case lists such as data/05_splits/*_splits.json. Files without case
+lists (e.g. *_splits_stacks.json) are skipped.
+
+Usage:
+  python tools/guardrails/split_leakage.py \
+      --dataset-dir data/00_raw/nnUNet_raw/Dataset001_20241206_MyelinConfData \
+      --report logs/leakage_Dataset001.json --workers 8
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+INDEX_NAME = "content_hash_index.npz"
+INDEX_VERSION = 1
+THUMB = 32
+HASH_SIDE = 8
+BATCH = 512
+DEFAULT_SPLITS_GLOB = str(Path(__file__).resolve().parents[2] / "data" / "05_splits" / "*.json")
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+@dataclass
+class Issue:
+    severity: str  # error|warn
+    check: str
+    message: str
+    context: str = ""
+
+
+def centre_channel(dataset_dir: Path) -> int:
+    try:
+        names = json.loads((dataset_dir / "dataset.json").read_text(encoding="utf-8"))["channel_names"]
+    except (OSError, ValueError, KeyError):
+        return 0
+    for idx, name in names.items():
+        if name == "slice_0":
+            return int(idx)
+    return len(names) // 2
+
+
+def popcount64(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x.astype(np.uint64))
+    return _POPCOUNT[x.astype(np.uint64).view(np.uint8)].reshape(*x.shape, 8).sum(axis=-1)
+
+
+def _thumbnail(img: np.ndarray) -> np.ndarray:
+    """Area-averaged THUMB x THUMB float thumbnail of a 2D plane."""
+    img = np.asarray(img, dtype=np.float64)
+    if img.ndim > 2:
+        img = img.reshape(-1, *img.shape[-2:]).mean(axis=0)
+    h, w = img.shape
+    ye = (np.arange(THUMB) * h) // THUMB
+    xe = (np.arange(THUMB) * w) // THUMB
+    ny = np.diff(np.append(ye, h)).clip(min=1)
+    nx = np.diff(np.append(xe, w)).clip(min=1)
+    s = np.add.reduceat(np.add.reduceat(img, ye, axis=0), xe, axis=1)
+    return s / ny[:, None] / nx[None, :]
+
+
+def phash_batch(thumbs: np.ndarray) -> np.ndarray:
+    """64-bit DCT hashes of a (n, THUMB, THUMB) batch: low-frequency coefficients above their median."""
+    from scipy.fft import dctn
+
+    coef = dctn(thumbs, axes=(1, 2), norm="ortho")[:, :HASH_SIDE, :HASH_SIDE].reshape(len(thumbs), -1)
+    bits = coef > np.median(coef[:, 1:], axis=1, keepdims=True)
+    bits[:, 0] = False  # DC term only carries brightness
+    weights = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+    return (bits.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+
+def _hash_chunk(paths: List[str]) -> Tuple[List[str], np.ndarray]:
+    import tifffile as tiff
+
+    digests: List[str] = []
+    thumbs = np.zeros((len(paths), THUMB, THUMB))
+    for i, p in enumerate(paths):
+        arr = np.ascontiguousarray(tiff.imread(p))
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{arr.dtype.str}{arr.shape}".encode())
+        h.update(arr.tobytes())
+        digests.append(h.hexdigest())
+        thumbs[i] = _thumbnail(arr)
+    return digests, phash_batch(thumbs)
+
+
+def build_hash_index(dataset_dir: Path, channel: int, workers: int = 1) -> Tuple[Dict[str, Tuple[str, int]], int]:
+    """{case: (exact digest, phash)} for imagesTr channel `channel`; returns (index, number re-hashed)."""
+    suffix = f"_{channel:04d}.tif"
+    files: Dict[str, Tuple[str, int, int]] = {}
+    with os.scandir(dataset_dir / "imagesTr") as it:
+        for e in it:
+            if e.name.endswith(suffix) and not e.name.startswith("."):
+                st = e.stat()
+                files[e.name[: -len(suffix)]] = (e.path, st.st_size, st.st_mtime_ns)
+
+    index_path = dataset_dir / INDEX_NAME
+    old: Dict[str, Tuple[int, int, str, int]] = {}
+    try:
+        with np.load(index_path) as z:
+            if int(z["version"]) == INDEX_VERSION and int(z["channel"]) == channel:
+                for row in zip(z["cases"], z["size"], z["mtime_ns"], z["digest"], z["phash"]):
+                    old[str(row[0])] = (int(row[1]), int(row[2]), str(row[3]), int(row[4]))
+    except (OSError, KeyError, ValueError):
+        old = {}
+
+    index: Dict[str, Tuple[str, int]] = {}
+    todo: List[str] = []
+    for case, (_, size, mtime) in files.items():
+        prev = old.get(case)
+        if prev is not None and prev[:2] == (size, mtime):
+            index[case] = (prev[2], prev[3])
+        else:
+            todo.append(case)
+
+    chunks = [todo[i : i + BATCH] for i in range(0, len(todo), BATCH)]
+    tasks = [[files[c][0] for c in chunk] for chunk in chunks]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_hash_chunk, tasks))
+    else:
+        results = [_hash_chunk(t) for t in tasks]
+    for chunk, (digests, hashes) in zip(chunks, results):
+        for case, d, ph in zip(chunk, digests, hashes):
+            index[case] = (d, int(ph))
+
+    if todo or set(old) != set(index):
+        cases = sorted(index)
+        tmp = index_path.with_name(f".{index_path.stem}.tmp.npz")
+        np.savez(
+            tmp,
+            version=INDEX_VERSION,
+            channel=channel,
+            cases=np.array(cases),
+            size=np.array([files[c][1] for c in cases], dtype=np.int64),
+            mtime_ns=np.array([files[c][2] for c in cases], dtype=np.int64),
+            digest=np.array([index[c][0] for c in cases]),
+            phash=np.array([index[c][1] for c in cases], dtype=np.uint64),
+        )
+        os.replace(tmp, index_path)
+    return index, len(todo)
+
+
+def near_edges(codes: np.ndarray, max_distance: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(u, v, dist) index pairs u < v of distinct codes within max_distance, via banded bucket lookup.
+
+    Per band the codes are sorted by band key; comparing every position with
+    the one k places further, for growing k while still inside its bucket,
+    visits exactly the same-bucket pairs with one vectorized step per k.
+    """
+    n = len(codes)
+    empty = np.zeros(0, np.int64)
+    if max_distance <= 0 or n < 2:
+        return empty, empty, empty
+    bands = min(max_distance + 1, 64)
+    bounds = [(64 * b) // bands for b in range(bands + 1)]
+    found: List[np.ndarray] = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        key = (codes >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        order = np.argsort(key, kind="stable")
+        skey = key[order]
+        starts = np.flatnonzero(np.r_[True, skey[1:] != skey[:-1]])
+        run_end = np.repeat(np.r_[starts[1:], n], np.diff(np.r_[starts, n]))
+        pos = np.flatnonzero(run_end - np.arange(n) > 1)
+        k = 1
+        while len(pos):
+            a, b = order[pos], order[pos + k]
+            hit = popcount64(codes[a] ^ codes[b]) <= max_distance
+            found.append(np.minimum(a[hit], b[hit]).astype(np.int64) * n + np.maximum(a[hit], b[hit]))
+            k += 1
+            pos = pos[run_end[pos] - pos > k]
+    if not found:
+        return empty, empty, empty
+    pair = np.unique(np.concatenate(found))
+    u, v = pair // n, pair % n
+    return u, v, popcount64(codes[u] ^ codes[v]).astype(np.int64)
+
+
+def _cross_pairs(cnt_a: np.ndarray, cnt_b: np.ndarray) -> np.ndarray:
+    """Pairs with different roles between two groups, from (.., n_roles) role counts."""
+    return cnt_a.sum(-1) * cnt_b.sum(-1) - (cnt_a * cnt_b).sum(-1)
+
+
+def _within_cross(cnt: np.ndarray) -> np.ndarray:
+    tot = cnt.sum(-1)
+    return (tot * tot - (cnt * cnt).sum(-1)) // 2
+
+
+def load_split_sources(paths: List[Path]) -> Tuple[List[Tuple[str, Dict[str, List[str]]]], List[str]]:
+    """[(label, {role: cases})] per fold of every split file; plus skipped files."""
+    sources: List[Tuple[str, Dict[str, List[str]]]] = []
+    skipped: List[str] = []
+    for p in paths:
+        try:
+            data = json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            skipped.append(str(p))
+            continue
+        folds = data if isinstance(data, list) else [data]
+        found = False
+        for i, fold in enumerate(folds):
+            if not isinstance(fold, dict):
+                continue
+            roles = {k: v for k, v in fold.items() if isinstance(v, list) and v and all(isinstance(c, str) for c in v)}
+            if len(roles) >= 2:
+                sources.append((f"{p}" + (f"#fold{i}" if isinstance(data, list) else ""), roles))
+                found = True
+        if not found:
+            skipped.append(str(p))
+    return sources, skipped
+
+
+def check_source(
+    roles: Dict[str, List[str]],
+    case_pos: Dict[str, int],
+    exact_group: np.ndarray,
+    code_group: np.ndarray,
+    n_exact: int,
+    n_codes: int,
+    edges: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    members: Dict[int, List[int]],
+    cases: List[str],
+    max_examples: int,
+) -> dict:
+    role_names = sorted(roles)
+    role_of = np.full(len(cases), -1, dtype=np.int64)
+    missing = 0
+    for r, name in enumerate(role_names):
+        for c in roles[name]:
+            pos = case_pos.get(c)
+            if pos is None:
+                missing += 1
+            else:
+                role_of[pos] = r
+    assigned = role_of >= 0
+    one_hot = np.zeros((len(cases), len(role_names)), dtype=np.int64)
+    one_hot[np.flatnonzero(assigned), role_of[assigned]] = 1
+
+    cnt_exact = np.zeros((n_exact, len(role_names)), dtype=np.int64)
+    np.add.at(cnt_exact, exact_group, one_hot)
+    cnt_code = np.zeros((n_codes, len(role_names)), dtype=np.int64)
+    np.add.at(cnt_code, code_group, one_hot)
+
+    exact_pairs = int(_within_cross(cnt_exact).sum())
+    u, v, dist = edges
+    # identical perceptual code but different content, plus codes within the distance
+    near_pairs = int(_within_cross(cnt_code).sum()) - exact_pairs + int(_cross_pairs(cnt_code[u], cnt_code[v]).sum())
+
+    nb = np.zeros_like(cnt_code)
+    np.add.at(nb, u, cnt_code[v])
+    np.add.at(nb, v, cnt_code[u])
+    other = (cnt_code.sum(1)[:, None] - cnt_code) + (nb.sum(1)[:, None] - nb)
+    leaked = {name: int(cnt_code[other[:, r] > 0, r].sum()) for r, name in enumerate(role_names)}
+
+    examples: List[dict] = []
+
+    def _add(a: int, b: int, kind: str, d: int) -> None:
+        examples.append(
+            {"kind": kind, "a": cases[a], "a_split": role_names[role_of[a]], "b": cases[b],
+             "b_split": role_names[role_of[b]], "distance": d}
+        )
+
+    for g in np.flatnonzero(_within_cross(cnt_code) > 0):
+        idx = [i for i in members[int(g)] if assigned[i]]
+        for ai, a in enumerate(idx):
+            for b in idx[ai + 1 :]:
+                if role_of[a] != role_of[b] and len(examples) < max_examples:
+                    _add(a, b, "exact" if exact_group[a] == exact_group[b] else "near", 0)
+        if len(examples) >= max_examples:
+            break
+    cross_edges = np.flatnonzero(_cross_pairs(cnt_code[u], cnt_code[v]) > 0)
+    for e in cross_edges[: max(0, max_examples - len(examples))]:
+        pa = [i for i in members[int(u[e])] if assigned[i]]
+        pb = [i for i in members[int(v[e])] if assigned[i]]
+        pair = next(((a, b) for a in pa for b in pb if role_of[a] != role_of[b]), None)
+        if pair is not None:
+            _add(pair[0], pair[1], "near", int(dist[e]))
+
+    return {
+        "cases": {name: len(roles[name]) for name in role_names},
+        "missing_in_index": missing,
+        "exact_cross_pairs": exact_pairs,
+        "near_cross_pairs": near_pairs,
+        "leaked_cases": leaked,
+        "examples": examples,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Detect exact/near-duplicate slices across split boundaries")
+    ap.add_argument("--dataset-dir", required=True, help="nnUNet raw dataset dir (imagesTr, splits_final.json)")
+    ap.add_argument("--splits", nargs="*", default=None, help=f"Split JSON files/globs (default: {DEFAULT_SPLITS_GLOB} + splits_final.json)")
+    ap.add_argument("--channel", type=int, default=None, help="imagesTr channel to hash (default: slice_0 of dataset.json)")
+    ap.add_argument("--max-distance", type=int, default=4, help="Perceptual hash Hamming distance for near duplicates")
+    ap.add_argument("--fail-on", choices=["exact", "near", "none"], default="exact")
+    ap.add_argument("--max-examples", type=int, default=20, help="Example pairs per split source in the report")
+    ap.add_argument("--workers", type=int, default=1, help="Processes for hashing new/changed images")
+    ap.add_argument("--report", default=None, help="Output report JSON path")
+    args = ap.parse_args()
+
+    dataset_dir = Path(args.dataset_dir).expanduser().resolve()
+    channel = centre_channel(dataset_dir) if args.channel is None else args.channel
+    patterns = args.splits if args.splits is not None else [DEFAULT_SPLITS_GLOB, str(dataset_dir / "splits_final.json")]
+    split_paths = sorted({Path(p).resolve() for pat in patterns for p in (glob.glob(pat) or [])})
+
+    index, n_hashed = build_hash_index(dataset_dir, channel, args.workers)
+    cases = sorted(index)
+    case_pos = {c: i for i, c in enumerate(cases)}
+    digests = np.array([index[c][0] for c in cases])
+    codes = np.array([index[c][1] for c in cases], dtype=np.uint64)
+    exact_group = np.unique(digests, return_inverse=True)[1].reshape(-1).astype(np.int64)
+    uniq_codes, code_group = np.unique(codes, return_inverse=True)
+    code_group = code_group.reshape(-1)
+    n_exact = int(exact_group.max(initial=-1)) + 1
+    members: Dict[int, List[int]] = {}
+    for i, g in enumerate(code_group):
+        members.setdefault(int(g), []).append(i)
+    edges = near_edges(uniq_codes, args.max_distance)
+
+    sources, skipped = load_split_sources(split_paths)
+    issues: List[Issue] = []
+    results: Dict[str, dict] = {}
+    for label, roles in sources:
+        res = check_source(
+            roles, case_pos, exact_group, code_group, n_exact, len(uniq_codes),
+            edges, members, cases, args.max_examples,
+        )
+        results[label] = res
+        leaked = ", ".join(f"{k}={v}" for k, v in res["leaked_cases"].items())
+        if res["exact_cross_pairs"]:
+            issues.append(Issue(
+                "error" if args.fail_on in ("exact", "near") else "warn", "leakage_exact",
+                f"{res['exact_cross_pairs']} identical slice pairs cross split boundaries", f"{label} ({leaked})",
+            ))
+        if res["near_cross_pairs"]:
+            issues.append(Issue(
+                "error" if args.fail_on == "near" else "warn", "leakage_near",
+                f"{res['near_cross_pairs']} near-duplicate slice pairs (distance <= {args.max_distance}) cross split boundaries",
+                f"{label} ({leaked})",
+            ))
+        if res["missing_in_index"]:
+            issues.append(Issue("warn", "leakage_missing", f"{res['missing_in_index']} split cases have no image", label))
+
+    errors = [asdict(i) for i in issues if i.severity == "error"]
+    warns = [asdict(i) for i in issues if i.severity == "warn"]
+    ok = len(errors) == 0
+    report = {
+        "ok": ok,
+        "dataset": str(dataset_dir),
+        "channel": channel,
+        "max_distance": args.max_distance,
+        "stats": {
+            "cases_indexed": len(cases),
+            "rehashed": n_hashed,
+            "exact_groups": n_exact,
+            "phash_codes": len(uniq_codes),
+            "near_code_pairs": int(len(edges[0])),
+        },
+        "skipped_split_files": skipped,
+        "splits": results,
+        "errors": errors,
+        "warnings": warns,
+    }
+    if args.report:
+        report_path = Path(args.report)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    for label, res in results.items():
+        print(f"{label}: exact={res['exact_cross_pairs']} near={res['near_cross_pairs']} leaked={res['leaked_cases']}")
+    print(
+        f"leakage_ok={ok} errors={len(errors)} warnings={len(warns)} cases={len(cases)} rehashed={n_hashed}"
+        + (f" report={args.report}" if args.report else "")
+    )
+    return 0 if ok else 2
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Ensemble per-fold / per-model probability stacks into a mean probability and a mask.
+
+Each --member is a directory of prediction volumes (TIFF / OME-TIFF /
+OME-Zarr) named `<stack id><suffix>`, e.g. one nnUNet fold or one model of
+the review bundle. For every stack id found in at least --min-members
+members the members are averaged z-slab by z-slab (--chunk-z planes):
+uncompressed TIFFs are read through memory maps, other formats through
+VolumeReader blocks, so memory is one float32 slab plus one member slab,
+whatever the number of members or the stack size.
+
+Weights: equal by default; --scores JSON ({member: score} or
+{member: {<--score-key>: score}}, e.g. per-fold validation Dice) gives
+score-proportional weights, --weight NAME=W sets them explicitly.
+
+Integer inputs are scaled by --input-max. By default a streaming max pass
+over each integer member (stopping at the first slab above 1) decides: a
+member holding only 0/1 is a label mask (the uint8 <sid>_pred.tif of
+stack_predictions_to_zstacks.py) and is averaged as votes (majority at
+--threshold 0.5); other integer inputs are probabilities scaled by the dtype
+maximum (uint8 0..255 -> 0..1). A stack that fails (unreadable member, disk
+full, ...) is reported as skipped in the summary. Per stack:
+  <out>/<sid>_prob<ext>  mean probability (--prob-dtype, uint8 = 0..255)
+  <out>/<sid>_mask<ext>  uint8 mask, mean >= --threshold
+plus <out>/ensemble_summary.json.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import tifffile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from volume_io import STACK_FORMATS, VolumeReader, list_volumes, volume_name, volume_suffix, write_volume  # noqa: E402
+
+PROB_DTYPES = ("float32", "uint8", "uint16")
+
+
+class MemberVolume:
+    """(z, y, x) slab access to one member volume, memory-mapped when the file allows it."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._mm: Optional[np.ndarray] = None
+        self._reader: Optional[VolumeReader] = None
+        if path.is_file():
+            try:
+                mm = tifffile.memmap(str(path), mode="r")
+                self._mm = mm.reshape((-1, *mm.shape[-2:])) if mm.ndim != 3 else mm
+            except (ValueError, OSError):
+                self._mm = None
+        if self._mm is None:
+            self._reader = VolumeReader(path)
+            self.shape: Tuple[int, int, int] = self._reader.shape
+            self.dtype = self._reader.dtype
+        else:
+            self.shape = tuple(self._mm.shape)  # type: ignore[assignment]
+            self.dtype = self._mm.dtype
+
+    @property
+    def memmapped(self) -> bool:
+        return self._mm is not None
+
+    def block(self, z0: int, z1: int) -> np.ndarray:
+        if self._mm is not None:
+            return np.asarray(self._mm[z0:z1])
+        return self._reader.read_block(z0, z1)
+
+    def close(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+        self._mm = None
+
+
+def stack_id(path: Path, strip: List[str]) -> str:
+    name = volume_name(path)
+    for suffix in strip:
+        if suffix and name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def member_weights(names: List[str], scores_path: Optional[str], score_key: str, explicit: List[str]) -> Dict[str, float]:
+    weights = {n: 1.0 for n in names}
+    if scores_path:
+        scores = json.loads(Path(scores_path).read_text(encoding="utf-8"))
+        for n in names:
+            if n not in scores:
+                raise SystemExit(f"--scores has no entry for member {n!r}")
+            val = scores[n]
+            weights[n] = float(val[score_key] if isinstance(val, dict) else val)
+    for item in explicit:
+        name, _, w = item.partition("=")
+        if name not in weights:
+            raise SystemExit(f"--weight for unknown member {name!r}")
+        weights[name] = float(w)
+    if any(w < 0 for w in weights.values()) or not any(weights.values()):
+        raise SystemExit(f"member weights must be >= 0 and not all zero: {weights}")
+    return weights
+
+
+def input_scale(m: MemberVolume, input_max: Optional[float], chunk_z: int) -> Tuple[float, bool]:
+    """(factor mapping member values to 0..1, True if the member is a 0/1 label mask).
+
+    Integer members without ``input_max`` are scanned slab by slab; the scan
+    stops at the first value above 1, so only all-0/1 volumes are read whole.
+    """
+    if input_max is not None:
+        return 1.0 / float(input_max), False
+    if not np.issubdtype(m.dtype, np.integer):
+        return 1.0, False
+    for z0 in range(0, m.shape[0], chunk_z):
+        if m.block(z0, min(z0 + chunk_z, m.shape[0])).max() > 1:
+            return 1.0 / np.iinfo(m.dtype).max, False
+    return 1.0, True
+
+
+def _new_tiff(path: Path, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+    return tifffile.memmap(str(path), shape=shape, dtype=dtype, photometric="minisblack")
+
+
+def ensemble_stack(
+    sid: str,
+    paths: List[Tuple[str, Path]],
+    weights: Dict[str, float],
+    out_dir: Path,
+    args: argparse.Namespace,
+) -> dict:
+    """Weighted mean of one stack's member volumes, slab by slab; writes prob and mask stacks.
+
+    Failures are returned as a skipped record so one bad stack does not stop the run.
+    """
+    try:
+        return _ensemble_stack(sid, paths, weights, out_dir, args)
+    except Exception as exc:
+        return {"id": sid, "status": "skipped", "reason": f"{type(exc).__name__}: {exc}"}
+
+
+def _ensemble_stack(
+    sid: str,
+    paths: List[Tuple[str, Path]],
+    weights: Dict[str, float],
+    out_dir: Path,
+    args: argparse.Namespace,
+) -> dict:
+    tmp_prob = out_dir / f".{sid}_prob.mm.tif"
+    tmp_mask = out_dir / f".{sid}_mask.mm.tif"
+    members: List[Tuple[str, MemberVolume]] = []
+    try:
+        for name, p in paths:
+            members.append((name, MemberVolume(p)))
+        shape = members[0][1].shape
+        bad = [str(m.path) for _, m in members if m.shape != shape]
+        if bad:
+            return {"id": sid, "status": "skipped", "reason": f"shape mismatch with {shape}: {bad}"}
+        total_w = sum(weights[name] for name, _ in members)
+        if total_w <= 0:
+            return {"id": sid, "status": "skipped", "reason": "all member weights are zero"}
+        scales = {name: input_scale(m, args.input_max, args.chunk_z) for name, m in members}
+        prob_dtype = np.dtype(args.prob_dtype)
+        prob_top = float(np.iinfo(prob_dtype).max) if np.issubdtype(prob_dtype, np.integer) else 1.0
+
+        # uncompressed TIFF temp outputs are filled through memory maps, then renamed (or converted)
+        suffix = volume_suffix(args.stack_format)
+        out_prob = out_dir / f"{sid}_prob{suffix}"
+        out_mask = out_dir / f"{sid}_mask{suffix}"
+        prob_mm = _new_tiff(tmp_prob, shape, prob_dtype)
+        mask_mm = _new_tiff(tmp_mask, shape, np.uint8)
+        acc = np.empty((min(args.chunk_z, shape[0]), *shape[1:]), dtype=np.float32)
+        fg = 0
+        for z0 in range(0, shape[0], args.chunk_z):
+            z1 = min(z0 + args.chunk_z, shape[0])
+            a = acc[: z1 - z0]
+            a.fill(0)
+            for name, m in members:
+                w = weights[name] / total_w
+                if not w:
+                    continue
+                a += m.block(z0, z1).astype(np.float32) * np.float32(w * scales[name][0])
+            mask = a >= args.threshold
+            mask_mm[z0:z1] = mask
+            fg += int(mask.sum())
+            if prob_top != 1.0:
+                prob_mm[z0:z1] = np.clip(np.rint(a * prob_top), 0, prob_top)
+            else:
+                prob_mm[z0:z1] = a
+        prob_mm.flush()
+        mask_mm.flush()
+        del prob_mm, mask_mm
+        for tmp, out, dtype in ((tmp_prob, out_prob, prob_dtype), (tmp_mask, out_mask, np.dtype(np.uint8))):
+            if args.stack_format == "tiff":
+                os.replace(tmp, out)
+            else:
+                with VolumeReader(tmp) as reader:
+                    write_volume(out, reader.iter_planes(), shape, dtype, fmt=args.stack_format)
+                tmp.unlink()
+        memmapped = sum(int(m.memmapped) for _, m in members)
+    finally:
+        for _, m in members:
+            m.close()
+        for tmp in (tmp_prob, tmp_mask):
+            tmp.unlink(missing_ok=True)
+    return {
+        "id": sid,
+        "status": "ok",
+        "shape": list(shape),
+        "members": {name: round(weights[name] / total_w, 6) for name, _ in members},
+        "memmapped": memmapped,
+        "mask_inputs": sorted(name for name, (_, is_mask) in scales.items() if is_mask),
+        "fg_fraction": fg / float(np.prod(shape)),
+        "prob": str(out_prob),
+        "mask": str(out_mask),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Streaming fold/model ensembling of probability stacks")
+    ap.add_argument("--member", action="append", required=True, help="[NAME=]DIR of per-stack probability volumes")
+    ap.add_argument("--out", required=True, help="Output directory")
+    ap.add_argument("--strip-suffix", nargs="*", default=["_prob", "_pred"], help="Removed from names to get stack ids")
+    ap.add_argument("--scores", default=None, help="JSON of per-member validation scores (score-weighted mean)")
+    ap.add_argument("--score-key", default="dice", help="Key inside per-member score dicts")
+    ap.add_argument("--weight", action="append", default=[], help="NAME=W explicit member weight")
+    ap.add_argument(
+        "--input-max",
+        type=float,
+        default=None,
+        help="Value of probability 1 in the inputs (default: 1 for 0/1 masks, else dtype maximum)",
+    )
+    ap.add_argument("--threshold", type=float, default=0.5)
+    ap.add_argument("--prob-dtype", choices=PROB_DTYPES, default="float32")
+    ap.add_argument("--stack-format", choices=STACK_FORMATS, default="tiff")
+    ap.add_argument("--chunk-z", type=int, default=16, help="Planes per slab")
+    ap.add_argument("--min-members", type=int, default=0, help="Stacks need this many members (0 = all)")
+    ap.add_argument("--jobs", type=int, default=1, help="Stacks ensembled in parallel (threads)")
+    args = ap.parse_args()
+
+    members: Dict[str, Path] = {}
+    for item in args.member:
+        name, sep, path = item.partition("=")
+        if not sep:
+            name, path = Path(item).name, item
+        if name in members:
+            raise SystemExit(f"duplicate member name {name!r}; use NAME=DIR")
+        members[name] = Path(path)
+    weights = member_weights(list(members), args.scores, args.score_key, args.weight)
+    min_members = args.min_members or len(members)
+
+    by_stack: Dict[str, List[Tuple[str, Path]]] = {}
+    for name, d in members.items():
+        for p in list_volumes(d):
+            by_stack.setdefault(stack_id(p, args.strip_suffix), []).append((name, p))
+    stacks = sorted(sid for sid, items in by_stack.items() if len(items) >= min_members)
+    missing = sorted(sid for sid in by_stack if sid not in stacks)
+    if not stacks:
+        raise SystemExit(f"no stack has >= {min_members} members")
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as ex:
+        results = list(ex.map(lambda sid: ensemble_stack(sid, by_stack[sid], weights, out_dir, args), stacks))
+
+    summary = {
+        "members": {n: str(p) for n, p in members.items()},
+        "weights": weights,
+        "threshold": args.threshold,
+        "input_max": args.input_max,
+        "stacks": results,
+        "incomplete": missing,
+    }
+    (out_dir / "ensemble_summary.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    for r in results:
+        if r["status"] != "ok":
+            print(f"[WARN] {r['id']}: {r['reason']}", file=sys.stderr)
+    ok = sum(r["status"] == "ok" for r in results)
+    print(f"[DONE] ensembled={ok} skipped={len(results) - ok} incomplete={len(missing)} -> {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Remove small 3D connected components from reassembled prediction stacks.
+
+Each volume under --pred-dir (e.g. REVIEW/predictions/<model>) is labelled
+in z-slabs on a process pool, with labels merged across slab boundaries by
+union-find (tools/common/chunked_components.py), so memory stays at about
+--workers x --slab planes. Components smaller than --min-volume-um3 are
+zeroed and the filtered stack is written under the same name to --out.
+
+Spacing (dz, dy, dx) per stack: --dz/--dy/--dx if given, else the prep meta
+JSON (--meta-root/<stack id>.json: dz_target, dy, dx), else OME metadata
+of the volume itself.
+
+Outputs:
+  <out>/<name><ext>                 filtered stack (input values kept)
+  <out>/<name>_labels<ext>          component ids (with --write-labels; extra pass)
+  <out>/components/<name>.csv       per component: voxels, volume, bbox, extent, centroid, kept
+  <out>/components_summary.json     counts and removed volume per stack
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from chunked_components import Components, iter_filtered_planes, label_components, label_dtype  # noqa: E402
+from ome_meta import SpacingService  # noqa: E402
+from volume_io import STACK_FORMATS, VolumeReader, list_volumes, volume_name, volume_suffix, write_volume  # noqa: E402
+
+ID_SUFFIXES = ("_pred", "_prob", "_mask")
+
+
+def stack_spacing(path: Path, args: argparse.Namespace, spacing: SpacingService) -> Optional[Tuple[float, float, float]]:
+    """(dz, dy, dx) in µm: command line, else prep meta JSON, else OME metadata; None if incomplete."""
+    sp = [args.dz, args.dy, args.dx]
+    if None in sp and args.meta_root:
+        name = volume_name(path)
+        sid = next((name[: -len(s)] for s in ID_SUFFIXES if name.endswith(s)), name)
+        meta_path = Path(args.meta_root) / f"{sid}.json"
+        if meta_path.is_file():
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            found = [meta.get("dz_target") or meta.get("dz_original"), meta.get("dy"), meta.get("dx")]
+            sp = [a if a is not None else b for a, b in zip(sp, found)]
+    if None in sp and path.is_file():
+        ome = spacing.spacing(path)
+        if ome is not None:
+            sp = [a if a is not None else b for a, b in zip(sp, (ome.dz, ome.dy, ome.dx))]
+    return None if None in sp else (float(sp[0]), float(sp[1]), float(sp[2]))
+
+
+def write_table(path: Path, comps: Components, keep: np.ndarray, sp: Tuple[float, float, float]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    voxel_um3 = sp[0] * sp[1] * sp[2]
+    extent = (comps.bbox_max - comps.bbox_min + 1) * np.asarray(sp)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(
+            ["component", "voxels", "volume_um3"]
+            + [f"{a}_{m}" for a in "zyx" for m in ("min", "max")]
+            + ["extent_z_um", "extent_y_um", "extent_x_um", "centroid_z", "centroid_y", "centroid_x", "kept"]
+        )
+        for i in range(comps.n):
+            lo, hi = comps.bbox_min[i], comps.bbox_max[i]
+            w.writerow(
+                [i + 1, int(comps.voxels[i]), f"{comps.voxels[i] * voxel_um3:.6g}"]
+                + [int(v) for pair in zip(lo, hi) for v in pair]
+                + [f"{v:.6g}" for v in extent[i]]
+                + [f"{v:.2f}" for v in comps.centroid[i]]
+                + [int(keep[i])]
+            )
+
+
+def process(path: Path, out_dir: Path, args: argparse.Namespace, spacing: SpacingService) -> dict:
+    sp = stack_spacing(path, args, spacing)
+    if sp is None:
+        return {"path": str(path), "status": "skipped", "reason": "no (dz, dy, dx) spacing"}
+    comps = label_components(path, args.threshold, args.slab, args.connectivity, args.workers)
+    volume_um3 = comps.voxels * (sp[0] * sp[1] * sp[2])
+    keep = volume_um3 >= args.min_volume_um3
+    name = volume_name(path)
+    with VolumeReader(path) as reader:
+        dtype = reader.dtype
+    suffix = volume_suffix(args.stack_format)
+    outputs = [(out_dir / f"{name}{suffix}", False, dtype)]
+    if args.write_labels:
+        outputs.append((out_dir / f"{name}_labels{suffix}", True, label_dtype(comps.n)))
+    for out_path, as_labels, out_dtype in outputs:
+        write_volume(
+            out_path,
+            iter_filtered_planes(path, comps, keep, args.threshold, args.connectivity, args.workers, as_labels),
+            comps.shape,
+            out_dtype,
+            fmt=args.stack_format,
+            spacing=sp,
+            compression=args.compression,
+        )
+    write_table(out_dir / "components" / f"{name}.csv", comps, keep, sp)
+    return {
+        "path": str(path),
+        "status": "ok",
+        "spacing_zyx": list(sp),
+        "components": comps.n,
+        "kept": int(keep.sum()),
+        "removed": int(comps.n - keep.sum()),
+        "removed_volume_um3": float(volume_um3[~keep].sum()),
+        "kept_volume_um3": float(volume_um3[keep].sum()),
+        "out": str(outputs[0][0]),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Chunked 3D connected-component filtering of prediction stacks")
+    ap.add_argument("--pred-dir", required=True, help="Prediction volumes (directory or single volume)")
+    ap.add_argument("--out", required=True, help="Output directory")
+    ap.add_argument("--min-volume-um3", type=float, required=True, help="Smallest component volume kept")
+    ap.add_argument("--threshold", type=float, default=0.0, help="Foreground is value > threshold")
+    ap.add_argument("--connectivity", type=int, choices=(6, 26), default=26)
+    ap.add_argument("--slab", type=int, default=64, help="Planes per slab")
+    ap.add_argument("--workers", type=int, default=1, help="Processes labelling slabs")
+    ap.add_argument("--dx", type=float, default=None)
+    ap.add_argument("--dy", type=float, default=None)
+    ap.add_argument("--dz", type=float, default=None)
+    ap.add_argument("--meta-root", default=None, help="Prep meta JSON directory for per-stack spacing")
+    ap.add_argument("--write-labels", action="store_true", help="Also write a component id stack")
+    ap.add_argument("--stack-format", choices=STACK_FORMATS, default="tiff")
+    ap.add_argument("--compression", default="zlib", help="Codec for --stack-format tiff-tiled")
+    args = ap.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    spacing = SpacingService()
+    results: List[dict] = []
+    for path in list_volumes(Path(args.pred_dir)):
+        res = process(path, out_dir, args, spacing)
+        if res["status"] != "ok":
+            print(f"[WARN] {path}: {res['reason']}", file=sys.stderr)
+        else:
+            print(f"{volume_name(path)}: components={res['components']} removed={res['removed']}")
+        results.append(res)
+
+    summary = {
+        "min_volume_um3": args.min_volume_um3,
+        "threshold": args.threshold,
+        "connectivity": args.connectivity,
+        "stacks": results,
+    }
+    (out_dir / "components_summary.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    ok = sum(r["status"] == "ok" for r in results)
+    print(f"[DONE] filtered={ok} skipped={len(results) - ok} -> {out_dir}")
+    return 0 if ok else 2
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
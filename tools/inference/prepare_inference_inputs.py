@@ -5,18 +5,27 @@ Prepare inference inputs for nnUNet (2D) from selected zstacks.
 - Resample along Z to a target dz (linear interpolation).
 - Keep XY unchanged.
 - Generate per-slice cases with channel files: case_id_0000.tif, case_id_0001.tif, ...
+  (--layout hardlink/symlink writes each plane once and links the channel files)
+- With --catalog, stack paths and dz fallbacks are looked up by file name in the
+  dataset catalog (tools/common/catalog.py) instead of the hard-coded locations,
+  and the outputs are recorded there.
 """
 from __future__ import annotations
 
+import argparse
 import json
-import math
+import sys
 from pathlib import Path
-from typing import Dict, Optional, Tuple
-import xml.etree.ElementTree as ET
 
 import numpy as np
 import tifffile as tiff
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from catalog import Catalog  # noqa: E402
+from ome_meta import SpacingService  # noqa: E402
+from volume_io import STACK_FORMATS, volume_suffix, write_volume  # noqa: E402
+from slice_layout import LAYOUTS, link_slice_images, plane_store_path, write_plane  # noqa: E402
+
 PROJECT_ROOT = Path("/home/dilgerlab/Siqi/myelin-benchmark")
 OUT_ROOT = PROJECT_ROOT / "data/06_inference/nnunet"
 TARGET_DZ = 0.396  # um
@@ -69,24 +78,6 @@ STACKS = [
 ]
 
 
-def parse_dz_from_ome(ome_xml: Optional[str]) -> Optional[float]:
-    if not ome_xml:
-        return None
-    try:
-        root = ET.fromstring(ome_xml)
-    except Exception:
-        return None
-    ns = {"ome": "http://www.openmicroscopy.org/Schemas/OME/2016-06"}
-    img = root.find("ome:Image", ns) or root.find("Image")
-    if img is None:
-        return None
-    pixels = img.find("ome:Pixels", ns) or img.find("Pixels")
-    if pixels is None:
-        return None
-    dz = pixels.attrib.get("PhysicalSizeZ")
-    return float(dz) if dz else None
-
-
 def load_stack(path: Path) -> np.ndarray:
     arr = tiff.imread(path)
     if arr.ndim == 2:
@@ -125,12 +116,34 @@ def save_slice_images(stack: np.ndarray, out_dir: Path, case_prefix: str, k: int
         for ch_idx, off in enumerate(range(-k, k + 1)):
             j = min(max(idx + off, 0), z - 1)
             out_path = out_dir / f"{case_id}_{ch_idx:04d}.tif"
-            tiff.imwrite(out_path, stack[j], photometric="minisblack")
+            write_plane(out_path, stack[j])
         num_cases += 1
     return num_cases
 
 
 def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="copy",
+        help="copy: one TIFF per case channel; hardlink/symlink: write each plane once, shared by all channel configs",
+    )
+    ap.add_argument(
+        "--stack-format",
+        choices=STACK_FORMATS,
+        default="tiff",
+        help="Resampled stack output: tiff (uncompressed), tiff-tiled (tiled, compressed OME-TIFF), ome-zarr",
+    )
+    ap.add_argument("--compression", default="zlib", help="Codec for --stack-format tiff-tiled")
+    ap.add_argument(
+        "--catalog",
+        default=None,
+        help="Dataset catalog SQLite; stacks are resolved by file name there before the hard-coded paths",
+    )
+    args = ap.parse_args()
+    catalog = Catalog(Path(args.catalog)) if args.catalog else None
+
     resampled_dir = OUT_ROOT / "zstacks_resampled_dz0p396"
     meta_dir = OUT_ROOT / "meta"
     resampled_dir.mkdir(parents=True, exist_ok=True)
@@ -146,19 +159,26 @@ def main() -> None:
         ch: OUT_ROOT / "inputs" / f"dz0p396_{ch}ch" / "imagesTs"
         for ch in channel_configs
     }
+    store_dir = OUT_ROOT / "inputs" / "planes_dz0p396"
 
     manifest = {"target_dz": TARGET_DZ, "stacks": []}
+    spacing = SpacingService(OUT_ROOT / "ome_spacing_cache.json")
 
     for item in STACKS:
         path = Path(item["path"])
+        rec = None
+        if catalog is not None:
+            found = catalog.find(name=path.name)
+            if len(found) > 1:
+                raise RuntimeError(f"{path.name} is catalogued more than once: {[r.path for r in found]}")
+            rec = found[0] if found else None
+            if rec is not None:
+                path = Path(rec.path)
         if not path.exists():
             raise FileNotFoundError(f"Missing stack: {path}")
-        with tiff.TiffFile(path) as tf:
-            dz = parse_dz_from_ome(tf.ome_metadata)
+        dz = rec.dz_effective if rec is not None else spacing.dz(path)
         if dz is None and item.get("fallback_dz_path"):
-            fb = Path(item["fallback_dz_path"])
-            with tiff.TiffFile(fb) as tf:
-                dz = parse_dz_from_ome(tf.ome_metadata)
+            dz = spacing.dz(Path(item["fallback_dz_path"]))
         if dz is None:
             raise RuntimeError(f"Missing dz for {path}")
 
@@ -167,13 +187,33 @@ def main() -> None:
         new_z = max(1, int(round(z * dz / TARGET_DZ)))
         stack_rs = resample_z_linear(stack, new_z)
 
-        out_stack = resampled_dir / f"{item['id']}_dz0p396.tif"
-        tiff.imwrite(out_stack, stack_rs, photometric="minisblack")
+        out_stack = resampled_dir / f"{item['id']}_dz0p396{volume_suffix(args.stack_format)}"
+        sp = spacing.spacing(path)
+        write_volume(
+            out_stack,
+            iter(stack_rs),
+            stack_rs.shape,
+            stack_rs.dtype,
+            fmt=args.stack_format,
+            spacing=(TARGET_DZ, sp.dy if sp else None, sp.dx if sp else None),
+            compression=args.compression,
+            photometric="minisblack",
+        )
 
         # write slices for each channel config
         counts = {}
-        for ch, k in channel_configs.items():
-            counts[ch] = save_slice_images(stack_rs, input_dirs[ch], item["id"], k)
+        if args.layout == "copy":
+            for ch, k in channel_configs.items():
+                counts[ch] = save_slice_images(stack_rs, input_dirs[ch], item["id"], k)
+        else:
+            # each plane once in the store, every channel config links to it
+            store_dir.mkdir(parents=True, exist_ok=True)
+            for j in range(new_z):
+                write_plane(plane_store_path(store_dir, item["id"], j), stack_rs[j])
+            for ch, k in channel_configs.items():
+                counts[ch] = link_slice_images(
+                    new_z, input_dirs[ch], item["id"], k, args.layout, store_dir
+                )
 
         meta = {
             "id": item["id"],
@@ -183,12 +223,26 @@ def main() -> None:
             "z_original": int(z),
             "z_resampled": int(new_z),
             "resample_ratio": float(dz / TARGET_DZ),
+            "dx": sp.dx if sp else None,
+            "dy": sp.dy if sp else None,
             "resampled_stack": str(out_stack),
+            "stack_format": args.stack_format,
             "cases_per_channel": counts,
+            "layout": args.layout,
         }
         (meta_dir / f"{item['id']}.json").write_text(json.dumps(meta, indent=2))
         manifest["stacks"].append(meta)
-
+        if catalog is not None:
+            params = {"target_dz": TARGET_DZ, "layout": args.layout, "stack_format": args.stack_format}
+            catalog.add_artifacts(
+                [
+                    (item["id"], "resampled_stack", out_stack, params),
+                    (item["id"], "meta", meta_dir / f"{item['id']}.json", params),
+                    *((item["id"], "inputs", input_dirs[ch], {**params, "channels": ch}) for ch in counts),
+                ]
+            )
+
+    spacing.save()
     (OUT_ROOT / "manifest_inference_dz0p396.json").write_text(json.dumps(manifest, indent=2))
 
 
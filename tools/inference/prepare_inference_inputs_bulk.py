@@ -2,93 +2,173 @@
 """
 Prepare bulk inference inputs for nnUNet (2D) with 7ch (k=3).
 
-- Scan input_root for *.ome.tif
-- Parse dz from OME-XML (fallback to sibling in same folder if missing)
-- Resample along Z to target dz (linear interpolation)
-- Create 7-channel per-slice cases in imagesTs
+- Scan input_root for *.ome.tif (or query the dataset catalog, --catalog)
+- Parse dz from OME-XML (fallback to sibling in same folder if missing; memoized and
+  cached on disk via tools/common/ome_meta.py)
+- Resample along Z to target dz (linear interpolation), streamed plane by plane;
+  resampled stacks as plain TIFF, tiled compressed OME-TIFF or OME-Zarr (--stack-format)
+- Create 7-channel per-slice cases in imagesTs (optionally as links into a plane store, --layout)
+- Optionally process stacks in parallel (--workers N)
+- Optionally skip unchanged, already prepared stacks (--incremental, cache index prep_cache_<suffix>.json)
 """
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
-import re
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Dict, List
-import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Set, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from catalog import Catalog, StackRecord, unique_case_id  # noqa: E402
+from ome_meta import SpacingService  # noqa: E402
+from volume_io import STACK_FORMATS, VolumeReader, volume_suffix, write_volume  # noqa: E402
+from zresample import iter_resampled_planes, resampled_depth  # noqa: E402
+from slice_layout import (  # noqa: E402
+    LAYOUTS,
+    atomic_target,
+    case_channel_path,
+    plane_store_path,
+    save_slice_images,
+)
+
+
+def source_fingerprint(path: Path, use_hash: bool = False) -> dict:
+    st = path.stat()
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if use_hash:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        fp["sha1"] = h.hexdigest()
+    return fp
+
+
+def load_cache_index(path: Path) -> Dict[str, dict]:
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text()).get("entries", {})
+    except (OSError, ValueError):
+        return {}
 
-import numpy as np
-import tifffile as tiff
 
+def save_cache_index(path: Path, entries: Dict[str, dict]) -> None:
+    with atomic_target(path) as tmp:
+        tmp.write_text(json.dumps({"entries": entries}, indent=2))
 
-def parse_dz_from_ome(ome_xml: Optional[str]) -> Optional[float]:
-    if not ome_xml:
-        return None
-    try:
-        root = ET.fromstring(ome_xml)
-    except Exception:
-        return None
-    ns = {"ome": "http://www.openmicroscopy.org/Schemas/OME/2016-06"}
-    img = root.find("ome:Image", ns) or root.find("Image")
-    if img is None:
-        return None
-    pixels = img.find("ome:Pixels", ns) or img.find("Pixels")
-    if pixels is None:
+
+def cached_meta(entry: Optional[dict], fingerprint: dict, params: dict) -> Optional[dict]:
+    """Meta of a previous run if source fingerprint and prep parameters still match."""
+    if not entry or entry.get("params") != params:
         return None
-    dz = pixels.attrib.get("PhysicalSizeZ")
-    return float(dz) if dz else None
-
-
-def load_stack(path: Path) -> np.ndarray:
-    arr = tiff.imread(path)
-    if arr.ndim == 2:
-        arr = arr[None, ...]
-    if arr.ndim != 3:
-        raise ValueError(f"Unexpected stack shape {arr.shape} for {path}")
-    return arr
-
-
-def resample_z_linear(stack: np.ndarray, new_z: int) -> np.ndarray:
-    z, y, x = stack.shape
-    if new_z == z:
-        return stack
-    if new_z < 1:
-        new_z = 1
-    pos = np.linspace(0, z - 1, new_z)
-    z0 = np.floor(pos).astype(int)
-    z1 = np.clip(z0 + 1, 0, z - 1)
-    w = (pos - z0).astype(np.float32)
-    out = (1.0 - w)[:, None, None] * stack[z0] + w[:, None, None] * stack[z1]
-    if np.issubdtype(stack.dtype, np.integer):
-        out = np.clip(np.rint(out), 0, np.iinfo(stack.dtype).max).astype(stack.dtype)
+    prev = entry.get("fingerprint", {})
+    # a sha1 match survives mtime changes (e.g. re-copied files); otherwise use size+mtime
+    if "sha1" in fingerprint and "sha1" in prev:
+        same = fingerprint["sha1"] == prev["sha1"]
     else:
-        out = out.astype(stack.dtype)
-    return out
-
-
-def save_slice_images(stack: np.ndarray, out_dir: Path, case_prefix: str, k: int = 3) -> int:
-    out_dir.mkdir(parents=True, exist_ok=True)
-    z, _, _ = stack.shape
-    num_cases = 0
-    for zi in range(1, z + 1):
-        idx = zi - 1
-        case_id = f"{case_prefix}_z{zi:03d}"
-        for ch_idx, off in enumerate(range(-k, k + 1)):
-            j = min(max(idx + off, 0), z - 1)
-            out_path = out_dir / f"{case_id}_{ch_idx:04d}.tif"
-            tiff.imwrite(out_path, stack[j], photometric="minisblack")
-        num_cases += 1
-    return num_cases
-
-
-def unique_case_id(stem: str, rel_path: Path, seen: Dict[str, int]) -> str:
-    if stem not in seen:
-        seen[stem] = 1
-        return stem
-    # collision: include directory path
-    safe = re.sub(r"[^A-Za-z0-9_\\-]", "_", str(rel_path.parent))
-    cid = f"{safe}__{stem}"
-    seen[cid] = 1
-    return cid
+        same = all(fingerprint.get(key) == prev.get(key) for key in ("size", "mtime_ns"))
+    return entry.get("meta") if same else None
+
+
+def outputs_valid(
+    meta: dict, meta_dir: Path, input_names: Set[str], store_names: Optional[Set[str]], k: int = 3
+) -> bool:
+    """All files a finished stack produces are present (every write is temp-then-rename)."""
+    case_id = meta["id"]
+    if not (meta_dir / f"{case_id}.json").is_file() or not Path(meta["resampled_stack"]).exists():
+        return False
+    z = int(meta["z_resampled"])
+    for idx in range(z):
+        for ch_idx in range(2 * k + 1):
+            if case_channel_path(Path(), case_id, idx, ch_idx).name not in input_names:
+                return False
+    if store_names is not None:
+        return all(plane_store_path(Path(), case_id, j).name in store_names for j in range(z))
+    return True
+
+
+@dataclass
+class PrepOptions:
+    target_dz: float
+    resampled_dir: Path
+    meta_dir: Path
+    input_dir: Path
+    layout: str = "copy"
+    store_dir: Optional[Path] = None
+    stack_format: str = "tiff"
+    compression: str = "zlib"
+
+
+def process_stack(
+    path: Path,
+    case_id: str,
+    dz: float,
+    dxy: Tuple[Optional[float], Optional[float]],
+    opts: PrepOptions,
+) -> Tuple[str, dict]:
+    """Resample one stack, write its slices and meta JSON.
+
+    ``dxy`` is the source (dx, dy), kept as spacing metadata. Returns
+    ``("processed", meta)`` or ``("skipped", record)``; the record reason is
+    ``read_error`` when the source cannot be opened and ``write_error`` when
+    resampling or writing the outputs fails, with the exception message.
+    Self-contained so it can run in a worker process.
+    """
+    target_dz = opts.target_dz
+    out_stack = opts.resampled_dir / f"{case_id}_dz0p396{volume_suffix(opts.stack_format)}"
+
+    try:
+        reader = VolumeReader(path)
+    except Exception as exc:
+        return "skipped", {"path": str(path), "reason": f"read_error: {type(exc).__name__}: {exc}"}
+    try:
+        z, y, x = reader.shape
+        new_z = resampled_depth(z, dz, target_dz)
+        planes = iter_resampled_planes(reader, new_z)
+        planes = save_slice_images(
+            planes, new_z, opts.input_dir, case_id, k=3, layout=opts.layout, store_dir=opts.store_dir
+        )
+        write_volume(
+            out_stack,
+            planes,
+            (new_z, y, x),
+            reader.dtype,
+            fmt=opts.stack_format,
+            spacing=(target_dz, dxy[1], dxy[0]),
+            compression=opts.compression,
+            photometric="minisblack",
+        )
+    except Exception as exc:
+        # planes are read lazily, so this also covers truncated/corrupt pages
+        return "skipped", {"path": str(path), "reason": f"write_error: {type(exc).__name__}: {exc}"}
+    finally:
+        reader.close()
+
+    meta = {
+        "id": case_id,
+        "source_path": str(path),
+        "dz_original": dz,
+        "dz_target": target_dz,
+        "z_original": int(z),
+        "z_resampled": int(new_z),
+        "resample_ratio": float(dz / target_dz),
+        "dx": dxy[0],
+        "dy": dxy[1],
+        "resampled_stack": str(out_stack),
+        "stack_format": opts.stack_format,
+        "cases_7ch": new_z,
+        "layout": opts.layout,
+    }
+    # meta JSON goes last: its presence marks the stack as complete
+    with atomic_target(opts.meta_dir / f"{case_id}.json") as tmp:
+        tmp.write_text(json.dumps(meta, indent=2))
+    return "processed", meta
 
 
 def main() -> None:
@@ -97,6 +177,40 @@ def main() -> None:
     ap.add_argument("--out-root", required=True)
     ap.add_argument("--target-dz", type=float, default=0.396)
     ap.add_argument("--suffix", default="all_7ch")
+    ap.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="copy",
+        help="copy: one TIFF per case channel; hardlink/symlink: write each plane once to a plane store",
+    )
+    ap.add_argument(
+        "--stack-format",
+        choices=STACK_FORMATS,
+        default="tiff",
+        help="Resampled stack output: tiff (uncompressed), tiff-tiled (tiled, compressed OME-TIFF), ome-zarr",
+    )
+    ap.add_argument("--compression", default="zlib", help="Codec for --stack-format tiff-tiled")
+    ap.add_argument("--workers", type=int, default=1, help="Stacks processed in parallel (process pool)")
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip stacks whose source is unchanged since the last run and whose outputs are complete",
+    )
+    ap.add_argument(
+        "--spacing-cache",
+        default=None,
+        help="OME spacing cache JSON (default: <out-root>/ome_spacing_cache.json)",
+    )
+    ap.add_argument(
+        "--catalog",
+        default=None,
+        help="Dataset catalog SQLite: refresh it for --input-root and take stacks, spacing and case ids from it",
+    )
+    ap.add_argument(
+        "--hash",
+        action="store_true",
+        help="Fingerprint sources by SHA-1 content hash in addition to size/mtime",
+    )
     args = ap.parse_args()
 
     input_root = Path(args.input_root)
@@ -106,13 +220,24 @@ def main() -> None:
     resampled_dir = out_root / f"zstacks_resampled_dz0p396_{args.suffix}"
     meta_dir = out_root / f"meta_{args.suffix}"
     input_dir = out_root / "inputs" / f"dz0p396_7ch_{args.suffix}" / "imagesTs"
+    store_dir = input_dir.parent / "planes" if args.layout != "copy" else None
 
     resampled_dir.mkdir(parents=True, exist_ok=True)
     meta_dir.mkdir(parents=True, exist_ok=True)
     input_dir.mkdir(parents=True, exist_ok=True)
 
-    ome_files = list(input_root.rglob("*.ome.tif"))
-    ome_files.sort()
+    catalog: Optional[Catalog] = None
+    records: Dict[str, StackRecord] = {}
+    if args.catalog:
+        # only directories with a new mtime are re-listed and only new/changed stacks are opened
+        catalog = Catalog(Path(args.catalog))
+        catalog.refresh(input_root)
+        records = {r.path: r for r in catalog.stacks(root=input_root)}
+        ome_files = [Path(p) for p in records]
+        input_root = input_root.resolve()
+    else:
+        ome_files = list(input_root.rglob("*.ome.tif"))
+        ome_files.sort()
 
     manifest = {
         "target_dz": target_dz,
@@ -122,60 +247,114 @@ def main() -> None:
         "skipped": [],
     }
 
+    spacing = SpacingService(
+        Path(args.spacing_cache) if args.spacing_cache else out_root / "ome_spacing_cache.json"
+    )
+    cache_path = out_root / f"prep_cache_{args.suffix}.json"
+    cache = load_cache_index(cache_path)
+    params = {"target_dz": target_dz, "k": 3, "layout": args.layout, "stack_format": args.stack_format}
+    opts = PrepOptions(
+        target_dz=target_dz,
+        resampled_dir=resampled_dir,
+        meta_dir=meta_dir,
+        input_dir=input_dir,
+        layout=args.layout,
+        store_dir=store_dir,
+        stack_format=args.stack_format,
+        compression=args.compression,
+    )
+    input_names: Set[str] = set(os.listdir(input_dir)) if args.incremental else set()
+    store_names: Optional[Set[str]] = None
+    if args.incremental and store_dir is not None:
+        store_names = set(os.listdir(store_dir)) if store_dir.is_dir() else set()
+
     seen: Dict[str, int] = {}
+    # one slot per input file so the manifest keeps rglob order regardless of completion order
+    results: List[Optional[Tuple[str, dict]]] = [None] * len(ome_files)
+    fingerprints: Dict[int, dict] = {}
+    jobs: List[Tuple[int, tuple]] = []
+    n_cached = 0
 
-    for path in ome_files:
+    for pos, path in enumerate(ome_files):
         rel = path.relative_to(input_root)
-        with tiff.TiffFile(path) as tf:
-            dz = parse_dz_from_ome(tf.ome_metadata)
-
-        if dz is None:
-            # fallback: look for sibling with metadata
-            for sib in path.parent.glob("*.ome.tif"):
-                with tiff.TiffFile(sib) as tf:
-                    dz = parse_dz_from_ome(tf.ome_metadata)
-                if dz is not None:
-                    break
-
-        if dz is None:
-            manifest["skipped"].append({"path": str(path), "reason": "missing_dz"})
+        fingerprints[pos] = source_fingerprint(path, args.hash)
+        prev = cached_meta(cache.get(str(path)), fingerprints[pos], params)
+        rec = records.get(str(path))
+        if rec is not None:
+            # the catalog assigns ids the same way, to stacks with a dz only
+            dz, case_id = rec.dz_effective, rec.case_id
+        else:
+            dz = prev["dz_original"] if prev else spacing.dz_with_sibling_fallback(path)
+            case_id = None
+        if dz is None or (rec is not None and case_id is None):
+            results[pos] = ("skipped", {"path": str(path), "reason": "missing_dz"})
             continue
-
-        try:
-            stack = load_stack(path)
-        except Exception as exc:
-            manifest["skipped"].append(
-                {"path": str(path), "reason": f"read_error: {type(exc).__name__}"}
-            )
+        if case_id is None:
+            # ids are assigned up front, in sorted order, so they do not depend on scheduling
+            case_id = unique_case_id(path.stem, rel, seen)
+        if (
+            args.incremental
+            and prev is not None
+            and prev["id"] == case_id
+            and outputs_valid(prev, meta_dir, input_names, store_names)
+        ):
+            results[pos] = ("processed", prev)
+            # refresh the fingerprint, e.g. to add a sha1 on the first --hash run
+            cache[str(path)]["fingerprint"] = fingerprints[pos]
+            n_cached += 1
             continue
-        z = stack.shape[0]
-        new_z = max(1, int(round(z * dz / target_dz)))
-        stack_rs = resample_z_linear(stack, new_z)
-
-        case_id = unique_case_id(path.stem, rel, seen)
-
-        out_stack = resampled_dir / f"{case_id}_dz0p396.tif"
-        tiff.imwrite(out_stack, stack_rs, photometric="minisblack")
-
-        counts = save_slice_images(stack_rs, input_dir, case_id, k=3)
-
-        meta = {
-            "id": case_id,
-            "source_path": str(path),
-            "dz_original": dz,
-            "dz_target": target_dz,
-            "z_original": int(z),
-            "z_resampled": int(new_z),
-            "resample_ratio": float(dz / target_dz),
-            "resampled_stack": str(out_stack),
-            "cases_7ch": counts,
-        }
-        (meta_dir / f"{case_id}.json").write_text(json.dumps(meta, indent=2))
-        manifest["processed"].append(meta)
+        if rec is not None:
+            dxy = (rec.dx, rec.dy)
+        else:
+            sp = spacing.spacing(path)
+            dxy = (sp.dx, sp.dy) if sp else (None, None)
+        jobs.append((pos, (path, case_id, dz, dxy, opts)))
+
+    spacing.save()
+
+    def _record(pos: int, result: Tuple[str, dict]) -> None:
+        results[pos] = result
+        status, record = result
+        if status == "processed":
+            cache[str(ome_files[pos])] = {
+                "fingerprint": fingerprints[pos],
+                "params": params,
+                "meta": record,
+            }
+            # persisted per stack so a crash keeps everything finished so far
+            save_cache_index(cache_path, cache)
+
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            futures = {ex.submit(process_stack, *job_args): pos for pos, job_args in jobs}
+            for fut in as_completed(futures):
+                _record(futures[fut], fut.result())
+    else:
+        for pos, job_args in jobs:
+            _record(pos, process_stack(*job_args))
+
+    if n_cached:
+        save_cache_index(cache_path, cache)
+
+    for status, record in results:
+        manifest[status].append(record)
+
+    if catalog is not None:
+        catalog.add_artifacts(
+            (meta["id"], kind, path, {"suffix": args.suffix, **params})
+            for meta in manifest["processed"]
+            for kind, path in (
+                ("resampled_stack", Path(meta["resampled_stack"])),
+                ("meta", meta_dir / f"{meta['id']}.json"),
+                ("inputs", input_dir),
+            )
+        )
+        catalog.close()
 
     (out_root / f"manifest_inference_dz0p396_{args.suffix}.json").write_text(
         json.dumps(manifest, indent=2)
     )
+    print(f"processed={len(manifest['processed'])} (cached={n_cached}) skipped={len(manifest['skipped'])}")
 
 
 if __name__ == "__main__":
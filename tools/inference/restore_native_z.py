@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Map prediction stacks from the resampled z grid (dz=0.396) back to the native one.
+
+Every volume under --pred-root (and its model subdirectories, e.g. the review
+bundle's predictions/<model>/) is matched to its prep meta JSON
+(--meta-root/<stack id>.json, stack id = name minus _pred/_prob/_mask) and
+inverse-resampled from z_resampled to z_original planes, one output plane at
+a time (tools/common/zresample.py). Probabilities use --prob-mode
+(linear/nearest), masks --mask-mode (majority/nearest); a volume counts as a
+probability if its name ends in _prob or its dtype is float (--kind
+overrides). Output keeps the relative layout under --out and is written with
+the original (dz, dy, dx) spacing; use an OME format (tiff-tiled / ome-zarr,
+the default is tiff-tiled) to have it stored in the file.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from catalog import Catalog  # noqa: E402
+from volume_io import STACK_FORMATS, VolumeReader, list_volumes, volume_name, volume_suffix, write_volume  # noqa: E402
+from zresample import iter_inverse_planes  # noqa: E402
+
+ID_SUFFIXES = ("_pred", "_prob", "_mask")
+
+
+def find_predictions(root: Path) -> List[Path]:
+    """Volumes directly under ``root`` and in its immediate subdirectories."""
+    found = [p for p in list_volumes(root) if p != root]
+    for sub in sorted(p for p in root.iterdir() if p.is_dir() and p.suffix != ".zarr"):
+        found.extend(list_volumes(sub))
+    return found
+
+
+def split_name(path: Path) -> Tuple[str, str]:
+    """(stack id, suffix) of a prediction volume, e.g. ("S01.ome", "_pred")."""
+    name = volume_name(path)
+    for suffix in ID_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)], suffix
+    return name, ""
+
+
+def inverse_mode(path: Path, dtype: np.dtype, args: argparse.Namespace) -> str:
+    kind = args.kind
+    if kind == "auto":
+        is_prob = split_name(path)[1] == "_prob" or np.issubdtype(dtype, np.floating)
+        kind = "prob" if is_prob else "mask"
+    return args.prob_mode if kind == "prob" else args.mask_mode
+
+
+def restore_one(path: Path, meta: dict, out_path: Path, args: argparse.Namespace) -> dict:
+    """Inverse-resample one prediction volume according to its prep meta record."""
+    z_original = int(meta["z_original"])
+    with VolumeReader(path) as reader:
+        z, y, x = reader.shape
+        if z != int(meta["z_resampled"]):
+            return {"path": str(path), "status": "skipped", "reason": f"z={z} != z_resampled={meta['z_resampled']}"}
+        mode = inverse_mode(path, reader.dtype, args)
+        write_volume(
+            out_path,
+            iter_inverse_planes(reader, z_original, mode),
+            (z_original, y, x),
+            reader.dtype,
+            fmt=args.stack_format,
+            spacing=(meta.get("dz_original"), meta.get("dy"), meta.get("dx")),
+            compression=args.compression,
+        )
+    return {
+        "path": str(path),
+        "status": "ok",
+        "id": meta["id"],
+        "mode": mode,
+        "z": [z, z_original],
+        "out": str(out_path),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Inverse z-resampling of predictions to the native stack grid")
+    ap.add_argument("--pred-root", required=True, help="Prediction volumes (or model subdirectories of them)")
+    ap.add_argument("--meta-root", required=True, help="Prep meta JSON directory (<stack id>.json)")
+    ap.add_argument("--out", required=True, help="Output root (mirrors --pred-root layout)")
+    ap.add_argument("--kind", choices=("auto", "prob", "mask"), default="auto")
+    ap.add_argument("--prob-mode", choices=("linear", "nearest"), default="linear")
+    ap.add_argument("--mask-mode", choices=("majority", "nearest"), default="majority")
+    ap.add_argument("--stack-format", choices=STACK_FORMATS, default="tiff-tiled")
+    ap.add_argument("--compression", default="zlib", help="Codec for --stack-format tiff-tiled")
+    ap.add_argument("--jobs", type=int, default=1, help="Volumes restored in parallel (threads)")
+    ap.add_argument("--catalog", default=None, help="Dataset catalog SQLite: record the native-grid predictions")
+    args = ap.parse_args()
+
+    pred_root = Path(args.pred_root)
+    meta_root = Path(args.meta_root)
+    out_root = Path(args.out)
+
+    metas: Dict[str, Optional[dict]] = {}
+    tasks: List[Tuple[Path, dict, Path]] = []
+    missing: List[str] = []
+    for path in find_predictions(pred_root):
+        sid, suffix = split_name(path)
+        if sid not in metas:
+            meta_path = meta_root / f"{sid}.json"
+            metas[sid] = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.is_file() else None
+        if metas[sid] is None:
+            missing.append(str(path))
+            continue
+        out_dir = out_root / path.parent.relative_to(pred_root)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        tasks.append((path, metas[sid], out_dir / f"{sid}{suffix}_native{volume_suffix(args.stack_format)}"))
+    if not tasks:
+        raise SystemExit(f"no prediction under {pred_root} has a meta JSON in {meta_root}")
+    for p in missing:
+        print(f"[WARN] no meta JSON for {p}")
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as ex:
+        results = list(ex.map(lambda t: restore_one(*t, args), tasks))
+    for r in results:
+        if r["status"] != "ok":
+            print(f"[WARN] {r['path']}: {r['reason']}")
+
+    if args.catalog:
+        with Catalog(Path(args.catalog)) as catalog:
+            catalog.add_artifacts(
+                (r["id"], "native_prediction", Path(r["out"]), {"mode": r["mode"], "source": r["path"]})
+                for r in results
+                if r["status"] == "ok"
+            )
+    ok = sum(r["status"] == "ok" for r in results)
+    print(f"[DONE] restored={ok} skipped={len(results) - ok} no_meta={len(missing)} -> {out_root}")
+
+
+if __name__ == "__main__":
+    main()
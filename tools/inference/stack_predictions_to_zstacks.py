@@ -1,5 +1,12 @@
 """
 Stack per-slice nnUNet predictions back into z-stacks and copy originals + preds to REVIEW.
+
+Model x stack assembly runs on a thread pool (--jobs); originals already present
+with the same size/mtime are skipped, and can be hardlinked (--link-originals).
+Prediction stacks can be written as tiled compressed OME-TIFF or OME-Zarr with
+spacing from the prep meta JSON (--stack-format). With --catalog, stack ids
+come from the meta artifacts recorded by the prep run instead of a glob, and
+the prediction stacks are recorded back as artifacts.
 """
 from __future__ import annotations
 
@@ -8,26 +15,118 @@ import json
 import os
 import re
 import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 import tifffile
 
-Z_RE = re.compile(r"_z(\d+)")
-
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from catalog import Catalog  # noqa: E402
+from volume_io import STACK_FORMATS, volume_suffix, write_volume  # noqa: E402
 
-def _sorted_by_z(files: List[Path]) -> List[Path]:
-    def _key(p: Path) -> int:
-        m = Z_RE.search(p.stem)
-        return int(m.group(1)) if m else -1
+SLICE_RE = re.compile(r"^(?P<sid>.+)_z(?P<z>\d+)\.tif$")
 
-    return sorted(files, key=_key)
 
+def index_slices(mdir: Path) -> Dict[str, List[Path]]:
+    """Group a model's per-slice predictions by stack id in one directory scan.
 
-def stack_slices(files: List[Path]) -> np.ndarray:
-    arrs = [tifffile.imread(f) for f in files]
-    return np.stack(arrs, axis=0)
+    Returns ``{sid: [slice paths sorted by z]}``.
+    """
+    groups: Dict[str, List[Tuple[int, Path]]] = {}
+    with os.scandir(mdir) as it:
+        for entry in it:
+            m = SLICE_RE.match(entry.name)
+            if m is None or not entry.is_file():
+                continue
+            groups.setdefault(m.group("sid"), []).append((int(m.group("z")), Path(entry.path)))
+    return {sid: [p for _, p in sorted(items)] for sid, items in groups.items()}
+
+
+def _iter_pages(files: List[Path], slice_shape: Tuple[int, ...]) -> Iterator[np.ndarray]:
+    for f in files:
+        arr = tifffile.imread(f)
+        if arr.shape != slice_shape:
+            raise ValueError(f"slice shape {arr.shape} != {slice_shape}: {f}")
+        yield from arr.reshape((-1, *slice_shape[-2:]))
+
+
+def stack_slices(
+    files: List[Path],
+    out_path: Path,
+    fmt: str = "tiff",
+    spacing: Optional[Tuple[float, float, float]] = None,
+    compression: str = "zlib",
+) -> Tuple[int, ...]:
+    """Write slices as one z-stack page by page; only one slice is held in memory.
+
+    With ``fmt="tiff"`` this produces the same file as
+    ``tifffile.imwrite(out_path, np.stack(slices), photometric="minisblack")``
+    (one page per slice, also for 3- or 4-slice stacks).
+    """
+    with tifffile.TiffFile(files[0]) as tf:
+        page = tf.series[0]
+        slice_shape = tuple(page.shape)
+        dtype = np.dtype(page.dtype)
+    shape = (len(files), *slice_shape)
+    if fmt != "tiff":
+        # chunked formats are strictly (z, y, x)
+        shape = (int(np.prod(shape[:-2])), *shape[-2:])
+    write_volume(
+        out_path,
+        _iter_pages(files, slice_shape),
+        shape,
+        dtype,
+        fmt=fmt,
+        spacing=spacing,
+        compression=compression,
+    )
+    return shape
+
+
+def _stack_spacing(meta_path: Path) -> Optional[Tuple[float, float, float]]:
+    """(dz, dy, dx) of the resampled grid from a prep meta JSON, if recorded."""
+    try:
+        meta = json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return None
+    return (meta.get("dz_target"), meta.get("dy"), meta.get("dx"))
+
+
+def sync_original(src: Path, dst: Path, link: bool = False) -> str:
+    """Bring ``dst`` up to date with ``src``; returns "skipped", "linked" or "copied".
+
+    A destination with the same size and mtime (copy2/copytree preserve mtime)
+    is left alone, so rebuilding a bundle does not recopy unchanged originals.
+    OME-Zarr directories are compared by mtime and always copied.
+    """
+    st = src.stat()
+    try:
+        dst_st = dst.stat()
+    except FileNotFoundError:
+        dst_st = None
+    if dst_st is not None and dst_st.st_mtime_ns == st.st_mtime_ns and (
+        src.is_dir() or dst_st.st_size == st.st_size
+    ):
+        return "skipped"
+    if dst.is_dir() and not dst.is_symlink():
+        shutil.rmtree(dst)
+    elif dst_st is not None or dst.is_symlink():
+        dst.unlink()
+    if src.is_dir():
+        shutil.copytree(src, dst)
+        return "copied"
+    if link:
+        try:
+            os.link(src, dst)
+            return "linked"
+        except OSError:
+            # e.g. review root on another filesystem
+            pass
+    shutil.copy2(src, dst)
+    return "copied"
 
 
 def main() -> None:
@@ -36,6 +135,24 @@ def main() -> None:
     ap.add_argument("--resampled-root", required=True, help="Resampled zstack root")
     ap.add_argument("--meta-root", required=True, help="Meta JSON root")
     ap.add_argument("--review-root", required=True, help="Review output root")
+    ap.add_argument(
+        "--stack-format",
+        choices=STACK_FORMATS,
+        default="tiff",
+        help="Prediction stack output: tiff (uncompressed), tiff-tiled (tiled, compressed OME-TIFF), ome-zarr",
+    )
+    ap.add_argument("--compression", default="zlib", help="Codec for --stack-format tiff-tiled")
+    ap.add_argument("--jobs", type=int, default=1, help="Threads for slice indexing, assembly and copies")
+    ap.add_argument(
+        "--link-originals",
+        action="store_true",
+        help="Hardlink original resampled stacks into REVIEW instead of copying",
+    )
+    ap.add_argument(
+        "--catalog",
+        default=None,
+        help="Dataset catalog SQLite: stack ids from its meta artifacts under --meta-root; predictions are recorded",
+    )
     args = ap.parse_args()
 
     outputs_root = Path(args.outputs_root)
@@ -48,40 +165,82 @@ def main() -> None:
     (review_root / "predictions").mkdir(parents=True, exist_ok=True)
 
     # Stack IDs from meta JSONs
-    stack_ids = sorted([p.stem for p in meta_root.glob("*.json")])
+    catalog = Catalog(Path(args.catalog)) if args.catalog else None
+    stack_ids: List[str] = []
+    if catalog is not None:
+        stack_ids = sorted({a["case_id"] for a in catalog.artifacts(kind="meta", under=meta_root)})
+    if not stack_ids:
+        stack_ids = sorted([p.stem for p in meta_root.glob("*.json")])
     if not stack_ids:
         raise SystemExit(f"No meta json found in {meta_root}")
+    spacings = {
+        sid: _stack_spacing(meta_root / f"{sid}.json") if args.stack_format != "tiff" else None
+        for sid in stack_ids
+    }
 
     # Copy original resampled stacks
+    resampled_files = sorted(p for p in resampled_root.iterdir() if p.suffix in {".tif", ".zarr"})
+    resampled_names = {p.name for p in resampled_files}
+    originals: List[Path] = []
     for sid in stack_ids:
         # prefer explicit dz0p396 naming if present
-        cand = resampled_root / f"{sid}_dz0p396.tif"
-        if not cand.exists():
-            # fallback: any tif containing sid
-            matches = list(resampled_root.glob(f"{sid}*.tif"))
+        explicit = [f"{sid}_dz0p396{suffix}" for suffix in (".tif", ".ome.zarr")]
+        cand = next((resampled_root / n for n in explicit if n in resampled_names), None)
+        if cand is None:
+            # fallback: any tif starting with sid
+            matches = [p for p in resampled_files if p.name.startswith(sid)]
             if matches:
                 cand = matches[0]
             else:
                 print(f"[WARN] Missing resampled stack for {sid}")
                 continue
-        shutil.copy2(cand, review_root / "original_zstacks" / cand.name)
-
-    # For each model output, stack predictions
-    model_dirs = sorted([p for p in outputs_root.iterdir() if p.is_dir()])
-    for mdir in model_dirs:
-        out_model_dir = review_root / "predictions" / mdir.name
-        out_model_dir.mkdir(parents=True, exist_ok=True)
-
-        for sid in stack_ids:
-            files = list(mdir.glob(f"{sid}_z*.tif"))
-            if not files:
-                print(f"[WARN] {mdir.name}: no slices for {sid}")
-                continue
-            files = _sorted_by_z(files)
-            stack = stack_slices(files)
-            out_path = out_model_dir / f"{sid}_pred.tif"
-            # minimal stack, keep uint8/uint16 as-is
-            tifffile.imwrite(out_path, stack)
+        originals.append(cand)
+
+    # TIFF decode/encode and file copies release the GIL, so threads are enough.
+    # ex.map keeps results (and warnings) in submission order.
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as ex:
+        synced = list(
+            ex.map(
+                lambda src: sync_original(
+                    src, review_root / "original_zstacks" / src.name, args.link_originals
+                ),
+                originals,
+            )
+        )
+
+        # For each model output, stack predictions
+        model_dirs = sorted([p for p in outputs_root.iterdir() if p.is_dir()])
+        indexes = list(ex.map(index_slices, model_dirs))
+
+        tasks: List[tuple] = []
+        task_ids: List[Tuple[str, str]] = []
+        for mdir, slices in zip(model_dirs, indexes):
+            out_model_dir = review_root / "predictions" / mdir.name
+            out_model_dir.mkdir(parents=True, exist_ok=True)
+            for sid in stack_ids:
+                files = slices.get(sid)
+                if not files:
+                    print(f"[WARN] {mdir.name}: no slices for {sid}")
+                    continue
+                # minimal stack, keep uint8/uint16 as-is
+                out_path = out_model_dir / f"{sid}_pred{volume_suffix(args.stack_format)}"
+                tasks.append((files, out_path, args.stack_format, spacings[sid], args.compression))
+                task_ids.append((sid, mdir.name))
+        list(ex.map(lambda task: stack_slices(*task), tasks))
+
+    if catalog is not None:
+        catalog.add_artifacts(
+            (sid, "prediction", task[1], {"model": model, "stack_format": args.stack_format})
+            for (sid, model), task in zip(task_ids, tasks)
+        )
+        catalog.close()
+
+    counts = {k: synced.count(k) for k in ("copied", "linked", "skipped")}
+    print(
+        "[INFO] originals "
+        + " ".join(f"{k}={v}" for k, v in counts.items())
+        + f"; prediction stacks={len(tasks)} from {len(model_dirs)} models"
+    )
 
     # Copy manifest for traceability
     manifest = outputs_root / ".." / "manifest_inference_dz0p396.json"
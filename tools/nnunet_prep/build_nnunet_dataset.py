@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Build nnUNet v2 2D pseudo-3D datasets from a raw/label pairs manifest.
+
+Replaces per-variant copies of prepare_nnunet_2d3ch.py. For each centre
+slice z the channels are planes z-k..z+k (2k+1 channels) and the label is
+annotation plane z. Edge handling (--pad / variant "pad"):
+- drop:  only centres with a full window (prepare_nnunet_2d3ch.py behaviour)
+- clamp: every plane is a centre, edge windows repeat the first/last plane
+
+Each pair is streamed plane by plane (never loaded whole) and every raw and
+label plane is written once to a plane store shared by all variants;
+imagesTr/labelsTr entries are hardlinks (or symlinks/copies, --layout) into
+it. A pair whose sources are unchanged since the last build is not re-read.
+Pairs run on a process pool and all manifest variants are built per pair in
+one pass, so Dataset001-005 come from a single command:
+
+  python tools/nnunet_prep/build_nnunet_dataset.py \
+      --manifest tools/nnunet_prep/manifests/myelin_20241206.json --workers 4
+
+Case ids stay `<pair id>_z<centre:03d>` as before, so existing splits apply.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from slice_layout import (  # noqa: E402
+    LAYOUTS,
+    PAD_POLICIES,
+    atomic_target,
+    channel_window_targets,
+    link_plane,
+    window_centers,
+    write_plane,
+)
+from volume_io import VolumeReader  # noqa: E402
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+STORE_VERSION = 1
+
+
+def dataset_dir_name(variant: dict, dataset_name: str) -> str:
+    return f"Dataset{variant['dataset_id']}_{dataset_name}{variant.get('suffix', '')}"
+
+
+def channel_names(k: int) -> Dict[str, str]:
+    return {str(i): ("slice_0" if off == 0 else f"slice_{off:+d}") for i, off in enumerate(range(-k, k + 1))}
+
+
+def _source_fp(path: Path) -> dict:
+    st = path.stat()
+    return {"path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _raw_plane(store: Path, pid: str, j: int) -> Path:
+    return store / pid / f"raw_p{j:03d}.tif"
+
+
+def _label_plane(store: Path, pid: str, j: int) -> Path:
+    return store / pid / f"label_p{j:03d}.tif"
+
+
+def fill_store(pid: str, raw_path: Path, label_path: Path, store: Path) -> Tuple[int, bool]:
+    """Write raw/label planes of one pair to the plane store; returns (z, reused).
+
+    The label stack is aligned to the raw depth as before: missing planes are
+    zeros, extra planes are dropped.
+    """
+    meta_path = store / pid / "store.json"
+    fp = {"v": STORE_VERSION, "raw": _source_fp(raw_path), "label": _source_fp(label_path)}
+    if meta_path.is_file():
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        z = int(meta.get("z", -1))
+        if meta.get("fp") == fp and all(
+            _raw_plane(store, pid, j).is_file() and _label_plane(store, pid, j).is_file() for j in range(z)
+        ):
+            return z, True
+        meta_path.unlink()
+
+    (store / pid).mkdir(parents=True, exist_ok=True)
+    with VolumeReader(raw_path) as raw, VolumeReader(label_path) as ann:
+        z = raw.shape[0]
+        for j in range(z):
+            write_plane(_raw_plane(store, pid, j), raw.read(j))
+            label = ann.read(j) if j < ann.shape[0] else np.zeros(ann.shape[1:], dtype=ann.dtype)
+            write_plane(_label_plane(store, pid, j), label)
+    # written last: a store without it is rebuilt on the next run
+    with atomic_target(meta_path) as tmp:
+        tmp.write_text(json.dumps({"fp": fp, "z": z}, indent=2), encoding="utf-8")
+    return z, False
+
+
+def place(src: Path, dst: Path, layout: str) -> None:
+    if layout == "copy":
+        with atomic_target(dst) as tmp:
+            shutil.copy2(src, tmp)
+    else:
+        link_plane(src, dst, layout)
+
+
+def build_pair(task: tuple) -> Tuple[str, Dict[str, int], bool]:
+    """Fill the store for one pair and link its cases into every variant; returns case counts per variant."""
+    pid, raw_path, label_path, store, layout, variants = task
+    z, reused = fill_store(pid, Path(raw_path), Path(label_path), Path(store))
+    counts: Dict[str, int] = {}
+    for out_dir, k, pad in variants:
+        images, labels = Path(out_dir) / "imagesTr", Path(out_dir) / "labelsTr"
+        for j, cases in enumerate(channel_window_targets(z, k, pad)):
+            src = _raw_plane(Path(store), pid, j)
+            for centre, ch in cases:
+                place(src, images / f"{pid}_z{centre:03d}_{ch:04d}.tif", layout)
+        centres = window_centers(z, k, pad)
+        for centre in centres:
+            place(_label_plane(Path(store), pid, centre), labels / f"{pid}_z{centre:03d}.tif", layout)
+        counts[out_dir] = len(centres)
+    return pid, counts, reused
+
+
+def write_dataset_json(out_dir: Path, dataset_name: str, k: int, n_cases: int, description: str) -> None:
+    dataset_json = {
+        "name": dataset_name,
+        "description": description,
+        "tensorImageSize": "2D",
+        "reference": "",
+        "licence": "",
+        "release": "",
+        "channel_names": channel_names(k),
+        "labels": {
+            "background": 0,
+            "myelin": 1,
+        },
+        "numTraining": n_cases,
+        "numTest": 0,
+        "file_ending": ".tif",
+    }
+    with open(out_dir / "dataset.json", "w", encoding="utf-8") as f:
+        json.dump(dataset_json, f, indent=2)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Build nnUNet 2D pseudo-3D datasets from a pairs manifest")
+    ap.add_argument("--manifest", required=True, help="JSON with dataset_name, pairs [{id, raw, label}], variants")
+    ap.add_argument("--project-root", default=str(PROJECT_ROOT), help="Base for relative manifest paths")
+    ap.add_argument("--nnunet-raw", default=None, help="Default: $nnUNet_raw or <project>/data/00_raw/nnUNet_raw")
+    ap.add_argument("--store", default=None, help="Plane store (default: <nnunet-raw>/_plane_store)")
+    ap.add_argument("--variants", nargs="*", default=None, help="Dataset ids to build (default: all in manifest)")
+    ap.add_argument("--dataset-id", default=None, help="Build one ad-hoc variant instead of the manifest ones")
+    ap.add_argument("--suffix", default="", help="Dataset name suffix for --dataset-id, e.g. _5ch")
+    ap.add_argument("--k", type=int, default=1, help="Half window for --dataset-id (channels = 2k+1)")
+    ap.add_argument("--pad", choices=PAD_POLICIES, default="drop", help="Edge policy for --dataset-id")
+    ap.add_argument("--layout", choices=LAYOUTS, default="hardlink")
+    ap.add_argument("--clean", action="store_true", help="Remove existing imagesTr/labelsTr of built variants first")
+    ap.add_argument("--workers", type=int, default=1)
+    args = ap.parse_args()
+
+    root = Path(args.project_root)
+    manifest_path = Path(args.manifest)
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    dataset_name = manifest["dataset_name"]
+    nnunet_raw = Path(args.nnunet_raw or os.environ.get("nnUNet_raw") or root / "data/00_raw/nnUNet_raw")
+    store = Path(args.store) if args.store else nnunet_raw / "_plane_store"
+
+    if args.dataset_id:
+        variants = [{"dataset_id": args.dataset_id, "suffix": args.suffix, "k": args.k, "pad": args.pad}]
+    else:
+        variants = manifest.get("variants", [])
+        if args.variants:
+            variants = [v for v in variants if v["dataset_id"] in set(args.variants)]
+    if not variants:
+        print("No variants to build", file=sys.stderr)
+        return 1
+
+    pairs: List[Tuple[str, Path, Path]] = []
+    for pair in manifest["pairs"]:
+        raw_path, label_path = Path(pair["raw"]), Path(pair["label"])
+        pairs.append(
+            (
+                pair["id"],
+                raw_path if raw_path.is_absolute() else root / raw_path,
+                label_path if label_path.is_absolute() else root / label_path,
+            )
+        )
+    missing = [str(p) for _, r, lab in pairs for p in (r, lab) if not p.is_file()]
+    if missing:
+        print("Missing inputs:\n  " + "\n  ".join(missing), file=sys.stderr)
+        return 1
+
+    specs: List[Tuple[str, int, str]] = []
+    for v in variants:
+        k, pad = int(v["k"]), v.get("pad", "drop")
+        if pad not in PAD_POLICIES:
+            raise ValueError(f"variant {v['dataset_id']}: unknown pad policy {pad!r}")
+        out_dir = nnunet_raw / dataset_dir_name(v, dataset_name)
+        for sub in ("imagesTr", "labelsTr"):
+            if args.clean and (out_dir / sub).exists():
+                shutil.rmtree(out_dir / sub)
+            (out_dir / sub).mkdir(parents=True, exist_ok=True)
+        specs.append((str(out_dir), k, pad))
+
+    tasks = [(pid, str(r), str(lab), str(store), args.layout, specs) for pid, r, lab in pairs]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            results = list(ex.map(build_pair, tasks))
+    else:
+        results = [build_pair(t) for t in tasks]
+
+    n_reused = sum(int(reused) for _, _, reused in results)
+    for v, (out_dir, k, pad) in zip(variants, specs):
+        n_cases = sum(counts[out_dir] for _, counts, _ in results)
+        description = v.get(
+            "description",
+            f"Myelin confocal pseudo-3D 2D dataset ({2 * k + 1}-channel sliding window"
+            + (", edge-clamped)" if pad == "clamp" and k else ")"),
+        )
+        write_dataset_json(Path(out_dir), dataset_name, k, n_cases, description)
+        print(f"Prepared {n_cases} training cases in {out_dir} (k={k}, pad={pad}, layout={args.layout})")
+    print(f"pairs={len(results)} (store reused={n_reused}) store={store}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Cached per-case label/intensity index of an nnUNet dataset.
+
+For every labelsTr case: foreground fraction, foreground pixels, 2D skeleton
+length (pixels) and centre-channel intensity statistics (mean/std over the
+image and over the foreground). Entries are keyed by case id and stamped
+with the label and image (size, mtime_ns), so rebuilding only rereads
+changed cases; unchanged datasets are served from <dataset>/label_index.json
+without touching any TIFF.
+
+Changed cases are read in batches; same-shape planes are stacked so the
+per-case reductions run as single vectorized calls per batch.
+
+Usage:
+  python tools/nnunet_prep/label_index.py --dataset-dir <nnUNet_raw>/Dataset001_... --workers 8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import tifffile as tiff
+from skimage.morphology import skeletonize
+
+INDEX_NAME = "label_index.json"
+INDEX_VERSION = 1
+STAT_KEYS = ("fg_fraction", "fg_pixels", "skeleton_len", "img_mean", "img_std", "fg_mean")
+BATCH = 256
+
+
+def centre_channel(dataset_dir: Path) -> int:
+    """Index of the centre (slice_0) channel from dataset.json (0 if unknown)."""
+    try:
+        names = json.loads((dataset_dir / "dataset.json").read_text(encoding="utf-8"))["channel_names"]
+    except (OSError, ValueError, KeyError):
+        return 0
+    for idx, name in names.items():
+        if name == "slice_0":
+            return int(idx)
+    return len(names) // 2
+
+
+def _stamp(path: Path) -> Optional[List[int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _stats_batch(labels: np.ndarray, images: Optional[np.ndarray]) -> List[Dict[str, float]]:
+    """Stats of a (n, y, x) batch of same-shape label planes (+ centre-channel images)."""
+    fg = labels > 0
+    n_px = fg.shape[1] * fg.shape[2]
+    fg_pixels = fg.reshape(len(fg), -1).sum(axis=1)
+    skel = np.array([np.count_nonzero(skeletonize(p)) if p.any() else 0 for p in fg])
+    out = {
+        "fg_fraction": fg_pixels / n_px,
+        "fg_pixels": fg_pixels,
+        "skeleton_len": skel,
+    }
+    if images is not None:
+        img = images.reshape(len(images), -1).astype(np.float64)
+        fg_flat = fg.reshape(len(fg), -1)
+        fg_sum = np.where(fg_flat, img, 0.0).sum(axis=1)
+        out["img_mean"] = img.mean(axis=1)
+        out["img_std"] = img.std(axis=1)
+        out["fg_mean"] = np.divide(fg_sum, fg_pixels, out=np.full(len(img), np.nan), where=fg_pixels > 0)
+    return [{k: float(v[i]) for k, v in out.items()} for i in range(len(fg))]
+
+
+def _index_chunk(items: List[Tuple[str, str, Optional[str]]]) -> Dict[str, Dict[str, float]]:
+    by_shape: Dict[tuple, List[Tuple[str, np.ndarray, Optional[np.ndarray]]]] = {}
+    for case, label_path, image_path in items:
+        lab = tiff.imread(label_path)
+        img = tiff.imread(image_path) if image_path else None
+        if img is not None and img.shape != lab.shape:
+            img = None
+        by_shape.setdefault((lab.shape, img is not None), []).append((case, lab, img))
+    result: Dict[str, Dict[str, float]] = {}
+    for (_, has_img), group in by_shape.items():
+        labels = np.stack([g[1] for g in group])
+        images = np.stack([g[2] for g in group]) if has_img else None
+        for (case, _, _), stats in zip(group, _stats_batch(labels, images)):
+            result[case] = stats
+    return result
+
+
+def load_index(dataset_dir: Path) -> Dict[str, dict]:
+    path = dataset_dir / INDEX_NAME
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data.get("cases", {}) if data.get("v") == INDEX_VERSION else {}
+
+
+def build_index(dataset_dir: Path, workers: int = 1) -> Tuple[Dict[str, dict], int]:
+    """Up-to-date index for all labelsTr cases; returns (cases, number re-read)."""
+    dataset_dir = Path(dataset_dir)
+    old = load_index(dataset_dir)
+    ch = centre_channel(dataset_dir)
+    entries: Dict[str, dict] = {}
+    todo: List[Tuple[str, str, Optional[str]]] = []
+    with os.scandir(dataset_dir / "labelsTr") as it:
+        label_files = sorted(e.path for e in it if e.name.endswith(".tif") and not e.name.startswith("."))
+    for label_path in label_files:
+        case = Path(label_path).stem
+        image_path = dataset_dir / "imagesTr" / f"{case}_{ch:04d}.tif"
+        stamp = {"label": _stamp(Path(label_path)), "image": _stamp(image_path)}
+        prev = old.get(case)
+        if prev is not None and prev.get("stamp") == stamp:
+            entries[case] = prev
+            continue
+        entries[case] = {"stamp": stamp}
+        todo.append((case, label_path, str(image_path) if stamp["image"] else None))
+
+    chunks = [todo[i : i + BATCH] for i in range(0, len(todo), BATCH)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_index_chunk, chunks))
+    else:
+        results = [_index_chunk(c) for c in chunks]
+    for res in results:
+        for case, stats in res.items():
+            entries[case].update(stats)
+
+    if todo or set(old) != set(entries):
+        path = dataset_dir / INDEX_NAME
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(
+            json.dumps({"v": INDEX_VERSION, "centre_channel": ch, "cases": entries}, indent=1), encoding="utf-8"
+        )
+        os.replace(tmp, path)
+    return entries, len(todo)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Build/refresh the cached per-case label index of an nnUNet dataset")
+    ap.add_argument("--dataset-dir", required=True)
+    ap.add_argument("--workers", type=int, default=1)
+    args = ap.parse_args()
+    entries, n_read = build_index(Path(args.dataset_dir), args.workers)
+    fg = np.array([e.get("fg_fraction", np.nan) for e in entries.values()])
+    print(
+        f"cases={len(entries)} reread={n_read} fg_fraction_mean={np.nanmean(fg) if len(fg) else float('nan'):.4f} "
+        f"index={Path(args.dataset_dir) / INDEX_NAME}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
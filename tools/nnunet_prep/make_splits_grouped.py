@@ -1,22 +1,39 @@
 #!/usr/bin/env python3
-"""Create grouped train/val split (by stack/animal/batch) for nnUNet dataset."""
+"""Create grouped train/val split (by stack/animal/batch) for nnUNet dataset.
+
+With N_SPLITS >= number of stacks every stack is its own validation fold
+(leave-one-stack-out). With more stacks than folds, stacks are assigned to
+N_SPLITS folds so that the folds match in case count and in the summed
+per-case statistics of label_index.py (foreground fraction, skeleton length,
+centre-channel intensity). The index is cached in the dataset dir and only
+changed label/image files are re-read.
+"""
 from __future__ import annotations
 
+import argparse
 import json
 import random
 import re
+import sys
 from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from label_index import build_index  # noqa: E402
 
 
 DATASET_DIR = Path("/home/dilgerlab/Siqi/myelin-benchmark/data/00_raw/nnUNet_raw/Dataset001_20241206_MyelinConfData")
 PREPROCESSED_DIR = Path("/home/dilgerlab/Siqi/myelin-benchmark/data/04_processed/nnUNet_preprocessed/Dataset001_20241206_MyelinConfData")
 SPLITS_DIR = Path("/home/dilgerlab/Siqi/myelin-benchmark/data/05_splits")
-SPLITS_DIR.mkdir(parents=True, exist_ok=True)
 
 SEED = 42
 TRAIN_RATIO = 0.8
 N_SPLITS = 4  # use leave-one-stack-out when N_SPLITS >= number of stacks
 EXCLUDE_FROM_VAL = set()
+BALANCE_FEATURES = ("fg_fraction", "skeleton_len", "img_mean")
+RESTARTS = 16
 
 
 def case_to_group(case_id: str) -> str:
@@ -24,17 +41,122 @@ def case_to_group(case_id: str) -> str:
     return m.group(1) if m else case_id
 
 
-def main() -> None:
-    labels = sorted((DATASET_DIR / "labelsTr").glob("*.tif"))
-    case_ids = [p.stem for p in labels]
+def group_features(groups: Dict[str, List[str]], group_ids: Sequence[str], index: Dict[str, dict]) -> np.ndarray:
+    """(n_groups, 1 + n_features): case count and per-feature sums over the group's cases."""
+    feats = np.zeros((len(group_ids), 1 + len(BALANCE_FEATURES)))
+    for i, g in enumerate(group_ids):
+        rows = np.array([[index.get(c, {}).get(k, np.nan) for k in BALANCE_FEATURES] for c in groups[g]], dtype=float)
+        feats[i, 0] = len(groups[g])
+        feats[i, 1:] = np.nansum(rows.reshape(len(groups[g]), -1), axis=0)
+    return feats
+
+
+def _cost(sums: np.ndarray, target: np.ndarray) -> float:
+    return float((((sums - target) / target) ** 2).sum())
+
+
+def balanced_folds(feats: np.ndarray, n_folds: int, rng: random.Random) -> Tuple[List[int], float]:
+    """Assign groups to n_folds folds minimising the relative deviation of fold sums from the mean.
+
+    Greedy largest-group-first placement followed by single moves and pairwise
+    swaps until no improvement; the best of RESTARTS shuffled tie orders wins.
+    """
+    n = len(feats)
+    keep = feats.sum(axis=0) > 0
+    feats = feats[:, keep]
+    target = feats.sum(axis=0) / n_folds
+    best: Tuple[List[int], float] = ([], float("inf"))
+    for _ in range(RESTARTS):
+        jitter = [rng.random() for _ in range(n)]
+        order = sorted(range(n), key=lambda i: (-feats[i, 0], jitter[i]))
+        assign = [0] * n
+        sums = np.zeros((n_folds, feats.shape[1]))
+        for pos, i in enumerate(order):
+            empty = [f for f in range(n_folds) if not sums[f, 0]]
+            choices = empty if len(empty) >= n - pos else range(n_folds)
+            f = min(choices, key=lambda f: _cost(sums[f] + feats[i], target) - _cost(sums[f], target))
+            assign[i] = f
+            sums[f] += feats[i]
+
+        improved = True
+        while improved:
+            improved = False
+            for i in range(n):
+                a = assign[i]
+                if sum(1 for x in assign if x == a) == 1:
+                    continue
+                base = _cost(sums[a], target)
+                for b in range(n_folds):
+                    if b == a:
+                        continue
+                    delta = (
+                        _cost(sums[a] - feats[i], target)
+                        + _cost(sums[b] + feats[i], target)
+                        - base
+                        - _cost(sums[b], target)
+                    )
+                    if delta < -1e-12:
+                        sums[a] -= feats[i]
+                        sums[b] += feats[i]
+                        assign[i] = b
+                        improved = True
+                        break
+            for i in range(n):
+                for j in range(i + 1, n):
+                    a, b = assign[i], assign[j]
+                    if a == b:
+                        continue
+                    d = feats[i] - feats[j]
+                    delta = (
+                        _cost(sums[a] - d, target)
+                        + _cost(sums[b] + d, target)
+                        - _cost(sums[a], target)
+                        - _cost(sums[b], target)
+                    )
+                    if delta < -1e-12:
+                        sums[a] -= d
+                        sums[b] += d
+                        assign[i], assign[j] = b, a
+                        improved = True
+        cost = _cost(sums, target)
+        if cost < best[1]:
+            best = (list(assign), cost)
+    return best
+
+
+def fold_stats(cases: Sequence[str], index: Dict[str, dict]) -> Dict[str, float]:
+    out: Dict[str, float] = {"n_cases": len(cases)}
+    for k in BALANCE_FEATURES:
+        vals = np.array([index.get(c, {}).get(k, np.nan) for c in cases], dtype=float)
+        out[f"{k}_mean"] = round(float(np.nanmean(vals)), 6) if np.isfinite(vals).any() else None
+    return out
+
 
-    groups = {}
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Create stack-grouped nnUNet splits")
+    ap.add_argument("--dataset-dir", default=str(DATASET_DIR))
+    ap.add_argument("--preprocessed-dir", default=str(PREPROCESSED_DIR))
+    ap.add_argument("--splits-dir", default=str(SPLITS_DIR))
+    ap.add_argument("--n-splits", type=int, default=N_SPLITS)
+    ap.add_argument("--seed", type=int, default=SEED)
+    ap.add_argument("--workers", type=int, default=1, help="Processes for (re)indexing changed label files")
+    args = ap.parse_args()
+
+    dataset_dir = Path(args.dataset_dir)
+    preprocessed_dir = Path(args.preprocessed_dir)
+    splits_dir = Path(args.splits_dir)
+    splits_dir.mkdir(parents=True, exist_ok=True)
+    n_splits = args.n_splits
+
+    index, n_reread = build_index(dataset_dir, args.workers)
+    case_ids = sorted(index)
+
+    groups: Dict[str, List[str]] = {}
     for cid in case_ids:
-        g = case_to_group(cid)
-        groups.setdefault(g, []).append(cid)
+        groups.setdefault(case_to_group(cid), []).append(cid)
 
     group_ids = sorted(groups.keys())
-    rng = random.Random(SEED)
+    rng = random.Random(args.seed)
     rng.shuffle(group_ids)
 
     n_groups = len(group_ids)
@@ -43,55 +165,61 @@ def main() -> None:
     if len(candidates) == 0:
         raise RuntimeError("No candidates available for validation split after exclusions.")
 
-    splits = []
-    fold_groups = []
-    if N_SPLITS >= n_groups:
+    if n_splits >= n_groups:
         # leave-one-stack-out
-        for val_group in group_ids:
-            if val_group in EXCLUDE_FROM_VAL:
-                continue
-            train_groups = [g for g in group_ids if g != val_group]
-            train_ids = sorted([cid for cid in case_ids if case_to_group(cid) in train_groups])
-            val_ids = sorted([cid for cid in case_ids if case_to_group(cid) == val_group])
-            splits.append({"train": train_ids, "val": val_ids})
-            fold_groups.append({"train_stacks": train_groups, "val_stacks": [val_group]})
+        strategy = "leave_one_stack_out"
+        val_folds = [[g] for g in group_ids if g not in EXCLUDE_FROM_VAL]
+        balance_cost = None
     else:
-        n_train = max(1, int(round(n_groups * TRAIN_RATIO)))
-        rng.shuffle(group_ids)
-        val_group = rng.choice(candidates)
-        val_groups = {val_group}
-        train_groups = set([g for g in group_ids if g != val_group])
-        train_ids = sorted([cid for cid in case_ids if case_to_group(cid) in train_groups])
-        val_ids = sorted([cid for cid in case_ids if case_to_group(cid) in val_groups])
-        splits = [{"train": train_ids, "val": val_ids}]
-        fold_groups = [{"train_stacks": sorted(train_groups), "val_stacks": sorted(val_groups)}]
-
-    with open(DATASET_DIR / "splits_final.json", "w", encoding="utf-8") as f:
+        strategy = "balanced_kfold"
+        n_folds = min(n_splits, len(candidates))
+        assign, balance_cost = balanced_folds(group_features(groups, candidates, index), n_folds, rng)
+        val_folds = [sorted(g for g, f in zip(candidates, assign) if f == fold) for fold in range(n_folds)]
+
+    splits = []
+    fold_groups = []
+    for val_groups in val_folds:
+        train_groups = [g for g in group_ids if g not in val_groups]
+        train_ids = sorted(cid for g in train_groups for cid in groups[g])
+        val_ids = sorted(cid for g in val_groups for cid in groups[g])
+        splits.append({"train": train_ids, "val": val_ids})
+        fold_groups.append(
+            {
+                "train_stacks": train_groups if strategy == "leave_one_stack_out" else sorted(train_groups),
+                "val_stacks": val_groups,
+                "val_stats": fold_stats(val_ids, index),
+            }
+        )
+
+    with open(dataset_dir / "splits_final.json", "w", encoding="utf-8") as f:
         json.dump(splits, f, indent=2)
 
-    if PREPROCESSED_DIR.exists():
-        with open(PREPROCESSED_DIR / "splits_final.json", "w", encoding="utf-8") as f:
+    if preprocessed_dir.exists():
+        with open(preprocessed_dir / "splits_final.json", "w", encoding="utf-8") as f:
             json.dump(splits, f, indent=2)
 
-    with open(SPLITS_DIR / "nnunet_Dataset001_20241206_MyelinConfData_splits.json", "w", encoding="utf-8") as f:
-        json.dump({"train": train_ids, "val": val_ids}, f, indent=2)
+    with open(splits_dir / "nnunet_Dataset001_20241206_MyelinConfData_splits.json", "w", encoding="utf-8") as f:
+        json.dump(splits[-1], f, indent=2)
 
-    with open(SPLITS_DIR / "nnunet_Dataset001_20241206_MyelinConfData_splits_stacks.json", "w", encoding="utf-8") as f:
+    with open(splits_dir / "nnunet_Dataset001_20241206_MyelinConfData_splits_stacks.json", "w", encoding="utf-8") as f:
         json.dump(
             {
-                "seed": SEED,
+                "seed": args.seed,
                 "train_ratio": TRAIN_RATIO,
-                "n_splits": N_SPLITS,
+                "n_splits": n_splits,
                 "exclude_from_val": sorted(EXCLUDE_FROM_VAL),
                 "n_stacks": n_groups,
+                "strategy": strategy,
+                "balance_features": ["n_cases", *BALANCE_FEATURES],
+                "balance_cost": balance_cost,
                 "folds": fold_groups,
             },
             f,
             indent=2,
         )
 
-    print(f"Stacks total: {n_groups}, folds: {len(splits)}")
-    print(f"Cases total: {len(case_ids)}")
+    print(f"Stacks total: {n_groups}, folds: {len(splits)} ({strategy})")
+    print(f"Cases total: {len(case_ids)} (label index re-read: {n_reread})")
 
 
 if __name__ == "__main__":